@@ -0,0 +1,63 @@
+from __future__ import absolute_import, division, print_function
+
+import os
+import resource
+import timeit
+
+import numpy as np
+
+from bigarray import MmapArray, MmapArrayWriter
+
+mmap_path = '/tmp/tmp.mmap'
+
+N = 200000
+N_READS = 20000
+X = np.random.rand(N, 256).astype('float32')
+print("Array size: %.2f (MB)\n" % (X.nbytes / 1024 / 1024))
+
+with MmapArrayWriter(mmap_path,
+                     dtype='float32',
+                     shape=(0,) + X.shape[1:],
+                     remove_exist=True) as f:
+  f.write(X)
+del X
+
+
+def drop_page_cache():
+  if hasattr(os, 'posix_fadvise'):
+    fd = os.open(mmap_path, os.O_RDONLY)
+    os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    os.close(fd)
+
+
+def benchmark(access_pattern, order_name, order):
+  drop_page_cache()
+  x = MmapArray(mmap_path, mode='r', access_pattern=access_pattern)
+  usage = resource.getrusage(resource.RUSAGE_SELF)
+  start = timeit.default_timer()
+  total = 0.
+  for i in order:
+    total += x[i, 0]
+  duration = timeit.default_timer() - start
+  new_usage = resource.getrusage(resource.RUSAGE_SELF)
+  print('%-10s %-10s: %.4f s  minor faults: %-8d major faults: %d' %
+        (access_pattern, order_name, duration,
+         new_usage.ru_minflt - usage.ru_minflt,
+         new_usage.ru_majflt - usage.ru_majflt))
+  del x
+
+
+orders = [
+    ('random', np.random.randint(0, N, size=N_READS)),
+    ('sequential', np.arange(0, N, N // N_READS)),
+]
+for order_name, order in orders:
+  for access_pattern in ('normal', 'random', 'sequential', 'willneed'):
+    benchmark(access_pattern, order_name, order)
+  print()
+
+# ===========================================================================
+# Clean-up
+# ===========================================================================
+if os.path.exists(mmap_path):
+  os.remove(mmap_path)
@@ -0,0 +1,86 @@
+from __future__ import absolute_import, division, print_function
+
+import asyncio
+import os
+import timeit
+
+import numpy as np
+
+from bigarray import MmapArray, MmapArrayWriter, get_aio_stats
+
+path = '/tmp/tmp.aio_read'
+
+N_ROWS = 200000
+N_FEATURES = 512  # 400MB of float32
+N_CLIENTS = 64  # concurrent coroutines
+N_REQUESTS = 50  # requests of each client
+N_ROWS_PER_REQUEST = 32
+
+
+def drop_cache():
+  fd = os.open(path, os.O_RDONLY)
+  os.fsync(fd)
+  os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+  os.close(fd)
+
+
+with MmapArrayWriter(path, (None, N_FEATURES), 'float32',
+                     remove_exist=True) as f:
+  for i in range(0, N_ROWS, 10000):
+    f.write(np.random.rand(10000, N_FEATURES).astype('float32'))
+x = MmapArray(path, mode='r')
+
+
+async def read_sync(start):
+  return np.array(x[start:start + N_ROWS_PER_REQUEST])
+
+
+async def read_async(start):
+  return await x.aread(slice(start, start + N_ROWS_PER_REQUEST))
+
+
+async def run(read):
+  latencies = []
+  lags = []
+  is_done = False
+
+  async def client(starts):
+    for start in starts:
+      begin = timeit.default_timer()
+      await read(start)
+      latencies.append(timeit.default_timer() - begin)
+
+  async def ticker():
+    # the delay of the event loop to wake up a sleeping task
+    while not is_done:
+      begin = timeit.default_timer()
+      await asyncio.sleep(0.001)
+      lags.append(timeit.default_timer() - begin - 0.001)
+
+  rand = np.random.RandomState(8)
+  starts = rand.randint(0,
+                        N_ROWS - N_ROWS_PER_REQUEST,
+                        size=(N_CLIENTS, N_REQUESTS)).tolist()
+  tick = asyncio.ensure_future(ticker())
+  begin = timeit.default_timer()
+  await asyncio.gather(*[client(s) for s in starts])
+  duration = timeit.default_timer() - begin
+  is_done = True
+  await tick
+  return np.array(latencies) * 1000, np.array(lags) * 1000, duration
+
+
+for name, read in (('blocking slice', read_sync), ('aread', read_async)):
+  drop_cache()
+  latencies, lags, duration = asyncio.run(run(read))
+  print('%-14s: %.2f req/s  latency p50 %.2f ms  p99 %.2f ms  '
+        'loop lag p99 %.2f ms  max %.2f ms' %
+        (name, latencies.shape[0] / duration, np.percentile(latencies, 50),
+         np.percentile(latencies, 99), np.percentile(lags, 99), np.max(lags)))
+print(get_aio_stats())
+
+# ===========================================================================
+# Clean-up
+# ===========================================================================
+del x
+os.remove(path)
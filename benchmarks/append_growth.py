@@ -0,0 +1,48 @@
+from __future__ import absolute_import, division, print_function
+
+import os
+import timeit
+
+import numpy as np
+
+from bigarray import MmapArrayWriter
+
+mmap_path = '/tmp/tmp.mmap'
+
+N_APPEND = 20000
+BATCH = 8
+REPORT = 4000
+X = np.random.rand(BATCH, 25, 16).astype('float32')
+print("Appending %d batches of shape %s\n" % (N_APPEND, str(X.shape)))
+
+
+def benchmark(name, **kwargs):
+  mmap = MmapArrayWriter(mmap_path,
+                         dtype='float32',
+                         shape=(0,) + X.shape[1:],
+                         remove_exist=True,
+                         **kwargs)
+  start = timeit.default_timer()
+  last = start
+  for i in range(1, N_APPEND + 1):
+    mmap.write(X)
+    # cost per append in each window, should stay flat for amortized growth
+    if i % REPORT == 0:
+      now = timeit.default_timer()
+      print('%-18s rows=%-8d %.2f (us/append)' %
+            (name, mmap.shape[0], (now - last) / REPORT * 1e6))
+      last = now
+  mmap.flush()
+  mmap.close()
+  print('%-18s total: %.4f s\n' % (name, timeit.default_timer() - start))
+
+
+benchmark('exact')
+benchmark('geometric (x2)', growth_factor=2.0)
+benchmark('chunked (65536)', growth_chunk=65536)
+
+# ===========================================================================
+# Clean-up
+# ===========================================================================
+if os.path.exists(mmap_path):
+  os.remove(mmap_path)
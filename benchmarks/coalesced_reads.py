@@ -0,0 +1,84 @@
+from __future__ import absolute_import, division, print_function
+
+import gc
+import os
+import timeit
+
+import numpy as np
+
+from bigarray import MmapArray, MmapArrayWriter, PointerArray, \
+  PointerArrayWriter, mmap_array
+
+path = '/tmp/tmp.coalesced'
+
+N_ROWS = 1000000
+N_FEATURES = 64  # 256MB of float32
+N_REPEAT = 5
+
+
+def drop_cache():
+  fd = os.open(path, os.O_RDONLY)
+  os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+  os.close(fd)
+
+
+def open_cold(cls):
+  # the pages mapped by the process are not dropped by the kernel
+  mmap_array._POOL.clear()
+  gc.collect()
+  drop_cache()
+  return cls(path, mode='r')
+
+
+def benchmark(name, cls, fn):
+  for coalesce in (False, True):
+    mmap_array.COALESCE_READS = coalesce
+    cold = []
+    x = None
+    for _ in range(N_REPEAT):
+      x = None
+      x = open_cold(cls)
+      start = timeit.default_timer()
+      fn(x)
+      cold.append(timeit.default_timer() - start)
+    start = timeit.default_timer()
+    for _ in range(N_REPEAT):
+      fn(x)
+    hot = (timeit.default_timer() - start) / N_REPEAT
+    del x
+    print('%-28s coalesce=%-5s: cold %8.2f ms  hot %7.3f ms' %
+          (name, coalesce, np.median(cold) * 1000, hot * 1000))
+
+
+# ====== rows ====== #
+with MmapArrayWriter(path, (None, N_FEATURES), 'float32',
+                     remove_exist=True) as f:
+  for i in range(0, N_ROWS, 100000):
+    f.write(np.random.rand(100000, N_FEATURES).astype('float32'))
+rand = np.random.RandomState(8)
+for n, spread in ((4096, N_ROWS), (4096, 50000), (4096, 4096), (256, 5000)):
+  indices = rand.randint(0, spread, size=n)
+  benchmark('%d rows within %d' % (n, spread), MmapArray, lambda x: x[indices])
+
+# ====== keys ====== #
+with PointerArrayWriter(path, (0, N_FEATURES), 'float32',
+                        remove_exist=True) as f:
+  for i in range(0, 100000, 10000):
+    lengths = rand.randint(1, 20, size=10000)
+    data = np.random.rand(int(np.sum(lengths)), N_FEATURES).astype('float32')
+    offsets = np.cumsum(lengths) - lengths
+    f.write({
+        'key%d' % (i + j): data[o:o + l]
+        for j, (o, l) in enumerate(zip(offsets, lengths))
+    })
+keys = ['key%d' % i for i in rand.randint(0, 100000, size=1024)]
+benchmark('gather 1024 keys', PointerArray, lambda x: x.gather(keys))
+keys = ['key%d' % i for i in rand.choice(20000, size=1024, replace=False)]
+benchmark('gather 1024 nearby keys', PointerArray, lambda x: x.gather(keys))
+keys = ['key%d' % i for i in rand.permutation(1024) + 50000]
+benchmark('gather 1024 adjacent keys', PointerArray, lambda x: x.gather(keys))
+
+# ===========================================================================
+# Clean-up
+# ===========================================================================
+os.remove(path)
@@ -0,0 +1,68 @@
+from __future__ import absolute_import, division, print_function
+
+import os
+import timeit
+
+import numpy as np
+
+from bigarray import MmapArray, MmapArrayWriter
+
+path = '/tmp/tmp.direct_io'
+
+N_ROWS = 400000
+N_FEATURES = 512  # 800MB of float32
+BLOCK_ROWS = 8192
+
+
+def page_cache_mb():
+  with open('/proc/meminfo') as f:
+    for line in f:
+      if line.startswith('Cached:'):
+        return int(line.split()[1]) / 1024
+
+
+def drop_cache():
+  fd = os.open(path, os.O_RDONLY)
+  os.fsync(fd)
+  os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+  os.close(fd)
+
+
+with MmapArrayWriter(path, (None, N_FEATURES), 'float32',
+                     remove_exist=True) as f:
+  for i in range(0, N_ROWS, BLOCK_ROWS):
+    f.write(
+        np.random.rand(min(BLOCK_ROWS, N_ROWS - i),
+                       N_FEATURES).astype('float32'))
+x = MmapArray(path, mode='r')
+size = x.nbytes / 1024 / 1024
+
+
+def scan_mmap():
+  total = 0.
+  for i in range(0, N_ROWS, BLOCK_ROWS):
+    total += float(np.sum(x[i:i + BLOCK_ROWS]))
+  return total
+
+
+def scan_direct():
+  total = 0.
+  for block in x.iter_direct(block_rows=BLOCK_ROWS):
+    total += float(np.sum(block))
+  return total
+
+
+for name, fn in (('mmap', scan_mmap), ('O_DIRECT', scan_direct)):
+  drop_cache()
+  cached = page_cache_mb()
+  start = timeit.default_timer()
+  fn()
+  duration = timeit.default_timer() - start
+  print('%-8s: %.4f s  %.2f MB/s  page cache +%.1f MB' %
+        (name, duration, size / duration, page_cache_mb() - cached))
+
+# ===========================================================================
+# Clean-up
+# ===========================================================================
+del x
+os.remove(path)
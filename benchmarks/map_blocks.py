@@ -0,0 +1,57 @@
+from __future__ import absolute_import, division, print_function
+
+import os
+import timeit
+
+import numpy as np
+
+from bigarray import MmapArray, MmapArrayWriter
+
+path = '/tmp/tmp.map_blocks'
+out_path = '/tmp/tmp.map_blocks.out'
+
+N_ROWS = 200000
+N_FEATURES = 256
+BLOCK_ROWS = 8192
+
+
+def fn(x):
+  return np.log1p(np.abs(x)) @ np.ones((N_FEATURES, 64), dtype='float32')
+
+
+with MmapArrayWriter(path, (None, N_FEATURES), 'float32',
+                     remove_exist=True) as f:
+  f.write(np.random.randn(N_ROWS, N_FEATURES).astype('float32'))
+x = MmapArray(path, mode='r')
+size = x.nbytes / 1024 / 1024
+
+# ====== the hand-rolled loop ====== #
+start = timeit.default_timer()
+with MmapArrayWriter(out_path, (None, 64), 'float32', remove_exist=True) as f:
+  for i in range(0, N_ROWS, BLOCK_ROWS):
+    f.write(fn(np.asarray(x[i:i + BLOCK_ROWS])))
+duration = timeit.default_timer() - start
+print('%-12s: %.4f s  %.2f MB/s' % ('loop', duration, size / duration))
+expected = np.array(MmapArray(out_path, mode='r'))
+
+for executor in ('thread', 'process'):
+  for workers in (1, 2, 4, 8):
+    start = timeit.default_timer()
+    y = x.map_blocks(fn,
+                     out_path,
+                     out_dtype='float32',
+                     out_shape=(None, 64),
+                     workers=workers,
+                     block_rows=BLOCK_ROWS,
+                     executor=executor,
+                     remove_exist=True)
+    duration = timeit.default_timer() - start
+    assert np.allclose(y, expected, rtol=1e-4)
+    print('%-7s x %d : %.4f s  %.2f MB/s' %
+          (executor, workers, duration, size / duration))
+
+# ===========================================================================
+# Clean-up
+# ===========================================================================
+os.remove(path)
+os.remove(out_path)
@@ -0,0 +1,37 @@
+from __future__ import absolute_import, division, print_function
+
+import os
+import timeit
+
+import numpy as np
+
+from bigarray import (PointerArray, PointerArrayWriter, enable_metrics,
+                      format_metrics, get_metrics)
+
+path = '/tmp/tmp.metrics'
+
+N_KEYS = 10000
+N_READS = 200000
+
+keys = ['key%d' % i for i in np.random.randint(0, N_KEYS, size=N_READS)]
+for enabled in (False, True):
+  enable_metrics(enabled)
+  start = timeit.default_timer()
+  with PointerArrayWriter(path, (0, 16), 'float32', remove_exist=True) as f:
+    for i in range(N_KEYS):
+      f.write({'key%d' % i: np.random.rand(4, 16).astype('float32')})
+  write = (timeit.default_timer() - start) / N_KEYS
+  x = PointerArray(path, mode='r')
+  start = timeit.default_timer()
+  for k in keys:
+    x[k]
+  read = (timeit.default_timer() - start) / N_READS
+  print('metrics=%-5s: write %.2f us/key  read %.2f us/key' %
+        (enabled, write * 1e6, read * 1e6))
+  del x
+print(format_metrics(get_metrics()))
+
+# ===========================================================================
+# Clean-up
+# ===========================================================================
+os.remove(path)
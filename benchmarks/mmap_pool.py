@@ -0,0 +1,56 @@
+from __future__ import absolute_import, division, print_function
+
+import os
+import shutil
+import timeit
+
+import numpy as np
+
+from bigarray import (MmapArray, MmapArrayWriter, get_mmap_pool_stats,
+                      read_mmaparray_header, set_mmap_pool_limits)
+
+path = '/tmp/tmp.mmap_pool'
+
+N_FILES = 1000
+N_OPEN = 20000  # number of random opens
+
+if os.path.exists(path):
+  shutil.rmtree(path)
+os.makedirs(path)
+files = [os.path.join(path, 'array%d' % i) for i in range(N_FILES)]
+for f in files:
+  with MmapArrayWriter(f, (None, 16), 'float32', remove_exist=True) as w:
+    w.write(np.random.rand(256, 16).astype('float32'))
+order = np.random.randint(0, N_FILES, size=N_OPEN).tolist()
+
+
+def open_memmap(f):
+  dtype, shape, offset = read_mmaparray_header(f, return_header_size=True)
+  return np.memmap(f, dtype=dtype, shape=shape, mode='r', offset=offset)
+
+
+def open_pool(f):
+  return MmapArray(f, mode='r')
+
+
+for name, fn in (('numpy.memmap', open_memmap), ('MmapArray pool', open_pool)):
+  start = timeit.default_timer()
+  for i in order:
+    x = fn(files[i])
+    x[0]
+  print('%-14s: %.2f us/open' %
+        (name, (timeit.default_timer() - start) / N_OPEN * 1e6))
+print(get_mmap_pool_stats())
+# a pool with fewer handles than files
+set_mmap_pool_limits(max_handles=100)
+start = timeit.default_timer()
+for i in order:
+  MmapArray(files[i], mode='r')[0]
+print('pool (100 handles): %.2f us/open' %
+      ((timeit.default_timer() - start) / N_OPEN * 1e6))
+print(get_mmap_pool_stats())
+
+# ===========================================================================
+# Clean-up
+# ===========================================================================
+shutil.rmtree(path)
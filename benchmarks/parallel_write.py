@@ -0,0 +1,53 @@
+from __future__ import absolute_import, division, print_function
+
+import os
+import timeit
+
+import numpy as np
+
+from bigarray import MmapArray, MmapArrayWriter
+
+mmap_path = '/tmp/tmp.mmap'
+numpy_path = '/tmp/tmp.array'
+
+N = 50000
+X = np.random.rand(N, 25, 128).astype('float64')
+SIZE = X.nbytes / 1024 / 1024
+print("Array size: %.2f (MB)\n" % SIZE)
+
+start = timeit.default_timer()
+with open(numpy_path, 'wb') as f:
+  np.save(f, X)
+duration = timeit.default_timer() - start
+print('%-28s: %.4f s  %.2f (MB/s)' % ('Numpy save', duration,
+                                      SIZE / duration))
+
+
+def benchmark(write_mode, write_workers):
+  f = MmapArrayWriter(mmap_path,
+                      dtype='float64',
+                      shape=(0,) + X.shape[1:],
+                      remove_exist=True,
+                      write_workers=write_workers,
+                      write_mode=write_mode)
+  start = timeit.default_timer()
+  f.write(X)
+  duration = timeit.default_timer() - start
+  f.flush()
+  f.close()
+  print('%-28s: %.4f s  %.2f (MB/s)' %
+        ('%s (workers=%d)' % (write_mode, write_workers), duration,
+         SIZE / duration))
+  assert np.all(MmapArray(mmap_path)[-100:] == X[-100:])
+
+
+for write_mode in ('mmap', 'pwrite'):
+  for write_workers in (1, 2, 4, 8):
+    benchmark(write_mode, write_workers)
+
+# ===========================================================================
+# Clean-up
+# ===========================================================================
+for path in (mmap_path, numpy_path):
+  if os.path.exists(path):
+    os.remove(path)
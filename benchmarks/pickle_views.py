@@ -0,0 +1,54 @@
+from __future__ import absolute_import, division, print_function
+
+import os
+import pickle
+import timeit
+from multiprocessing import Pool
+
+import numpy as np
+
+from bigarray import MmapArray, MmapArrayWriter
+
+path = '/tmp/tmp.pickle_views'
+
+N_ROWS = 20000
+N_FEATURES = 512
+BATCH_SIZE = 2000  # 4 MB per batch
+
+with MmapArrayWriter(path, (None, N_FEATURES), 'float32',
+                     remove_exist=True) as f:
+  f.write(np.random.rand(N_ROWS, N_FEATURES).astype('float32'))
+x = MmapArray(path, mode='r')
+starts = list(range(0, N_ROWS, BATCH_SIZE))
+
+
+def fn_view(start):
+  return x[start:start + BATCH_SIZE]
+
+
+def fn_copy(start):
+  return np.array(x[start:start + BATCH_SIZE])
+
+
+batch = x[:BATCH_SIZE]
+for name, obj in (('view', batch), ('copy', np.array(batch))):
+  start = timeit.default_timer()
+  for _ in range(100):
+    pickle.loads(pickle.dumps(obj))
+  print('pickle %-4s: %.2f us/batch  %d bytes' %
+        (name,
+         (timeit.default_timer() - start) / 100 * 1e6, len(pickle.dumps(obj))))
+
+with Pool(2) as p:
+  for name, fn in (('view', fn_view), ('copy', fn_copy)):
+    start = timeit.default_timer()
+    for _ in range(10):
+      p.map(fn, starts)
+    print('worker returns %-4s: %.2f ms/batch' %
+          (name, (timeit.default_timer() - start) / 10 / len(starts) * 1e3))
+
+# ===========================================================================
+# Clean-up
+# ===========================================================================
+if os.path.exists(path):
+  os.remove(path)
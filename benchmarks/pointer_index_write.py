@@ -0,0 +1,56 @@
+from __future__ import absolute_import, division, print_function
+
+import os
+import timeit
+from multiprocessing import Pool
+
+import numpy as np
+
+from bigarray import PointerArray, PointerArrayWriter
+
+path = '/tmp/tmp.pointer'
+
+N_PROCESSES = 8
+N_JOBS = 64
+N_KEYS = 2000  # number of keys written per job, one key per batch
+N_ROWS = 4
+WRITER = None
+
+
+def fn_write(job_idx):
+  start = job_idx * N_KEYS * N_ROWS
+  for i in range(N_KEYS):
+    WRITER.write(
+        {'name_%d_%d' % (job_idx, i): np.full((N_ROWS,), i, dtype='int32')},
+        start_position=start + i * N_ROWS)
+
+
+def benchmark(index_mode):
+  global WRITER
+  WRITER = PointerArrayWriter(path,
+                              shape=(N_JOBS * N_KEYS * N_ROWS,),
+                              dtype='int32',
+                              remove_exist=True,
+                              index_mode=index_mode)
+  start = timeit.default_timer()
+  with Pool(N_PROCESSES) as p:
+    p.map(fn_write, range(N_JOBS))
+  write_time = timeit.default_timer() - start
+  start = timeit.default_timer()
+  WRITER.flush()
+  WRITER.close()
+  flush_time = timeit.default_timer() - start
+  assert len(PointerArray(path).indices) == N_JOBS * N_KEYS
+  print('%-7s write: %.4f s  flush: %.4f s' % (index_mode, write_time,
+                                               flush_time))
+
+
+print("%d processes writing %d keys\n" % (N_PROCESSES, N_JOBS * N_KEYS))
+benchmark('shared')
+benchmark('local')
+
+# ===========================================================================
+# Clean-up
+# ===========================================================================
+if os.path.exists(path):
+  os.remove(path)
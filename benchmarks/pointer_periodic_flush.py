@@ -0,0 +1,49 @@
+from __future__ import absolute_import, division, print_function
+
+import os
+import timeit
+
+import numpy as np
+
+from bigarray import PointerArray, PointerArrayWriter
+
+path = '/tmp/tmp.pointer'
+
+N_FLUSHES = 50
+N_KEYS = 5000  # number of keys written between two flushes
+N_ROWS = 4
+
+f = PointerArrayWriter(path,
+                       shape=(0, N_ROWS),
+                       dtype='float32',
+                       remove_exist=True,
+                       index_mode='local',
+                       growth_factor=1.5)
+data = np.ones((N_KEYS * N_ROWS, N_ROWS), dtype='float32')
+flush_time = []
+for i in range(N_FLUSHES):
+  f.write({
+      'name_%d_%d' % (i, j): data[j * N_ROWS:(j + 1) * N_ROWS]
+      for j in range(N_KEYS)
+  })
+  start = timeit.default_timer()
+  f.flush()
+  flush_time.append(timeit.default_timer() - start)
+size = f.filesize
+start = timeit.default_timer()
+f.close()
+close_time = timeit.default_timer() - start
+assert len(PointerArray(path).indices) == N_FLUSHES * N_KEYS
+
+print("%d flushes, %d new keys per flush" % (N_FLUSHES, N_KEYS))
+print("first flush: %.4f s  last flush: %.4f s" %
+      (flush_time[0], flush_time[-1]))
+print("file size before close: %.2f MB  after close: %.2f MB" %
+      (size / 1024 / 1024, os.stat(path).st_size / 1024 / 1024))
+print("close (compaction): %.4f s" % close_time)
+
+# ===========================================================================
+# Clean-up
+# ===========================================================================
+if os.path.exists(path):
+  os.remove(path)
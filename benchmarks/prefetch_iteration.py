@@ -0,0 +1,65 @@
+from __future__ import absolute_import, division, print_function
+
+import os
+import time
+import timeit
+
+import numpy as np
+
+from bigarray import MmapArray, MmapArrayWriter
+
+mmap_path = '/tmp/tmp.mmap'
+
+N = 50000
+BATCH = 256
+COMPUTE = 0.002  # simulated computation per batch (in second)
+X = np.random.rand(N, 25, 128).astype('float32')
+print("Array size: %.2f (MB)\n" % (X.nbytes / 1024 / 1024))
+
+with MmapArrayWriter(mmap_path,
+                     dtype='float32',
+                     shape=(0,) + X.shape[1:],
+                     remove_exist=True) as f:
+  f.write(X)
+
+
+def drop_page_cache():
+  # evict the pages of the file from the page cache (cold cache)
+  if hasattr(os, 'posix_fadvise'):
+    fd = os.open(mmap_path, os.O_RDONLY)
+    os.fsync(fd)
+    os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    os.close(fd)
+
+
+def benchmark(name, iterator):
+  start = timeit.default_timer()
+  for x in iterator():
+    np.sum(x[:, 0, 0])
+    time.sleep(COMPUTE)
+  print('%-44s: %.4f s' % (name, timeit.default_timer() - start))
+
+
+for cache in ('cold', 'warm'):
+  mmap = MmapArray(mmap_path)
+
+  def plain_loop():
+    for i in range(0, N, BATCH):
+      yield np.array(mmap[i:i + BATCH])
+
+  for name, it in [
+      ('plain loop', plain_loop),
+      ('iter_batches(prefetch=4)', lambda: mmap.iter_batches(BATCH, 4)),
+      ('iter_batches(prefetch=4, workers=4)',
+       lambda: mmap.iter_batches(BATCH, 4, workers=4)),
+  ]:
+    if cache == 'cold':
+      drop_page_cache()
+    benchmark('[%s] %s' % (cache, name), it)
+  print()
+
+# ===========================================================================
+# Clean-up
+# ===========================================================================
+if os.path.exists(mmap_path):
+  os.remove(mmap_path)
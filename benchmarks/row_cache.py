@@ -0,0 +1,65 @@
+from __future__ import absolute_import, division, print_function
+
+import os
+import timeit
+
+import numpy as np
+
+from bigarray import PointerArray, PointerArrayWriter, RowCache
+
+path = '/tmp/tmp.row_cache'
+
+N_KEYS = 100000
+N_FEATURES = 64
+N_READS = 200000
+SCAN_EVERY = 1000  # a scan of SCAN_LENGTH keys after every 1000 reads
+SCAN_LENGTH = 2000
+CACHE_BYTES = 16 * 1024 * 1024
+
+rand = np.random.RandomState(8)
+with PointerArrayWriter(path, (0, N_FEATURES), 'float32',
+                        remove_exist=True) as f:
+  for i in range(0, N_KEYS, 10000):
+    f.write({
+        'key%d' % (i + j): np.random.rand(10, N_FEATURES).astype('float32')
+        for j in range(10000)
+    })
+# skewed (zipf) access to the popular keys, interrupted by the bulk scans
+popular = ['key%d' % i for i in (rand.zipf(1.2, size=N_READS) - 1) % N_KEYS]
+reads = []
+scan_start = 0
+for i in range(0, N_READS, SCAN_EVERY):
+  reads += popular[i:i + SCAN_EVERY]
+  reads += ['key%d' % j for j in range(scan_start, scan_start + SCAN_LENGTH)]
+  scan_start = (scan_start + SCAN_LENGTH) % N_KEYS
+
+for name, cache in (('no cache', None), ('LRU',
+                                         RowCache(CACHE_BYTES,
+                                                  protected_ratio=0.)),
+                    ('segmented LRU', RowCache(CACHE_BYTES))):
+  x = PointerArray(path, mode='r').set_cache(cache)
+  start = timeit.default_timer()
+  for k in reads:
+    x[k]
+  duration = timeit.default_timer() - start
+  if cache is None:
+    print('%-14s: %.2f us/read' % (name, duration / len(reads) * 1e6))
+  else:
+    stats = cache.stats()
+    print('%-14s: %.2f us/read  hit rate %.2f%%  %s' %
+          (name, duration / len(reads) * 1e6, stats['hits'] / len(reads) * 100,
+           stats))
+
+# the cost of a hit, against the slicing of the mapped (cached) pages
+for name, cache in (('hot key', None), ('hot key (hit)', RowCache())):
+  x = PointerArray(path, mode='r').set_cache(cache)
+  start = timeit.default_timer()
+  for _ in range(N_READS):
+    x['key0']
+  print('%-14s: %.2f us/read' %
+        (name, (timeit.default_timer() - start) / N_READS * 1e6))
+
+# ===========================================================================
+# Clean-up
+# ===========================================================================
+os.remove(path)
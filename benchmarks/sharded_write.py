@@ -0,0 +1,49 @@
+from __future__ import absolute_import, division, print_function
+
+import os
+import shutil
+import timeit
+from multiprocessing import Pool
+
+import numpy as np
+
+from bigarray import ShardedMmapArray
+
+path = '/tmp/tmp.sharded'
+
+N_SHARDS = 16
+N_ROWS = 20000  # rows written to each shard
+N_BATCH = 500  # rows per write
+N_FEATURES = 128
+
+
+def fn_write(shard):
+  data = np.random.rand(N_BATCH, N_FEATURES).astype('float32')
+  with ShardedMmapArray.writer(path,
+                               shard,
+                               shape=(0, N_FEATURES),
+                               dtype='float32',
+                               remove_exist=True,
+                               growth_factor=2.0) as f:
+    for _ in range(N_ROWS // N_BATCH):
+      f.write(data)
+
+
+for n_processes in (1, 2, 4, 8):
+  if os.path.exists(path):
+    shutil.rmtree(path)
+  start = timeit.default_timer()
+  with Pool(n_processes) as p:
+    p.map(fn_write, range(N_SHARDS))
+  duration = timeit.default_timer() - start
+  x = ShardedMmapArray(path)
+  assert x.shape == (N_SHARDS * N_ROWS, N_FEATURES)
+  print('%d processes: %.4f s  %.2f MB/s' %
+        (n_processes, duration, x.shape[0] * N_FEATURES * 4 / 1024 / 1024 /
+         duration))
+
+# ===========================================================================
+# Clean-up
+# ===========================================================================
+if os.path.exists(path):
+  shutil.rmtree(path)
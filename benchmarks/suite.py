@@ -0,0 +1,408 @@
+from __future__ import absolute_import, division, print_function
+
+# Parameterized benchmarks of bigarray, the results are printed and written
+# as JSON for tracking the regressions, for example:
+#
+#   PYTHONPATH=. python benchmarks/suite.py --output results.json
+#   PYTHONPATH=. python benchmarks/suite.py --suites read,flush --scale 0.1
+#
+# The cold cache cases drop the pages of the files with
+# `posix_fadvise(POSIX_FADV_DONTNEED)` (Linux), the comparison with HDF5 runs
+# only if `h5py` is installed.
+import argparse
+import gc
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import timeit
+from collections import OrderedDict
+from multiprocessing import Pool
+
+import numpy as np
+
+from bigarray import (MmapArray, MmapArrayWriter, PointerArray,
+                      PointerArrayWriter, ShardedMmapArray, mmap_array)
+
+try:
+  import h5py
+except ImportError:
+  h5py = None
+
+N_FEATURES = 128  # float32 rows of 512 bytes
+SUITES = OrderedDict()
+RESULTS = []
+# the human readable lines go to stderr when the JSON is printed
+LOG = sys.stdout
+
+
+# ===========================================================================
+# Helper
+# ===========================================================================
+def suite(fn):
+  SUITES[fn.__name__] = fn
+  return fn
+
+
+def record(suite_name, case, **values):
+  """ Keep the result and print it as a line """
+  result = OrderedDict(suite=suite_name)
+  result.update(case)
+  result.update(values)
+  RESULTS.append(result)
+  text = ' '.join('%s=%s' % (k, v) for k, v in case.items())
+  text += '  ' + '  '.join('%s=%.4g' %
+                           (k, v) if isinstance(v, float) else '%s=%s' % (k, v)
+                           for k, v in values.items())
+  print('%-10s %s' % (suite_name, text), file=LOG)
+
+
+def mbps(nbytes, seconds):
+  return nbytes / 1024 / 1024 / max(seconds, 1e-12)
+
+
+def can_drop_cache():
+  return hasattr(os, 'posix_fadvise')
+
+
+def drop_cache(*paths):
+  """ Drop the pages of the files, the files mapped by the pool are unmapped
+  first because the mapped pages are not dropped """
+  mmap_array._POOL.clear()
+  gc.collect()
+  for path in paths:
+    files = [path] if os.path.isfile(path) else \
+      [os.path.join(path, f) for f in os.listdir(path)]
+    for f in files:
+      fd = os.open(f, os.O_RDONLY)
+      try:
+        os.fsync(fd)
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+      finally:
+        os.close(fd)
+
+
+def cache_states():
+  return ('cold', 'warm') if can_drop_cache() else ('warm',)
+
+
+def write_array(path, n_rows, block_rows=65536):
+  with MmapArrayWriter(path, (0, N_FEATURES), 'float32',
+                       remove_exist=True) as f:
+    for i in range(0, n_rows, block_rows):
+      f.write(
+          np.random.rand(min(block_rows, n_rows - i),
+                         N_FEATURES).astype('float32'))
+
+
+def _write_shard(job):
+  path, shard, n_rows, batch = job
+  data = np.random.rand(batch, N_FEATURES).astype('float32')
+  with ShardedMmapArray.writer(path,
+                               shard,
+                               shape=(0, N_FEATURES),
+                               dtype='float32',
+                               remove_exist=True,
+                               growth_factor=2.0) as f:
+    for _ in range(n_rows // batch):
+      f.write(data)
+
+
+# ===========================================================================
+# Suites
+# ===========================================================================
+@suite
+def append(args):
+  """ Append throughput against the number of rows of each write """
+  path = os.path.join(args.path, 'append')
+  n_rows = int(200000 * args.scale)
+  for batch in (1, 16, 256, 4096):
+    n_writes = max(1, min(n_rows // batch, 20000))
+    data = np.random.rand(batch, N_FEATURES).astype('float32')
+    f = MmapArrayWriter(path, (0, N_FEATURES), 'float32', remove_exist=True)
+    start = timeit.default_timer()
+    for _ in range(n_writes):
+      f.write(data)
+    seconds = timeit.default_timer() - start
+    f.close()
+    record('append',
+           OrderedDict(batch=batch),
+           rows=n_writes * batch,
+           seconds=seconds,
+           us_per_write=seconds / n_writes * 1e6,
+           mb_per_s=mbps(n_writes * data.nbytes, seconds))
+  os.remove(path)
+
+
+@suite
+def read(args):
+  """ Sequential and random reads of batches of rows, with cold and warm
+  page cache """
+  path = os.path.join(args.path, 'read')
+  n_rows = int(400000 * args.scale)
+  batch = 256
+  write_array(path, n_rows)
+  rand = np.random.RandomState(8)
+  n_batches = n_rows // batch
+  patterns = OrderedDict([
+      ('sequential', [slice(i, i + batch) for i in range(0, n_rows, batch)]),
+      ('random_slices', [
+          slice(i, i + batch)
+          for i in rand.randint(0, n_rows - batch, size=n_batches)
+      ]),
+      ('random_rows',
+       [np.sort(rand.randint(0, n_rows, size=batch)) for _ in range(n_batches)
+       ]),
+  ])
+  for pattern, keys in patterns.items():
+    for cache in cache_states():
+      if cache == 'cold':
+        drop_cache(path)
+      x = MmapArray(path, mode='r')
+      start = timeit.default_timer()
+      nbytes = 0
+      for key in keys:
+        nbytes += np.array(x[key]).nbytes
+      seconds = timeit.default_timer() - start
+      record('read',
+             OrderedDict(pattern=pattern, cache=cache),
+             batches=len(keys),
+             seconds=seconds,
+             us_per_batch=seconds / len(keys) * 1e6,
+             mb_per_s=mbps(nbytes, seconds))
+      del x
+  os.remove(path)
+
+
+@suite
+def pointer_open(args):
+  """ Opening a `PointerArray` and the key lookups against the number of
+  keys """
+  path = os.path.join(args.path, 'open')
+  rand = np.random.RandomState(8)
+  for n_keys in (1000, 10000, 100000, 1000000):
+    n_keys = max(10, int(n_keys * args.scale))
+    with PointerArrayWriter(path, (0, 4), 'float32', remove_exist=True) as f:
+      for i in range(0, n_keys, 100000):
+        keys = range(i, min(i + 100000, n_keys))
+        f.write(
+            OrderedDict(
+                ('key%d' % j, np.zeros((2, 4), dtype='float32')) for j in keys))
+    keys = ['key%d' % i for i in rand.randint(0, n_keys, size=10000)]
+    for cache in cache_states():
+      if cache == 'cold':
+        drop_cache(path)
+      else:
+        mmap_array._POOL.clear()
+      start = timeit.default_timer()
+      x = PointerArray(path, mode='r')
+      open_seconds = timeit.default_timer() - start
+      start = timeit.default_timer()
+      for k in keys:
+        x.indices[k]
+      lookup_seconds = timeit.default_timer() - start
+      record('pointer_open',
+             OrderedDict(keys=n_keys, cache=cache),
+             open_ms=open_seconds * 1000,
+             lookup_us=lookup_seconds / len(keys) * 1e6,
+             filesize=os.stat(path).st_size)
+      del x
+  os.remove(path)
+
+
+@suite
+def multiprocess(args):
+  """ Writing one shard per process (the same rows per process) """
+  path = os.path.join(args.path, 'sharded')
+  n_rows = int(100000 * args.scale)
+  batch = 500
+  n_rows = max(batch, n_rows // batch * batch)
+  for n_processes in (1, 2, 4, 8):
+    if os.path.exists(path):
+      shutil.rmtree(path)
+    start = timeit.default_timer()
+    with Pool(n_processes) as pool:
+      pool.map(_write_shard,
+               [(path, shard, n_rows, batch) for shard in range(n_processes)])
+    seconds = timeit.default_timer() - start
+    assert ShardedMmapArray(path).shape[0] == n_rows * n_processes
+    record('multiprocess',
+           OrderedDict(processes=n_processes),
+           rows=n_rows * n_processes,
+           seconds=seconds,
+           mb_per_s=mbps(n_rows * n_processes * N_FEATURES * 4, seconds))
+  shutil.rmtree(path)
+
+
+@suite
+def flush(args):
+  """ The cost of flushing the dirty rows with each durability level """
+  path = os.path.join(args.path, 'flush')
+  n_rows = int(100000 * args.scale)
+  data = np.random.rand(n_rows, N_FEATURES).astype('float32')
+  keys = OrderedDict(
+      ('key%d' % i, data[i * 10:i * 10 + 10]) for i in range(n_rows // 10))
+  cases = [('MmapArrayWriter', d, a)
+           for d in ('page_cache', 'data')
+           for a in (False, True)]
+  cases += [
+      ('PointerArrayWriter', d, False) for d in ('page_cache', 'data', 'index')
+  ]
+  for writer, durability, asynchronous in cases:
+    if writer == 'MmapArrayWriter':
+      f = MmapArrayWriter(path, (0, N_FEATURES), 'float32', remove_exist=True)
+      f.write(data)
+    else:
+      f = PointerArrayWriter(path, (0, N_FEATURES),
+                             'float32',
+                             remove_exist=True)
+      f.write(keys)
+    start = timeit.default_timer()
+    result = f.flush(durability, asynchronous=asynchronous)
+    seconds = timeit.default_timer() - start
+    if asynchronous:
+      result.result()
+    total = timeit.default_timer() - start
+    f.close()
+    record('flush',
+           OrderedDict(writer=writer,
+                       durability=durability,
+                       asynchronous=asynchronous),
+           dirty_mb=data.nbytes / 1024 / 1024,
+           blocking_ms=seconds * 1000,
+           total_ms=total * 1000)
+  os.remove(path)
+
+
+@suite
+def hdf5(args):
+  """ Writing, opening and iterating the same data with `h5py`, `numpy.load`
+  and `MmapArray` """
+  if h5py is None:
+    print('hdf5       skipped: h5py is not installed', file=LOG)
+    return
+  paths = OrderedDict([(name, os.path.join(args.path, name))
+                       for name in ('numpy', 'hdf5', 'mmap')])
+  n_rows = int(200000 * args.scale)
+  data = np.random.rand(n_rows, N_FEATURES).astype('float32')
+  # ====== writing ====== #
+  writers = OrderedDict()
+
+  def write_numpy():
+    with open(paths['numpy'], 'wb') as f:
+      np.save(f, data)
+
+  def write_hdf5():
+    with h5py.File(paths['hdf5'], 'w') as f:
+      f['X'] = data
+
+  def write_mmap():
+    with MmapArrayWriter(paths['mmap'], (0, N_FEATURES),
+                         'float32',
+                         remove_exist=True) as f:
+      f.write(data)
+
+  writers['numpy'] = write_numpy
+  writers['hdf5'] = write_hdf5
+  writers['mmap'] = write_mmap
+  for name, fn in writers.items():
+    start = timeit.default_timer()
+    fn()
+    seconds = timeit.default_timer() - start
+    record('hdf5',
+           OrderedDict(format=name, operation='write'),
+           seconds=seconds,
+           mb_per_s=mbps(data.nbytes, seconds),
+           filesize=os.stat(paths[name]).st_size)
+  # ====== open and iterate ====== #
+  openers = OrderedDict([
+      ('numpy', lambda: np.load(paths['numpy'])),
+      ('hdf5', lambda: h5py.File(paths['hdf5'], 'r')['X']),
+      ('mmap', lambda: MmapArray(paths['mmap'], mode='r')),
+  ])
+  for name, fn in openers.items():
+    for cache in cache_states():
+      if cache == 'cold':
+        drop_cache(paths[name])
+      start = timeit.default_timer()
+      x = fn()
+      open_seconds = timeit.default_timer() - start
+      start = timeit.default_timer()
+      for i in range(0, n_rows, 256):
+        np.asarray(x[i:i + 256])
+      iter_seconds = timeit.default_timer() - start
+      record('hdf5',
+             OrderedDict(format=name, operation='read', cache=cache),
+             open_seconds=open_seconds,
+             iter_seconds=iter_seconds,
+             mb_per_s=mbps(data.nbytes, open_seconds + iter_seconds))
+      del x
+  for path in paths.values():
+    os.remove(path)
+
+
+# ===========================================================================
+# Main
+# ===========================================================================
+def main():
+  parser = argparse.ArgumentParser(description='bigarray benchmarks')
+  parser.add_argument('--suites',
+                      default=','.join(SUITES.keys()),
+                      help='comma separated suites, from: %s' %
+                      ', '.join(SUITES.keys()))
+  parser.add_argument('--scale',
+                      type=float,
+                      default=1.0,
+                      help='multiply the size of all the suites')
+  parser.add_argument('--path',
+                      default=None,
+                      help='directory for the files (a temporary directory '
+                      'by default), the page cache is only dropped for the '
+                      'local filesystems')
+  parser.add_argument('--output',
+                      default=None,
+                      help='path to the JSON results, "-" for stdout')
+  args = parser.parse_args()
+  global LOG
+  if args.output == '-':
+    LOG = sys.stderr
+  suites = [s.strip() for s in args.suites.split(',') if len(s.strip()) > 0]
+  for name in suites:
+    if name not in SUITES:
+      parser.error('Unknown suite: %s, choose from: %s' %
+                   (name, ', '.join(SUITES.keys())))
+  is_temporary = args.path is None
+  args.path = tempfile.mkdtemp(prefix='bigarray_benchmarks') \
+    if is_temporary else os.path.abspath(args.path)
+  if not os.path.exists(args.path):
+    os.makedirs(args.path)
+  np.random.seed(8)
+  try:
+    for name in suites:
+      SUITES[name](args)
+  finally:
+    if is_temporary:
+      shutil.rmtree(args.path)
+  output = OrderedDict(time=time.strftime('%Y-%m-%dT%H:%M:%S'),
+                       platform=platform.platform(),
+                       python=platform.python_version(),
+                       numpy=np.__version__,
+                       cpu_count=os.cpu_count(),
+                       h5py=None if h5py is None else h5py.__version__,
+                       cold_cache=can_drop_cache(),
+                       scale=args.scale,
+                       suites=suites,
+                       results=RESULTS)
+  if args.output == '-':
+    json.dump(output, sys.stdout, indent=2)
+    print()
+  elif args.output is not None:
+    with open(args.output, 'w') as f:
+      json.dump(output, f, indent=2)
+
+
+if __name__ == '__main__':
+  main()
@@ -1,2 +1,9 @@
 from bigarray.mmap_array import *
 from bigarray.pointer_array import *
+from bigarray.compressed_array import *
+from bigarray.samplers import *
+from bigarray.sharded_array import *
+from bigarray.ragged_array import *
+from bigarray.reductions import *
+from bigarray.row_cache import *
+from bigarray.metrics import *
@@ -0,0 +1,458 @@
+from __future__ import absolute_import, division, print_function
+
+import bz2
+import lzma
+import marshal
+import mmap
+import os
+import threading
+import zlib
+from collections import OrderedDict
+from typing import Iterable, List, Optional, Text, Union
+
+import numpy as np
+from six import string_types
+
+from bigarray.mmap_array import _MAXIMUM_HEADER_SIZE
+
+__all__ = [
+    'read_compressedarray_header',
+    'CompressedArrayWriter',
+    'CompressedArray',
+]
+
+_HEADER = b'mmapzipd'
+_HEADER_SIZE_LENGTH = 8
+# the chunks start right after the reserved header
+_CHUNKS_OFFSET = len(_HEADER) + _HEADER_SIZE_LENGTH + _MAXIMUM_HEADER_SIZE
+
+
+def _lzma_compress(data, level):
+  return lzma.compress(data, preset=level)
+
+
+# name -> (compress, decompress, default level)
+_CODECS = {
+    'zlib': (zlib.compress, zlib.decompress, 6),
+    'lzma': (_lzma_compress, lzma.decompress, 6),
+    'bz2': (bz2.compress, bz2.decompress, 9),
+}
+
+
+# ===========================================================================
+# Helper
+# ===========================================================================
+def read_compressedarray_header(path):
+  """ Reading header of a CompressedArray
+
+  Parameters
+  ----------
+  path : `str`
+    Input path to a file
+
+  Return
+  ------
+  dtype, shape, chunk_rows, codec, level
+  """
+  with open(path, mode='rb') as f:
+    if f.read(len(_HEADER)) != _HEADER:
+      raise ValueError('Invalid header for CompressedArray.')
+    try:
+      size = int(f.read(_HEADER_SIZE_LENGTH))
+      dtype, shape, chunk_rows, codec, level = marshal.loads(f.read(size))
+    except Exception as e:
+      raise Exception('Error reading compressed data file: %s' % str(e))
+  return dtype, tuple(shape), chunk_rows, codec, level
+
+
+def _read_chunk_table(f, filesize):
+  """ The table is stored at the end of file:
+  `[offsets (n_chunks + 1) int64][n_chunks int64]` """
+  f.seek(filesize - 8)
+  n_chunks = int.from_bytes(f.read(8), 'little')
+  f.seek(filesize - 8 - (n_chunks + 1) * 8)
+  return np.frombuffer(f.read((n_chunks + 1) * 8), dtype='<i8')
+
+
+# ===========================================================================
+# Writer
+# ===========================================================================
+class CompressedArrayWriter(object):
+  """ Writing an array as fixed-size chunks of rows, each chunk is
+  compressed independently, followed by a table of chunk offsets.
+
+  Parameters
+  ----------
+  path : str
+    path to a file for writing compressed data
+  shape : `tuple`
+    tuple of integer representing the shape, the first dimension is
+    ignored since the data could only be appended
+  dtype : numpy.dtype
+    data type
+  chunk_rows : `int` (default=1024)
+    number of rows in each compressed chunk
+  codec : {'zlib', 'lzma', 'bz2'}
+    compression algorithm from the standard library
+  level : `int` (optional)
+    compression level, the default level of the codec if `None`
+  remove_exist : boolean (default=False)
+    if file at given path exists, remove it
+
+  Note
+  ----
+  All changes won't be saved until you call `CompressedArrayWriter.flush`,
+  the last incomplete chunk is rewritten when more data is appended.
+  """
+
+  def __init__(self,
+               path: Text,
+               shape: Optional[List[int]] = None,
+               dtype: Optional[Union[Text, np.dtype]] = None,
+               chunk_rows: int = 1024,
+               codec: Text = 'zlib',
+               level: Optional[int] = None,
+               remove_exist: bool = False):
+    super(CompressedArrayWriter, self).__init__()
+    if not isinstance(path, string_types):
+      raise ValueError("Only support file path, and not file descriptor ID")
+    path = os.path.abspath(path)
+    if remove_exist and os.path.exists(path):
+      if os.path.isfile(path):
+        os.remove(path)
+      else:
+        raise RuntimeError("Give path at '%s' is a folder, cannot remove!" %
+                           path)
+    # ====== read exist file ====== #
+    if os.path.exists(path) and os.stat(path).st_size > 0:
+      dtype, shape, chunk_rows, codec, level = \
+        read_compressedarray_header(path)
+      f = open(path, 'rb+')
+      offsets = _read_chunk_table(f, os.stat(path).st_size).tolist()
+      n_rows = shape[0]
+      # decompress the incomplete chunk, it will be rewritten
+      n_partial = n_rows % chunk_rows
+      if n_partial > 0:
+        f.seek(offsets[-2])
+        data = _CODECS[codec][1](f.read(offsets[-1] - offsets[-2]))
+        buffer = [np.frombuffer(data, dtype=dtype).reshape(-1, *shape[1:])]
+        offsets = offsets[:-1]
+      else:
+        buffer = []
+    # ====== create new file ====== #
+    else:
+      if dtype is None or shape is None:
+        raise Exception("First created this CompressedArray, `dtype` and "
+                        "`shape` must NOT be None.")
+      if codec not in _CODECS:
+        raise ValueError("Only support codec: %s; given: %s" %
+                         (', '.join(_CODECS.keys()), str(codec)))
+      if not isinstance(shape, Iterable):
+        shape = (shape,)
+      shape = tuple([0 if i is None or i < 0 else int(i) for i in shape])
+      dtype = str(np.dtype(dtype))
+      chunk_rows = int(chunk_rows)
+      if level is None:
+        level = _CODECS[codec][2]
+      f = open(path, 'wb+')
+      n_rows = 0
+      n_partial = 0
+      offsets = [_CHUNKS_OFFSET]
+      buffer = []
+    # ====== assign attributes ====== #
+    self._path = path
+    self._file = f
+    self._dtype = np.dtype(dtype)
+    self._row_shape = tuple(shape[1:])
+    self._chunk_rows = chunk_rows
+    self._codec = codec
+    self._level = level
+    # number of rows in complete chunks, offsets of complete chunks
+    self._n_rows = n_rows - n_partial
+    self._offsets = offsets
+    self._buffer = buffer
+    self._n_buffer = n_partial
+    self._is_closed = False
+    self._write_header()
+
+  @property
+  def path(self):
+    return self._path
+
+  @property
+  def shape(self):
+    return (self._n_rows + self._n_buffer,) + self._row_shape
+
+  @property
+  def dtype(self):
+    return self._dtype
+
+  @property
+  def chunk_rows(self):
+    return self._chunk_rows
+
+  @property
+  def is_closed(self):
+    return self._is_closed
+
+  @property
+  def filesize(self):
+    """ Return the size of the file in bytes """
+    return os.stat(self.path).st_size
+
+  def _write_header(self):
+    meta = marshal.dumps([
+        str(self._dtype), self.shape, self._chunk_rows, self._codec, self._level
+    ])
+    if len(meta) > _MAXIMUM_HEADER_SIZE:
+      raise Exception('The size of header excess maximum allowed size '
+                      '(%d bytes).' % _MAXIMUM_HEADER_SIZE)
+    f = self._file
+    f.seek(0)
+    f.write(_HEADER)
+    f.write(('%8d' % len(meta)).encode())
+    f.write(meta)
+
+  def _write_chunk(self, offset, array):
+    compress = _CODECS[self._codec][0]
+    data = compress(np.ascontiguousarray(array).tobytes(), self._level)
+    self._file.seek(offset)
+    self._file.write(data)
+    return offset + len(data)
+
+  def write(self, arrays: Iterable):
+    """ Appending the arrays, every complete chunk is compressed and written
+    to the file.
+
+    Parameters
+    ----------
+    arrays : {`numpy.ndarray`, list of `numpy.ndarray`}
+      multiple arrays could be written to the file at once
+
+    Return
+    ------
+    `CompressedArrayWriter` for method chaining
+    """
+    if self.is_closed:
+      raise RuntimeError("The CompressedArrayWriter is closed!")
+    if not isinstance(arrays, Iterable) or isinstance(arrays, np.ndarray):
+      arrays = (arrays,)
+    for a in arrays:
+      if a.shape[1:] != self._row_shape:
+        raise ValueError("Require array with shape: %s, given: %s" %
+                         (str(self.shape), str(a.shape)))
+      self._buffer.append(np.asarray(a, dtype=self._dtype))
+      self._n_buffer += a.shape[0]
+    # ====== compress complete chunks ====== #
+    if self._n_buffer >= self._chunk_rows:
+      buffer = np.concatenate(self._buffer, axis=0)
+      n_chunks = buffer.shape[0] // self._chunk_rows
+      for i in range(n_chunks):
+        chunk = buffer[i * self._chunk_rows:(i + 1) * self._chunk_rows]
+        self._offsets.append(self._write_chunk(self._offsets[-1], chunk))
+      self._n_rows += n_chunks * self._chunk_rows
+      buffer = buffer[n_chunks * self._chunk_rows:]
+      self._buffer = [buffer] if buffer.shape[0] > 0 else []
+      self._n_buffer = buffer.shape[0]
+    return self
+
+  def flush(self):
+    """ Write the incomplete chunk, the chunk table and the header """
+    offsets = list(self._offsets)
+    if self._n_buffer > 0:
+      chunk = np.concatenate(self._buffer, axis=0)
+      offsets.append(self._write_chunk(offsets[-1], chunk))
+    f = self._file
+    f.seek(offsets[-1])
+    f.write(np.array(offsets, dtype='<i8').tobytes())
+    f.write((len(offsets) - 1).to_bytes(8, 'little'))
+    f.truncate()
+    self._write_header()
+    f.flush()
+    return self
+
+  def close(self):
+    if self.is_closed:
+      return
+    self.flush()
+    self._is_closed = True
+    self._file.close()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    self.close()
+
+  def __del__(self):
+    if hasattr(self, '_is_closed'):
+      self.close()
+
+
+# ===========================================================================
+# Reader
+# ===========================================================================
+class CompressedArray(object):
+  """ Read-only array stored by `CompressedArrayWriter`, slicing the array
+  only decompresses the chunks that are touched, the most recently
+  decompressed chunks are cached.
+
+  Parameters
+  ----------
+  path : str
+    path to the file
+  cache_size : `int` (default=8)
+    maximum number of decompressed chunks kept in memory
+  """
+
+  def __init__(self, path: Text, cache_size: int = 8):
+    if not isinstance(path, string_types):
+      raise ValueError("Only support file path, and not file descriptor ID")
+    path = os.path.abspath(path)
+    dtype, shape, chunk_rows, codec, _ = read_compressedarray_header(path)
+    self._path = path
+    self._dtype = np.dtype(dtype)
+    self._shape = shape
+    self._chunk_rows = chunk_rows
+    self._decompress = _CODECS[codec][1]
+    with open(path, 'rb') as f:
+      self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    self._offsets = _read_chunk_table(self._mmap, len(self._mmap))
+    self._cache = OrderedDict()
+    self._cache_size = max(1, int(cache_size))
+    self._lock = threading.Lock()
+
+  def __getstate__(self):
+    return self.path, self._cache_size
+
+  def __setstate__(self, states):
+    self.__init__(*states)
+
+  @property
+  def path(self):
+    return self._path
+
+  @property
+  def filesize(self):
+    """ Return the size of the file in bytes """
+    return os.stat(self.path).st_size
+
+  @property
+  def shape(self):
+    return self._shape
+
+  @property
+  def dtype(self):
+    return self._dtype
+
+  @property
+  def ndim(self):
+    return len(self._shape)
+
+  @property
+  def chunk_rows(self):
+    return self._chunk_rows
+
+  @property
+  def n_chunks(self):
+    return len(self._offsets) - 1
+
+  def __len__(self):
+    return self._shape[0]
+
+  def __array__(self, dtype=None, copy=None):
+    array = self[:]
+    return array if dtype is None else array.astype(dtype)
+
+  def _chunk(self, idx):
+    with self._lock:
+      if idx in self._cache:
+        self._cache.move_to_end(idx)
+        return self._cache[idx]
+    start, end = self._offsets[idx], self._offsets[idx + 1]
+    data = self._decompress(self._mmap[start:end])
+    chunk = np.frombuffer(data, dtype=self._dtype).reshape(-1, *self._shape[1:])
+    with self._lock:
+      self._cache[idx] = chunk
+      while len(self._cache) > self._cache_size:
+        self._cache.popitem(last=False)
+    return chunk
+
+  def _read_range(self, start, stop):
+    """ Read contiguous rows `[start, stop)` """
+    if stop <= start:
+      return np.empty((0,) + self._shape[1:], dtype=self._dtype)
+    rows = self._chunk_rows
+    first, last = start // rows, (stop - 1) // rows
+    parts = []
+    for idx in range(first, last + 1):
+      chunk = self._chunk(idx)
+      offset = idx * rows
+      parts.append(chunk[max(start - offset, 0):stop - offset])
+    return np.concatenate(parts, axis=0)
+
+  def _read_rows(self, indices):
+    """ Read the rows given by an integer array """
+    indices = np.asarray(indices, dtype='int64')
+    indices = np.where(indices < 0, indices + self._shape[0], indices)
+    if np.any((indices < 0) | (indices >= self._shape[0])):
+      raise IndexError("index out of bounds for axis 0 with size %d" %
+                       self._shape[0])
+    out = np.empty(indices.shape + self._shape[1:], dtype=self._dtype)
+    chunk_ids = indices // self._chunk_rows
+    for idx in np.unique(chunk_ids):
+      mask = chunk_ids == idx
+      out[mask] = self._chunk(idx)[indices[mask] - idx * self._chunk_rows]
+    return out
+
+  def __getitem__(self, key):
+    if isinstance(key, tuple):
+      if len(key) == 0:
+        key, rest = slice(None), ()
+      else:
+        key, rest = key[0], key[1:]
+    else:
+      rest = ()
+    if key is Ellipsis:
+      key, rest = slice(None), (Ellipsis,) + rest
+    # ====== select the rows ====== #
+    if isinstance(key, slice):
+      start, stop, step = key.indices(self._shape[0])
+      if step == 1:
+        array = self._read_range(start, stop)
+      else:
+        array = self._read_rows(np.arange(start, stop, step))
+      n_dims = 1
+    elif isinstance(key, (int, np.integer)):
+      idx = int(key)
+      if idx < 0:
+        idx += self._shape[0]
+      if not 0 <= idx < self._shape[0]:
+        raise IndexError("index %d is out of bounds for axis 0 with size %d" %
+                         (int(key), self._shape[0]))
+      chunk = self._chunk(idx // self._chunk_rows)
+      array = np.array(chunk[idx % self._chunk_rows])
+      n_dims = 0
+    else:
+      key = np.asarray(key)
+      if key.dtype == np.bool_:
+        key = np.nonzero(key)[0]
+      array = self._read_rows(key)
+      n_dims = key.ndim
+    # ====== the other dimensions ====== #
+    if len(rest) > 0:
+      array = array[(slice(None),) * n_dims + rest]
+    return array
+
+  def __iter__(self):
+    for idx in range(self.n_chunks):
+      for row in self._chunk(idx):
+        yield row
+
+  def close(self):
+    self._cache.clear()
+    self._mmap.close()
+
+  def __repr__(self):
+    return '<CompressedArray shape:%s dtype:%s chunks:%d path:%s>' % (str(
+        self.shape), str(self.dtype), self.n_chunks, self.path)
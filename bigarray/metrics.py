@@ -0,0 +1,260 @@
+from __future__ import absolute_import, division, print_function
+
+import logging
+import os
+import threading
+import time
+from typing import Optional
+
+try:
+  import resource
+except ImportError:  # `getrusage` is not supported on Windows
+  resource = None
+
+__all__ = [
+    'enable_metrics',
+    'get_metrics',
+    'reset_metrics',
+    'format_metrics',
+    'log_metrics',
+]
+
+# the latency histograms have power-of-two buckets (in microseconds), the
+# bucket `i` counts the latencies in `[2^(i-1), 2^i)`, the last bucket
+# counts everything above ~16 seconds
+_N_BUCKETS = 26
+_RUSAGE_SELF = None if resource is None else resource.RUSAGE_SELF
+# the faults of an operation are counted on the calling thread
+_RUSAGE_THREAD = None if resource is None else \
+  getattr(resource, 'RUSAGE_THREAD', resource.RUSAGE_SELF)
+
+
+# ===========================================================================
+# Helper
+# ===========================================================================
+def _faults(who):
+  if resource is None:
+    return 0, 0
+  usage = resource.getrusage(who)
+  return usage.ru_minflt, usage.ru_majflt
+
+
+def _percentile(histogram, count, q, max_us):
+  """ The upper edge of the bucket containing the quantile `q` """
+  rank = q * count
+  total = 0
+  for i, n in enumerate(histogram):
+    total += n
+    if total >= rank:
+      return min(float(2**i), max_us)
+  return max_us
+
+
+def _format_bytes(nbytes):
+  for unit in ('B', 'KB', 'MB', 'GB'):
+    if nbytes < 1024:
+      return '%.1f%s' % (nbytes, unit)
+    nbytes /= 1024
+  return '%.1fTB' % nbytes
+
+
+class _Operation(object):
+
+  def __init__(self):
+    self.count = 0
+    self.seconds = 0.
+    self.max_seconds = 0.
+    self.bytes = 0
+    self.rows = 0
+    self.minor_faults = 0
+    self.major_faults = 0
+    self.histogram = [0] * _N_BUCKETS
+
+  def add(self, seconds, nbytes, rows, minor_faults, major_faults):
+    self.count += 1
+    self.seconds += seconds
+    self.max_seconds = max(self.max_seconds, seconds)
+    self.bytes += nbytes
+    self.rows += rows
+    self.minor_faults += minor_faults
+    self.major_faults += major_faults
+    self.histogram[min(int(seconds * 1e6).bit_length(), _N_BUCKETS - 1)] += 1
+
+  def to_dict(self):
+    max_us = self.max_seconds * 1e6
+    return dict(count=self.count,
+                seconds=self.seconds,
+                mean_us=self.seconds * 1e6 / max(self.count, 1),
+                max_us=max_us,
+                p50_us=_percentile(self.histogram, self.count, 0.5, max_us),
+                p99_us=_percentile(self.histogram, self.count, 0.99, max_us),
+                bytes=self.bytes,
+                rows=self.rows,
+                minor_faults=self.minor_faults,
+                major_faults=self.major_faults,
+                histogram=list(self.histogram))
+
+
+class _Metrics(object):
+  """ The process-wide counters, the instrumented code calls `start` and
+  `stop`, which return right away when the metrics are disabled """
+
+  def __init__(self):
+    self.enabled = os.environ.get('BIGARRAY_METRICS', '') not in ('', '0')
+    self._lock = threading.Lock()
+    self._operations = {}
+    self._reset_time = time.time()
+    self._reset_faults = _faults(_RUSAGE_SELF)
+
+  def start(self):
+    if not self.enabled:
+      return None
+    return (time.perf_counter(),) + _faults(_RUSAGE_THREAD)
+
+  def stop(self, name, token, nbytes=0, rows=0):
+    if token is None:
+      return
+    seconds = time.perf_counter() - token[0]
+    minor, major = _faults(_RUSAGE_THREAD)
+    with self._lock:
+      operation = self._operations.get(name, None)
+      if operation is None:
+        operation = self._operations[name] = _Operation()
+      operation.add(seconds, int(nbytes), int(rows), minor - token[1],
+                    major - token[2])
+
+  def reset(self):
+    with self._lock:
+      self._operations = {}
+      self._reset_time = time.time()
+      self._reset_faults = _faults(_RUSAGE_SELF)
+
+  def to_dict(self, reset=False):
+    minor, major = _faults(_RUSAGE_SELF)
+    with self._lock:
+      metrics = dict(enabled=self.enabled,
+                     seconds=time.time() - self._reset_time,
+                     minor_faults=minor - self._reset_faults[0],
+                     major_faults=major - self._reset_faults[1],
+                     histogram_edges_us=[2**i for i in range(_N_BUCKETS)],
+                     operations={
+                         k: v.to_dict() for k, v in self._operations.items()
+                     })
+    if reset:
+      self.reset()
+    return metrics
+
+
+_METRICS = _Metrics()
+
+
+class _MetricsLogger(threading.Thread):
+
+  def __init__(self, interval, logger, level, reset):
+    super(_MetricsLogger, self).__init__(name='bigarray-metrics', daemon=True)
+    self.interval = float(interval)
+    self.logger = logger
+    self.level = level
+    self.reset = reset
+    self._stop_event = threading.Event()
+
+  def run(self):
+    while not self._stop_event.wait(self.interval):
+      self.logger.log(self.level, format_metrics(get_metrics(reset=self.reset)))
+
+  def stop(self):
+    """ Stop logging, the thread exits right away """
+    self._stop_event.set()
+    self.join()
+
+
+# ===========================================================================
+# Main
+# ===========================================================================
+def enable_metrics(enabled: bool = True):
+  """ Enable (or disable) the instrumentation of `MmapArrayWriter`,
+  `MmapArray` and `PointerArray`: the counters and latency histograms of
+  the opens, header reads, resizes, writes, flushes, index loads and key
+  lookups, with the page faults of each operation.
+
+  The metrics are disabled by default (or enabled by the environment
+  variable `BIGARRAY_METRICS=1`), the instrumented code only checks a flag
+  when they are disabled.
+  """
+  _METRICS.enabled = bool(enabled)
+
+
+def get_metrics(reset: bool = False) -> dict:
+  """ Return the metrics since the last reset
+
+  Parameters
+  ----------
+  reset : `bool`
+    if `True`, reset the metrics after reading them
+
+  Return
+  ------
+  a dictionary: 'enabled', 'seconds' since the last reset, the
+    'minor_faults' and 'major_faults' of the process, the
+    'histogram_edges_us' (the upper edge of each latency bucket), and the
+    'operations', for each operation: 'count', 'seconds', 'mean_us',
+    'max_us', 'p50_us', 'p99_us' (estimated from the histogram), 'bytes',
+    'rows', 'minor_faults', 'major_faults' and 'histogram'
+  """
+  return _METRICS.to_dict(reset=reset)
+
+
+def reset_metrics():
+  _METRICS.reset()
+
+
+def format_metrics(metrics: Optional[dict] = None) -> str:
+  """ Format the metrics (by default, the current metrics) as a single log
+  line """
+  if metrics is None:
+    metrics = get_metrics()
+  texts = [
+      'bigarray %.1fs faults minor:%d major:%d' %
+      (metrics['seconds'], metrics['minor_faults'], metrics['major_faults'])
+  ]
+  for name, op in sorted(metrics['operations'].items()):
+    text = '%s n:%d' % (name, op['count'])
+    if op['bytes'] > 0:
+      text += ' %s' % _format_bytes(op['bytes'])
+    if op['rows'] > 0:
+      text += ' rows:%d' % op['rows']
+    text += ' p50:%.0fus p99:%.0fus max:%.0fus' % (op['p50_us'], op['p99_us'],
+                                                   op['max_us'])
+    if op['major_faults'] > 0:
+      text += ' major_faults:%d' % op['major_faults']
+    texts.append(text)
+  return ' | '.join(texts)
+
+
+def log_metrics(interval: float = 60.,
+                logger: Optional[logging.Logger] = None,
+                level: int = logging.INFO,
+                reset: bool = False) -> _MetricsLogger:
+  """ Log the metrics periodically (see `format_metrics`) on a daemon
+  thread
+
+  Parameters
+  ----------
+  interval : `float`
+    number of seconds between two log lines
+  logger : `logging.Logger` (optional)
+    the logger, `logging.getLogger('bigarray')` by default
+  level : `int`
+    the logging level
+  reset : `bool`
+    if `True`, each line reports the metrics since the previous line
+
+  Return
+  ------
+  the logging thread, call its `stop()` method to stop logging
+  """
+  if logger is None:
+    logger = logging.getLogger('bigarray')
+  thread = _MetricsLogger(interval, logger, level, reset)
+  thread.start()
+  return thread
@@ -1,27 +1,353 @@
 from __future__ import absolute_import, division, print_function
 
+import asyncio
 import marshal
+import mmap
 import os
+import struct
+import threading
 import warnings
-from collections import OrderedDict
+import weakref
+from collections import OrderedDict, deque, namedtuple
+from concurrent.futures import (Future, ProcessPoolExecutor, ThreadPoolExecutor)
 from contextlib import contextmanager
 from typing import Iterable, List, Optional, Text, Tuple, Union
 
 import numpy as np
 from six import string_types
 
+try:
+  import fcntl
+except ImportError:  # `O_DIRECT` is not supported on Windows
+  fcntl = None
+
+from bigarray.metrics import _METRICS
+from bigarray.row_cache import RowCache
+
 __all__ = [
+    'DURABILITY_LEVELS',
     'get_total_opened_mmap',
+    'get_mmap_pool_stats',
+    'set_mmap_pool_limits',
+    'get_aio_stats',
+    'set_aio_limits',
     'read_mmaparray_header',
+    'read_mmaparray_metadata',
+    'write_mmaparray_metadata',
     'MmapArrayWriter',
     'MmapArray',
 ]
 
+# maximum number of writers keeping their file mapped, the least recently
+# used writers are unmapped (and remapped on the next access)
 MAX_OPEN_MMAP = 120
 _INSTANCES_WRITER = OrderedDict()
+# default limits of the pool of read-only mappings
+MAX_POOL_HANDLES = 512
+MAX_POOL_BYTES = None
+# default limits of the asynchronous reads: number of reading threads, and
+# number of reads in flight for each event loop (the others wait)
+MAX_AIO_WORKERS = 16
+MAX_AIO_INFLIGHT = 64
+# version 1 header: `mmapdata`, 8 bytes size, marshal `[dtype, shape]`
 _HEADER = b'mmapdata'
 _HEADER_SIZE_LENGTH = 8
 _MAXIMUM_HEADER_SIZE = 486
+# version 2 header: a fixed-size preamble `magic, version, ndim,
+# data_offset, metadata_offset, metadata_size, metadata_capacity, dtype,
+# shape` followed by the marshal-encoded metadata dictionary, the data starts
+# at `data_offset`
+_HEADER_V2 = b'mmapdat2'
+_MAX_NDIM = 32
+_PREAMBLE = struct.Struct('<8sII4Q32s%dq' % _MAX_NDIM)
+_PREAMBLE_SIZE = 512
+_METADATA_SIZE_OFFSET = 32
+_SHAPE_OFFSET = _PREAMBLE.size - 8 * _MAX_NDIM
+# default number of bytes reserved for the metadata of new files
+_METADATA_CAPACITY = 4096 - _PREAMBLE_SIZE
+# default alignment of the data of version 2 files, e.g. use `2 * 1024 * 1024`
+# for huge pages
+DATA_ALIGNMENT = 4096
+# `O_DIRECT` requires the offsets, sizes and buffers aligned to the logical
+# block size of the device (at most 4096 in practice)
+_DIRECT_IO_ALIGNMENT = 4096
+# size of each `O_DIRECT` read (in bytes)
+_DIRECT_IO_CHUNK = 8 * 1024 * 1024
+# a single read covers both the version 1 header and the preamble
+_HEADER_READ_SIZE = 512
+HEADER_VERSION = 2
+# 'none' - nothing is written
+# 'page_cache' - the header (and indices) are written to the page cache
+# 'data' - the data is synchronized to the disk
+# 'index' - the data, header and indices are synchronized to the disk
+DURABILITY_LEVELS = ('none', 'page_cache', 'data', 'index')
+# copies bigger than this (in bytes) are split among the write workers
+_PARALLEL_WRITE_SIZE = 16 * 1024 * 1024
+# default size of the blocks (in bytes) read by `MmapArray.map_blocks`
+_MAP_BLOCK_SIZE = 16 * 1024 * 1024
+# scattered reads are sorted and the ranges separated by at most this number
+# of bytes are merged into a single read, see `_coalesce_ranges`. The reads
+# with system calls (`aread`, `agather`) are always coalesced, the reads of
+# the mapped memory (integer indexing, `gather`) only if `COALESCE_READS`
+# (the page faults of the mapped memory already read ahead, the extra copy
+# of the runs costs more than it saves for the page cache)
+COALESCE_READS = False
+COALESCE_GAP = 32 * 1024
+# integer indexing with fewer rows is not coalesced, and the runs must have
+# this number of rows on average
+_COALESCE_MIN_ROWS = 32
+# access pattern -> the name of madvise flag
+_ACCESS_PATTERNS = {
+    'normal': 'MADV_NORMAL',
+    'random': 'MADV_RANDOM',
+    'sequential': 'MADV_SEQUENTIAL',
+    'willneed': 'MADV_WILLNEED',
+    'dontneed': 'MADV_DONTNEED',
+}
+
+_MMAP_ACCESS = {
+    'r': mmap.ACCESS_READ,
+    'readonly': mmap.ACCESS_READ,
+    'r+': mmap.ACCESS_WRITE,
+    'readwrite': mmap.ACCESS_WRITE,
+    'c': mmap.ACCESS_COPY,
+    'copyonwrite': mmap.ACCESS_COPY,
+}
+
+
+# ===========================================================================
+# Pool of opened mmap
+# ===========================================================================
+class _MmapPool(object):
+  """ A process-wide LRU cache of the mapped files for `MmapArray`, each
+  entry maps the whole file and keeps its header, so opening the same file
+  again neither reads the header nor creates a new mapping.
+
+  The entries are validated by the size, modification time and inode of
+  the file, a changed file is mapped again. When the number of entries or
+  the mapped bytes exceed the limits, the least recently used entries are
+  evicted: idle mappings are unmapped right away, the mappings still used
+  by some arrays are unmapped when those arrays are released.
+  """
+
+  def __init__(self, max_handles=MAX_POOL_HANDLES, max_bytes=MAX_POOL_BYTES):
+    self.max_handles = max_handles
+    self.max_bytes = max_bytes
+    self._entries = OrderedDict()
+    self._nbytes = 0
+    self._lock = threading.RLock()
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+
+  def _release(self, key):
+    # the file is unmapped (and closed) when the last array using the
+    # mapping is released, closing it here would invalidate those arrays
+    mm, _, _, _ = self._entries.pop(key)
+    self._nbytes -= len(mm)
+    self.evictions += 1
+
+  def evict(self):
+    """ Evict the least recently used entries until the pool is within
+    the limits, the most recent entry is always kept """
+    with self._lock:
+      while len(self._entries) > 1 and \
+        ((self.max_handles is not None and
+          len(self._entries) > self.max_handles) or
+         (self.max_bytes is not None and self._nbytes > self.max_bytes)):
+        self._release(next(iter(self._entries)))
+
+  def clear(self):
+    with self._lock:
+      for key in list(self._entries.keys()):
+        self._release(key)
+
+  def discard(self, path, mode):
+    """ Evict the entry of the file (if any), the mapping is closed when the
+    arrays using it are released """
+    key = (path, _MMAP_ACCESS.get(mode, None))
+    with self._lock:
+      if key in self._entries:
+        self._release(key)
+
+  def get(self, path, mode):
+    """ Return `(mmap, dtype, shape, offset)` of the file """
+    if mode not in _MMAP_ACCESS:
+      raise ValueError("mode must be one of: %s; given: %s" %
+                       (', '.join(_MMAP_ACCESS.keys()), str(mode)))
+    access = _MMAP_ACCESS[mode]
+    stat = os.stat(path)
+    version = (stat.st_size, stat.st_mtime_ns, stat.st_ino)
+    key = (path, access)
+    with self._lock:
+      # copy-on-write mappings are private to each array
+      if access != mmap.ACCESS_COPY and key in self._entries:
+        mm, header, old_version, offset = self._entries[key]
+        if old_version == version:
+          self._entries.move_to_end(key)
+          self.hits += 1
+          return (mm,) + header + (offset,)
+        self._release(key)
+      self.misses += 1
+    with open(path, 'rb' if access == mmap.ACCESS_READ else 'rb+') as f:
+      header = _read_header(f.fileno())
+      mm = mmap.mmap(f.fileno(), 0, access=access)
+    dtype, shape, offset = header.dtype, header.shape, header.data_offset
+    if access != mmap.ACCESS_COPY:
+      with self._lock:
+        if key in self._entries:
+          self._release(key)
+        self._entries[key] = (mm, (dtype, shape), version, offset)
+        self._nbytes += len(mm)
+      self.evict()
+    return mm, dtype, shape, offset
+
+  def stats(self):
+    with self._lock:
+      return dict(handles=len(self._entries),
+                  bytes=self._nbytes,
+                  hits=self.hits,
+                  misses=self.misses,
+                  evictions=self.evictions,
+                  writers=len(
+                      [w for w in _INSTANCES_WRITER.values() if w.is_mapped]))
+
+
+_POOL = _MmapPool()
+
+
+# ===========================================================================
+# Asynchronous reads
+# ===========================================================================
+def _pread_into(path, offset, out):
+  """ Read the file from `offset` into the contiguous array `out` """
+  view = memoryview(out).cast('B')
+  fd = os.open(path, os.O_RDONLY)
+  try:
+    position = 0
+    while position < len(view):
+      if hasattr(os, 'preadv'):
+        n = os.preadv(fd, [view[position:]], offset + position)
+      else:
+        data = os.pread(fd, len(view) - position, offset + position)
+        n = len(data)
+        view[position:position + n] = data
+      if n <= 0:
+        raise IOError("Unexpected end of file '%s' at position %d" %
+                      (path, offset + position))
+      position += n
+  finally:
+    os.close(fd)
+  return out
+
+
+class _AsyncReader(object):
+  """ Run the reads of the coroutines on a bounded thread pool, so page
+  faults and disk reads never block the event loop.
+
+  Each event loop has a semaphore limiting the reads in flight
+  (backpressure), and a table of the byte ranges being read, a request
+  contained in a range in flight waits for that read and copies its bytes
+  instead of reading the file again.
+  """
+
+  def __init__(self,
+               max_workers=MAX_AIO_WORKERS,
+               max_inflight=MAX_AIO_INFLIGHT):
+    self.max_workers = max_workers
+    self.max_inflight = max_inflight
+    self._executor = None
+    self._lock = threading.Lock()
+    # event loop -> (semaphore, {path: {(start, end): waiting requests}})
+    self._loops = weakref.WeakKeyDictionary()
+    self.reads = 0
+    self.coalesced = 0
+    self.bytes = 0
+
+  def executor(self):
+    with self._lock:
+      if self._executor is None:
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers)
+      return self._executor
+
+  def shutdown(self):
+    with self._lock:
+      if self._executor is not None:
+        self._executor.shutdown(wait=True)
+      self._executor = None
+      self._loops = weakref.WeakKeyDictionary()
+
+  def _state(self):
+    loop = asyncio.get_event_loop()
+    state = self._loops.get(loop, None)
+    if state is None:
+      state = (asyncio.Semaphore(self.max_inflight), {})
+      self._loops[loop] = state
+    return loop, state
+
+  async def run(self, fn, *args):
+    """ Run `fn(*args)` on the reading threads """
+    loop, (semaphore, _) = self._state()
+    async with semaphore:
+      return await loop.run_in_executor(self.executor(), fn, *args)
+
+  async def read(self, path, offset, out):
+    """ Read the file from `offset` into the contiguous array `out` """
+    loop, (semaphore, inflight) = self._state()
+    nbytes = out.nbytes
+    end = offset + nbytes
+    ranges = inflight.setdefault(path, {})
+    # ====== coalesce with a read in flight ====== #
+    for (start, stop), waiters in list(ranges.items()):
+      if start <= offset and end <= stop:
+        self.coalesced += 1
+        waiter = loop.create_future()
+        waiters.append((offset - start, out, waiter))
+        await waiter
+        return out
+    # ====== read the file ====== #
+    key = (offset, end)
+    waiters = []
+    ranges[key] = waiters
+    try:
+      async with semaphore:
+        await loop.run_in_executor(self.executor(), _pread_into, path, offset,
+                                   out)
+      self.reads += 1
+      self.bytes += nbytes
+      # the bytes are copied to the waiting requests before `out` is
+      # returned, its caller could modify it afterward
+      data = memoryview(out).cast('B')
+      for shift, waiter_out, waiter in waiters:
+        if not waiter.done():
+          memoryview(waiter_out).cast('B')[:] = \
+            data[shift:shift + waiter_out.nbytes]
+          waiter.set_result(None)
+    except asyncio.CancelledError:
+      for _, _, waiter in waiters:
+        waiter.cancel()
+      raise
+    except BaseException as e:
+      for _, _, waiter in waiters:
+        if not waiter.done():
+          waiter.set_exception(e)
+      raise
+    finally:
+      if ranges.get(key) is waiters:
+        del ranges[key]
+      if len(ranges) == 0 and inflight.get(path) is ranges:
+        del inflight[path]
+    return out
+
+  def stats(self):
+    return dict(reads=self.reads,
+                coalesced=self.coalesced,
+                bytes=self.bytes,
+                max_workers=self.max_workers,
+                max_inflight=self.max_inflight)
+
+
+_AIO = _AsyncReader()
 
 
 # ===========================================================================
@@ -31,6 +357,76 @@ def get_total_opened_mmap():
   return len(_INSTANCES_WRITER)
 
 
+def get_mmap_pool_stats() -> dict:
+  """ Return the statistics of the process-wide pool of mapped files:
+  number of `handles`, mapped `bytes`, `hits`, `misses`, `evictions` of
+  the readers, and the number of `writers` keeping their file mapped """
+  return _POOL.stats()
+
+
+def set_mmap_pool_limits(max_handles: Optional[int] = MAX_POOL_HANDLES,
+                         max_bytes: Optional[int] = MAX_POOL_BYTES):
+  """ Set the limits of the process-wide pool of mapped files used by
+  `MmapArray`, `None` means unlimited. Exceeding mappings are evicted
+  (least recently used first). """
+  _POOL.max_handles = None if max_handles is None else max(1, int(max_handles))
+  _POOL.max_bytes = None if max_bytes is None else max(0, int(max_bytes))
+  _POOL.evict()
+
+
+def get_aio_stats() -> dict:
+  """ Return the statistics of the asynchronous reads (`MmapArray.aread`):
+  number of `reads` and `bytes` read from the files, the number of requests
+  `coalesced` with a read in flight, and the limits """
+  return _AIO.stats()
+
+
+def set_aio_limits(max_workers: int = MAX_AIO_WORKERS,
+                   max_inflight: int = MAX_AIO_INFLIGHT):
+  """ Set the number of threads for the asynchronous reads, and the maximum
+  number of reads in flight for each event loop, the other reads wait
+  (backpressure). The limits apply to the event loops and the thread pool
+  created after this call. """
+  _AIO.shutdown()
+  _AIO.max_workers = max(1, int(max_workers))
+  _AIO.max_inflight = max(1, int(max_inflight))
+
+
+_Header = namedtuple('_Header', [
+    'version', 'dtype', 'shape', 'data_offset', 'metadata_offset',
+    'metadata_size', 'metadata_capacity'
+])
+
+
+def _read_header(fd) -> _Header:
+  """ Read the header of an opened file with a single `pread` """
+  token = _METRICS.start()
+  header = _parse_header(os.pread(fd, _HEADER_READ_SIZE, 0))
+  _METRICS.stop('header_read', token)
+  return header
+
+
+def _parse_header(buffer) -> _Header:
+  magic = buffer[:len(_HEADER)]
+  # ====== version 2 ====== #
+  if magic == _HEADER_V2 and len(buffer) >= _PREAMBLE.size:
+    fields = _PREAMBLE.unpack_from(buffer)
+    ndim = fields[2]
+    return _Header(fields[1], fields[7].rstrip(b'\0').decode(),
+                   tuple(fields[8:8 + ndim]), fields[3], fields[4], fields[5],
+                   fields[6])
+  # ====== version 1 ====== #
+  if magic != _HEADER:
+    raise ValueError('Invalid header for MmapData.')
+  try:
+    size = int(buffer[len(_HEADER):len(_HEADER) + _HEADER_SIZE_LENGTH])
+    start = len(_HEADER) + _HEADER_SIZE_LENGTH
+    dtype, shape = marshal.loads(buffer[start:start + size])
+  except Exception as e:
+    raise Exception('Error reading memmap data file: %s' % str(e))
+  return _Header(1, dtype, shape, _aligned_memmap_offset(dtype), start, 0, 0)
+
+
 def read_mmaparray_header(path, return_header_size=False):
   """ Reading header (if available) of a MmapArray
 
@@ -38,34 +434,331 @@ def read_mmaparray_header(path, return_header_size=False):
   ----------
   path : `str`
     Input path to a file
+  return_header_size : `bool`
+    if `True`, also return the size of the header, i.e. the offset of the
+    data within the file
 
   Return
   ------
   dtype, shape
     Necessary information to create numpy.memmap
   """
-  header_size = 0
   with open(path, mode='rb') as f:
-    # ====== check header signature ====== #
-    if f.read(len(_HEADER)) != _HEADER:
-      raise ValueError('Invalid header for MmapData.')
-    header_size += len(_HEADER)
-    # ====== 8 bytes for size of info ====== #
+    header = _read_header(f.fileno())
+  if return_header_size:
+    return header.dtype, header.shape, header.data_offset
+  return header.dtype, header.shape
+
+
+def _read_metadata(fd) -> dict:
+  header = _read_header(fd)
+  if header.metadata_size == 0:
+    return {}
+  return marshal.loads(
+      os.pread(fd, header.metadata_size, header.metadata_offset))
+
+
+def _write_metadata(fd, metadata):
+  header = _read_header(fd)
+  if header.version < 2:
+    raise ValueError("Metadata is only supported by the version 2 header")
+  data = marshal.dumps(metadata)
+  if len(data) > header.metadata_capacity:
+    raise ValueError("The metadata (%d bytes) exceeds the reserved capacity "
+                     "(%d bytes), use a bigger `metadata_size` when creating "
+                     "the file" % (len(data), header.metadata_capacity))
+  os.pwrite(fd, data, header.metadata_offset)
+  os.pwrite(fd, struct.pack('<Q', len(data)), _METADATA_SIZE_OFFSET)
+
+
+def read_mmaparray_metadata(path) -> dict:
+  """ Read the metadata dictionary stored in the header of a MmapArray,
+  files with the version 1 header have no metadata """
+  with open(path, mode='rb') as f:
+    return _read_metadata(f.fileno())
+
+
+def write_mmaparray_metadata(path, metadata: dict):
+  """ Replace the metadata dictionary stored in the header of a MmapArray,
+  the values must be supported by `marshal` (e.g. numbers, strings, bytes,
+  tuples, lists and dictionaries) and fit the capacity reserved when the
+  file was created """
+  with open(path, mode='rb+') as f:
+    _write_metadata(f.fileno(), metadata)
+  if 'statistics' in metadata:
+    _mark_statistics(path)
+
+
+def _mark_statistics(path):
+  """ The statistics are cached in the metadata of the file, the opened
+  writer of the file removes them on the next write """
+  writer = _INSTANCES_WRITER.get(os.path.abspath(path), None)
+  if writer is not None and not writer.is_closed:
+    writer._has_statistics = True
+
+
+def _coalesce_ranges(starts, ends, max_gap):
+  """ Plan the reads of the ranges `[starts[i], ends[i])` of the first
+  dimension: the ranges are sorted and those separated by at most `max_gap`
+  rows are merged into runs.
+
+  Return
+  ------
+  run_starts, run_ends : the runs (sorted)
+  run_offsets : the position of each run within the concatenated runs
+  shifts : the range `i` starts at row `shifts[i]` of the concatenated runs
+  """
+  n = starts.shape[0]
+  if n == 0:
+    empty = np.zeros((0,), dtype='int64')
+    return empty, empty, np.zeros((1,), dtype='int64'), empty
+  order = np.argsort(starts, kind='stable')
+  sorted_starts = starts[order]
+  sorted_ends = ends[order]
+  # the runs are split where a range starts after all the previous ranges
+  # (plus the gap)
+  reach = np.maximum.accumulate(sorted_ends)
+  is_first = np.ones((n,), dtype=np.bool_)
+  is_first[1:] = sorted_starts[1:] > reach[:-1] + max_gap
+  first = np.flatnonzero(is_first)
+  last = np.append(first[1:], n) - 1
+  run_starts = sorted_starts[first]
+  run_ends = reach[last]
+  run_offsets = np.zeros((first.shape[0] + 1,), dtype='int64')
+  np.cumsum(run_ends - run_starts, out=run_offsets[1:])
+  run_ids = np.cumsum(is_first) - 1
+  shifts = np.empty((n,), dtype='int64')
+  shifts[order] = run_offsets[run_ids] + sorted_starts - run_starts[run_ids]
+  return run_starts, run_ends, run_offsets, shifts
+
+
+def _read_coalesced(array, starts, ends):
+  """ Read the ranges `[starts[i], ends[i])` of the first dimension as a few
+  contiguous runs, return `(buffer, shifts)` where the range `i` is
+  `buffer[shifts[i]:shifts[i] + ends[i] - starts[i]]`.
+
+  Return `None` if coalescing does not pay off, i.e. the ranges are
+  scattered over a span much bigger than the requested rows (the extra
+  sort and copy cost more than the page faults they save), or the
+  runs are short (a single fancy indexing is faster than the slices). """
+  total = int(np.sum(ends - starts))
+  if total == 0 or int(np.max(ends)) - int(np.min(starts)) > 2 * total:
+    return None
+  row_size = array.dtype.itemsize * \
+    int(np.prod(array.shape[1:], dtype='int64'))
+  run_starts, run_ends, run_offsets, shifts = _coalesce_ranges(
+      starts, ends, COALESCE_GAP // max(row_size, 1))
+  n_runs = run_starts.shape[0]
+  if n_runs * _COALESCE_MIN_ROWS > int(run_offsets[-1]):
+    return None
+  buffer = np.empty((int(run_offsets[-1]),) + tuple(array.shape[1:]),
+                    dtype=array.dtype)
+  for start, end, offset in zip(run_starts.tolist(), run_ends.tolist(),
+                                run_offsets.tolist()):
+    buffer[offset:offset + end - start] = array[start:end]
+  return buffer, shifts
+
+
+async def _aread_coalesced(array, starts, ends):
+  """ Read the ranges `[starts[i], ends[i])` of a `MmapArray` with
+  concurrent `os.preadv` of the coalesced runs, return `(buffer, shifts)`
+  (see `_read_coalesced`) """
+  offset, row_size = array._direct_range()
+  run_starts, run_ends, run_offsets, shifts = _coalesce_ranges(
+      starts, ends, COALESCE_GAP // max(row_size, 1))
+  buffer = np.empty((int(run_offsets[-1]),) + array.shape[1:],
+                    dtype=array.dtype)
+  await asyncio.gather(*[
+      _AIO.read(array.path, offset + start * row_size, buffer[pos:pos + end -
+                                                              start])
+      for start, end, pos in zip(run_starts.tolist(), run_ends.tolist(),
+                                 run_offsets.tolist())
+      if end > start
+  ])
+  return buffer, shifts
+
+
+def _gather_ranges(array,
+                   starts,
+                   ends,
+                   padding=False,
+                   pad_value=0,
+                   coalesce=None):
+  """ Copy many ranges `array[starts[i]:ends[i]]` of the first dimension
+  with a single fancy indexing, return `(data, offsets)`, or
+  `(batch, lengths)` if `padding=True`. Scattered ranges are read in the
+  sorted order and the nearby ranges are merged (see `_coalesce_ranges`) """
+  if isinstance(array, np.ndarray):
+    array = array.view(np.ndarray)
+  starts = np.asarray(starts, dtype='int64')
+  ends = np.asarray(ends, dtype='int64')
+  lengths = ends - starts
+  n = starts.shape[0]
+  if coalesce is None:
+    coalesce = COALESCE_READS
+  if coalesce and n > 1:
+    coalesced = _read_coalesced(array, starts, ends)
+    if coalesced is not None:
+      array, starts = coalesced
+  # ====== padded batch ====== #
+  if padding:
+    max_length = int(lengths.max()) if n > 0 else 0
+    positions = np.arange(max_length, dtype='int64')
+    mask = positions[None, :] < lengths[:, None]
+    rows = np.where(mask, starts[:, None] + positions[None, :], 0)
+    batch = array[rows]
+    batch[~mask] = pad_value
+    return batch, lengths
+  # ====== concatenated ====== #
+  offsets = np.zeros((n + 1,), dtype='int64')
+  np.cumsum(lengths, out=offsets[1:])
+  rows = np.arange(offsets[-1], dtype='int64') + \
+    np.repeat(starts - offsets[:-1], lengths)
+  return array[rows], offsets
+
+
+def _completed_future(result):
+  future = Future()
+  future.set_result(result)
+  return future
+
+
+def _mmap_address(mm):
+  """ The memory address of the start of a mmap """
+  return np.frombuffer(mm, dtype=np.uint8, count=0).ctypes.data
+
+
+def _rebuild_mmaparray(subtype, path, mode, offset, shape, strides, dtype):
+  """ Unpickle a view of `MmapArray` from its descriptor, the file is mapped
+  (or reused from the pool) without copying any data """
+  mm, _, _, _ = _POOL.get(path, mode)
+  array = np.ndarray.__new__(subtype,
+                             shape,
+                             dtype=dtype,
+                             buffer=mm,
+                             offset=offset,
+                             strides=strides)
+  array._mmap = mm
+  array.filename = path
+  array.offset = offset
+  array.mode = mode
+  array._path = path
+  return array
+
+
+def _madvise_rows(array, advice, start, end):
+  """ Call `madvise` on the memory of rows `[start, end)` of a
+  memory-mapped array, return `False` if it is not supported """
+  mm = getattr(array, '_mmap', None)
+  if mm is None or not hasattr(mm, 'madvise') or array.ndim == 0:
+    return False
+  n = array.shape[0]
+  start, end = max(0, min(start, n)), max(0, min(end, n))
+  if end <= start or array.strides[0] <= 0:
+    return False
+  # the position of the array within the mmap
+  base = _mmap_address(mm)
+  first = array.ctypes.data - base + start * array.strides[0]
+  last = array.ctypes.data - base + (end - 1) * array.strides[0] + \
+    array.itemsize * int(np.prod(array.shape[1:], dtype='int64'))
+  # madvise requires the start to be page-aligned
+  aligned = first - first % mmap.PAGESIZE
+  mm.madvise(advice, aligned, min(last, len(mm)) - aligned)
+  return True
+
+
+def _unmap_writers(keep=None):
+  """ Unmap the least recently used writers, so at most `MAX_OPEN_MMAP`
+  writers keep their file mapped """
+  mapped = [
+      w for w in _INSTANCES_WRITER.values() if w.is_mapped and w is not keep
+  ]
+  n = MAX_OPEN_MMAP - (1 if keep is not None else 0)
+  for writer in mapped[:max(0, len(mapped) - n)]:
+    writer._unmap()
+
+
+def _map_block(fn, block, row_shape, dtype):
+  """ Apply `fn` to a block of rows of `MmapArray.map_blocks` """
+  n = block.shape[0]
+  result = np.asarray(fn(np.asarray(block)))
+  if result.shape != (n,) + row_shape:
+    raise ValueError("fn must return an array of shape %s for a block of %d "
+                     "rows, given: %s" %
+                     (str((n,) + row_shape), n, str(result.shape)))
+  return np.ascontiguousarray(result, dtype=dtype)
+
+
+def _map_block_to_file(fn, block, start, path, data_offset, row_shape, dtype):
+  """ Apply `fn` to a block of rows and write the result to the rows from
+  `start` of the (preallocated) file, run by the worker processes of
+  `MmapArray.map_blocks` """
+  result = _map_block(fn, block, row_shape, dtype)
+  offset = data_offset + start * \
+    int(np.prod(row_shape, dtype='int64')) * dtype.itemsize
+  data = memoryview(result).cast('B')
+  with open(path, 'rb+') as f:
+    fd = f.fileno()
+    while len(data) > 0:
+      n = os.pwrite(fd, data, offset)
+      data = data[n:]
+      offset += n
+
+
+def _open_direct(path):
+  """ Open the file for reading with `O_DIRECT`, return `(fd, is_direct)`,
+  `is_direct=False` if the platform or the file system does not support it """
+  direct = getattr(os, 'O_DIRECT', 0)
+  if direct and fcntl is not None:
     try:
-      size = f.read(_HEADER_SIZE_LENGTH)
-      header_size += len(size)
+      return os.open(path, os.O_RDONLY | direct), True
+    except OSError:
+      pass
+  return os.open(path, os.O_RDONLY), False
+
+
+def _read_direct(fd, is_direct, buffer, offset, nbytes):
+  """ Read `nbytes` from the file `offset` into the (page-aligned) `buffer`,
+  the file is read from `offset` rounded down to `_DIRECT_IO_ALIGNMENT`,
+  return the position of `offset` within the buffer and `is_direct` (the
+  file system could reject `O_DIRECT` reads) """
+  shift = offset % _DIRECT_IO_ALIGNMENT
+  position = offset - shift
+  view = memoryview(buffer)
+  start = 0
+  end = shift + nbytes
+  while start < end:
+    size = min(_DIRECT_IO_CHUNK, end - start)
+    if is_direct:
+      # the size of the last chunk is rounded up (read until the end of
+      # the file)
+      size = int(np.ceil(size / _DIRECT_IO_ALIGNMENT)) * _DIRECT_IO_ALIGNMENT
+      try:
+        n = os.preadv(fd, [view[start:start + size]], position + start)
+      except OSError:
+        # the file system rejects `O_DIRECT`, read the file normally
+        fcntl.fcntl(fd, fcntl.F_SETFL,
+                    fcntl.fcntl(fd, fcntl.F_GETFL) & ~os.O_DIRECT)
+        is_direct = False
+        continue
+    else:
+      n = os.preadv(fd, [view[start:start + size]], position + start)
+    if n <= 0:
+      raise IOError("Unexpected end of file at position %d" %
+                    (position + start))
+    start += n
+  # the pages read without `O_DIRECT` are dropped from the page cache
+  if not is_direct and hasattr(os, 'posix_fadvise'):
+    os.posix_fadvise(fd, position, end, os.POSIX_FADV_DONTNEED)
+  return shift, is_direct
 
-      metadata = f.read(int(size))
-      header_size += len(metadata)
 
-      dtype, shape = marshal.loads(metadata)
-    except Exception as e:
-      f.close()
-      raise Exception('Error reading memmap data file: %s' % str(e))
-    # ====== return file object ====== #
-    if return_header_size:
-      return dtype, shape, header_size
-    return dtype, shape
+def _direct_buffer(nbytes):
+  """ A page-aligned buffer for `_read_direct` of `nbytes` bytes starting at
+  any offset """
+  size = int(np.ceil((nbytes + _DIRECT_IO_ALIGNMENT) /
+                     _DIRECT_IO_ALIGNMENT)) * _DIRECT_IO_ALIGNMENT
+  return mmap.mmap(-1, size)
 
 
 def _aligned_memmap_offset(dtype):
@@ -92,11 +785,48 @@ class MmapArrayWriter(object):
     data type
   remove_exist : boolean (default=False)
     if file at given path exists, remove it
+  growth_factor : `float` (default=1.0)
+    when appending requires a bigger file, the mapped capacity is multiplied
+    by this factor (e.g. `2.0` doubles the capacity), so the number of
+    remaps grows logarithmically with the number of appends.
+    `1.0` extends the file to exactly the requested length.
+  growth_chunk : `int` (default=0)
+    if positive, the mapped capacity is always rounded up to a multiple of
+    this number of rows.
+  write_workers : `int` (default=1)
+    number of threads for copying large arrays, the copy is split by row
+    ranges (numpy and `os.pwrite` release the GIL).
+  write_mode : {'mmap', 'pwrite'}
+    'mmap' - copy the data into the memory-mapped pages
+    'pwrite' - write the data through `os.pwrite` to the file descriptor,
+      which avoids page faults on dirtying the mapped pages
+  header_version : {1, 2}
+    format of the header of a new file, version 2 has a fixed-size
+    preamble and a metadata section (see `read_mmaparray_metadata`),
+    version 1 is readable by older versions of this library. Existing files
+    keep their version.
+  metadata_size : `int`
+    number of bytes reserved for the metadata of a new (version 2) file,
+    rounded up so the data starts at an `alignment` boundary
+  alignment : `int` (optional)
+    the data of a new (version 2) file starts at a multiple of this number
+    of bytes, `DATA_ALIGNMENT` (4 KiB) by default, e.g. `2 * 1024 * 1024`
+    for huge pages. The page-aligned data could be read with `O_DIRECT`,
+    see `MmapArray.read_direct`.
 
   Note
   ----
-  All changes won't be saved until you call `MmapArrayWriter.flush`
+  All changes won't be saved until you call `MmapArrayWriter.flush`.
+  The reserved (unused) capacity is truncated when the writer is closed.
   """
+  # a writer failed to initialize is neither mapped nor reused
+  _memmap = None
+  _is_closed = True
+  # the options that are not given when re-creating an opened writer
+  _DEFAULT_OPTIONS = dict(growth_factor=1.0,
+                          growth_chunk=0,
+                          write_workers=1,
+                          write_mode='mmap')
 
   def __new__(cls, path=None, *args, **kwargs):
     # ====== from pickling ====== #
@@ -114,10 +844,6 @@ class MmapArrayWriter(object):
       obj = _INSTANCES_WRITER[path]
       if not obj.is_closed:
         return obj
-    # ====== increase memmap count ====== #
-    if get_total_opened_mmap() > MAX_OPEN_MMAP:
-      raise RuntimeError("Only allowed to open maximum of %d memmap file" %
-                         MAX_OPEN_MMAP)
     # ====== create new instance ====== #
     new_instance = super(MmapArrayWriter, cls).__new__(cls)
     _INSTANCES_WRITER[path] = new_instance
@@ -127,11 +853,73 @@ class MmapArrayWriter(object):
                path: Text,
                shape: Optional[List[int]] = None,
                dtype: Optional[Union[Text, np.dtype]] = None,
-               remove_exist: bool = False):
+               remove_exist: bool = False,
+               growth_factor: float = 1.0,
+               growth_chunk: int = 0,
+               write_workers: int = 1,
+               write_mode: Text = 'mmap',
+               header_version: int = HEADER_VERSION,
+               metadata_size: int = _METADATA_CAPACITY,
+               alignment: Optional[int] = None):
     super(MmapArrayWriter, self).__init__()
-    self._init(path, shape, dtype, remove_exist)
+    # the opened writer of the same path is returned by `__new__`, its
+    # header could be dirty so it is not initialized again
+    if not self.is_closed:
+      self._check_reopen(shape,
+                         dtype,
+                         remove_exist,
+                         growth_factor=growth_factor,
+                         growth_chunk=growth_chunk,
+                         write_workers=write_workers,
+                         write_mode=write_mode)
+      return
+    self._init(path,
+               shape,
+               dtype,
+               remove_exist,
+               growth_factor=growth_factor,
+               growth_chunk=growth_chunk,
+               write_workers=write_workers,
+               write_mode=write_mode,
+               header_version=header_version,
+               metadata_size=metadata_size,
+               alignment=alignment)
 
-  def _init(self, path, shape, dtype, remove_exist):
+  def _init(self,
+            path,
+            shape,
+            dtype,
+            remove_exist,
+            growth_factor=1.0,
+            growth_chunk=0,
+            write_workers=1,
+            write_mode='mmap',
+            header_version=HEADER_VERSION,
+            metadata_size=_METADATA_CAPACITY,
+            alignment=None):
+    if growth_factor < 1.0:
+      raise ValueError("growth_factor must be greater or equal to 1.0, "
+                       "given: %s" % str(growth_factor))
+    if write_mode not in ('mmap', 'pwrite'):
+      raise ValueError("write_mode must be 'mmap' or 'pwrite', given: %s" %
+                       str(write_mode))
+    if write_mode == 'pwrite' and not hasattr(os, 'pwrite'):
+      raise RuntimeError("os.pwrite is not supported on this platform")
+    if header_version not in (1, 2):
+      raise ValueError("header_version must be 1 or 2, given: %s" %
+                       str(header_version))
+    if alignment is not None and (header_version == 1 or int(alignment) <= 0 or
+                                  int(alignment) % _DIRECT_IO_ALIGNMENT != 0):
+      raise ValueError("alignment must be a multiple of %d for the version 2 "
+                       "header, given: %s" %
+                       (_DIRECT_IO_ALIGNMENT, str(alignment)))
+    alignment = DATA_ALIGNMENT if alignment is None else int(alignment)
+    self._growth_factor = float(growth_factor)
+    self._growth_chunk = max(0, int(growth_chunk))
+    self._write_workers = max(1, int(write_workers))
+    self._write_mode = write_mode
+    self._executor = None
+    self._flush_executor = None
     if isinstance(path, string_types):
       # validate path
       path = os.path.abspath(path)
@@ -146,45 +934,57 @@ class MmapArrayWriter(object):
       raise ValueError("Only support file path, and not file descriptor ID")
     # ====== read exist file ====== #
     if os.path.exists(path) and os.stat(path).st_size > 0:
-      dtype, shape, self._header_size = read_mmaparray_header(
-          path, return_header_size=True)
       f = open(path, 'rb+')
+      header = _read_header(f.fileno())
+      dtype, shape = header.dtype, header.shape
+      self._header_version = header.version
+      self._data_offset = header.data_offset
       self._start_position = shape[0]
+      has_statistics = header.version >= 2 and \
+        'statistics' in _read_metadata(f.fileno())
     # ====== create new file ====== #
     else:
       self._start_position = 0
-      self._header_size = 0
+      has_statistics = False
       if dtype is None or shape is None:
         raise Exception("First created this MmapData, `dtype` and "
                         "`shape` must NOT be None.")
       # check shape info
+      if isinstance(shape, np.ndarray):
+        shape = shape.tolist()
       if not isinstance(shape, Iterable):
         shape = (shape,)
       shape = tuple([0 if i is None or i < 0 else int(i) for i in shape])
       # open the file
       f = open(path, 'wb+')
-      f.write(_HEADER)
-      self._header_size += len(_HEADER)
-      # save dtype and shape to the header
-      dtype = str(np.dtype(dtype))
-      if isinstance(shape, np.ndarray):
-        shape = shape.tolist()
-      if not isinstance(shape, (tuple, list)):
-        shape = (shape,)
-      # write header metadata
-      # TODO: not a good solution, this could course overflow when expanding
-      # the memmap data, but if modifying the header algorithm,
-      # it is backward incompatible
-      header_meta = marshal.dumps([dtype, shape])
-      size = len(header_meta)
-      if size > _MAXIMUM_HEADER_SIZE:
-        raise Exception('The size of header excess maximum allowed size '
-                        '(%d bytes).' % _MAXIMUM_HEADER_SIZE)
-      header_length = ('%8d' % size).encode()
-      f.write(header_length)
-      self._header_size += len(header_length)
-      f.write(header_meta)
-      self._header_size += len(header_meta)
+      self._header_version = header_version
+      if header_version == 1:
+        dtype = str(np.dtype(dtype))
+        f.write(_HEADER)
+        header_meta = marshal.dumps([dtype, shape])
+        size = len(header_meta)
+        if size > _MAXIMUM_HEADER_SIZE:
+          raise Exception('The size of header excess maximum allowed size '
+                          '(%d bytes).' % _MAXIMUM_HEADER_SIZE)
+        f.write(('%8d' % size).encode())
+        f.write(header_meta)
+        self._data_offset = _aligned_memmap_offset(dtype)
+      else:
+        dtype = np.dtype(dtype).str
+        if len(shape) > _MAX_NDIM or len(dtype) > 32:
+          raise ValueError("The version 2 header supports at most %d "
+                           "dimensions and a dtype string of 32 bytes, "
+                           "given shape=%s dtype=%s" %
+                           (_MAX_NDIM, str(shape), dtype))
+        self._data_offset = int(
+            np.ceil((_PREAMBLE_SIZE + max(0, int(metadata_size))) / alignment) *
+            alignment)
+        f.write(
+            _PREAMBLE.pack(_HEADER_V2, 2, len(shape), self._data_offset,
+                           _PREAMBLE_SIZE, 0,
+                           self._data_offset - _PREAMBLE_SIZE, dtype.encode(),
+                           *(shape + (0,) * (_MAX_NDIM - len(shape)))))
+      f.flush()
     # ====== assign attributes ====== #
     self._file = f
     self._path = path if isinstance(path, string_types) else \
@@ -193,28 +993,143 @@ class MmapArrayWriter(object):
                      dtype=dtype,
                      shape=shape,
                      mode='r+',
-                     offset=_aligned_memmap_offset(dtype))
+                     offset=self._data_offset)
     self._data = data
+    self._length = data.shape[0]
+    self._is_header_dirty = False
     self._is_closed = False
+    # the statistics cached in the metadata, the flag is set when caching
+    # them in this process, so the writes only rewrite the metadata if needed
+    self._has_statistics = has_statistics
+    _unmap_writers(keep=self)
+
+  def _check_reopen(self, shape, dtype, remove_exist, **options):
+    """ Raise `ValueError` if the arguments for re-creating the opened writer
+    conflict with it, the options equal to the defaults are not given (the
+    header options only apply to new files) """
+    if remove_exist:
+      raise ValueError("Cannot remove the file of the opened writer at '%s', "
+                       "close the writer first" % self.path)
+    if dtype is not None and np.dtype(dtype) != self.dtype:
+      raise ValueError("The opened writer at '%s' has dtype=%s, given: %s" %
+                       (self.path, str(self.dtype), str(dtype)))
+    if shape is not None:
+      if isinstance(shape, np.ndarray):
+        shape = shape.tolist()
+      if not isinstance(shape, Iterable):
+        shape = (shape,)
+      shape = tuple([0 if i is None or i < 0 else int(i) for i in shape])
+      if shape[1:] != self.shape[1:]:
+        raise ValueError("The opened writer at '%s' has shape=%s, given: %s" %
+                         (self.path, str(self.shape), str(shape)))
+    current = self._options()
+    for name, value in options.items():
+      if name in self._DEFAULT_OPTIONS and \
+        value != self._DEFAULT_OPTIONS[name] and value != current[name]:
+        raise ValueError("The opened writer at '%s' has %s=%s, given: %s" %
+                         (self.path, name, str(current[name]), str(value)))
+
+  def _options(self):
+    """ The keyword arguments of `_init` for re-creating this writer """
+    return dict(growth_factor=self._growth_factor,
+                growth_chunk=self._growth_chunk,
+                write_workers=self._write_workers,
+                write_mode=self._write_mode)
 
   def __getstate__(self):
-    return self.path, self.shape, self.dtype
+    # the other process will read the shape from the header
+    if self._is_header_dirty:
+      self._update_header()
+    return self.path, self.shape, self.dtype, self._options()
 
   def __setstate__(self, states):
-    return self._init(*states, remove_exist=False)
+    path, shape, dtype, options = states
+    return self._init(path, shape, dtype, remove_exist=False, **options)
+
+  @property
+  def _data(self):
+    """ The memory-mapped data, the file is mapped again if it was
+    unmapped to keep the number of mapped writers within `MAX_OPEN_MMAP` """
+    data = self._memmap
+    if data is None:
+      # a closed writer is never mapped again
+      if self._is_closed:
+        raise RuntimeError("The MmapArrayWriter is closed!")
+      return self._map()
+    if _INSTANCES_WRITER.get(self._path) is self:
+      _INSTANCES_WRITER.move_to_end(self._path)
+    return data
+
+  @_data.setter
+  def _data(self, data):
+    self._memmap = data
+
+  @_data.deleter
+  def _data(self):
+    self._memmap = None
+
+  @property
+  def is_mapped(self):
+    return self._memmap is not None
+
+  def _map(self):
+    dtype, shape = self._unmapped_info
+    self._file = open(self.path, 'rb+')
+    self._memmap = np.memmap(self._file,
+                             dtype=dtype,
+                             shape=shape,
+                             mode='r+',
+                             offset=self._data_offset)
+    _unmap_writers(keep=self)
+    return self._memmap
+
+  def _fileno(self):
+    """ The descriptor of the file, which is closed while the writer is
+    unmapped """
+    if self._memmap is None:
+      self._map()
+    return self._file.fileno()
+
+  def _unmap(self):
+    """ Save the changes, then close the mapping and the file """
+    if self._memmap is None:
+      return
+    if self._is_header_dirty:
+      self._update_header()
+    data = self._memmap
+    data.flush()
+    self._unmapped_info = (data.dtype, data.shape)
+    data._mmap.close()
+    self._memmap = None
+    self._file.close()
 
   @property
   def filesize(self):
     """ Return the size of the mmap file in bytes """
     return os.stat(self.path).st_size
 
+  @property
+  def _data_info(self):
+    """ `(dtype, shape)` of the mapped data, the last known ones if the
+    writer is closed """
+    if self._is_closed and self._memmap is None:
+      return self._unmapped_info
+    data = self._data
+    return data.dtype, data.shape
+
   @property
   def shape(self):
-    return self._data.shape
+    """ The logical shape, i.e. the rows that have been written """
+    return (self._length,) + self._data_info[1][1:]
+
+  @property
+  def capacity(self):
+    """ Number of rows currently reserved in the mapped file """
+    return self._data_info[1][0]
 
   @property
   def dtype(self):
-    return self._data.dtype
+    return self._data_info[0]
 
   @property
   def path(self):
@@ -224,40 +1139,156 @@ class MmapArrayWriter(object):
   def is_closed(self):
     return self._is_closed
 
-  def _resize(self, new_length):
-    # ====== local files ====== #
+  def _update_header(self):
+    """ Rewrite the header with the logical shape """
+    if self._header_version >= 2:
+      shape = self.shape
+      os.pwrite(self._file.fileno(), struct.pack('<%dq' % len(shape), *shape),
+                _SHAPE_OFFSET)
+      self._is_header_dirty = False
+      return
+    meta = marshal.dumps([self._data.dtype.name, self.shape])
     f = self._file
-    old_length = self._data.shape[0]
-    # ====== check new shape ====== #
-    if new_length < old_length:
-      raise ValueError(
-          'Only support extending memmap, and cannot shrink the memory.')
-    # nothing to resize
-    elif new_length == old_length:
-      return self
-    # ====== flush previous changes ====== #
-    # resize by create new memmap and also rename old file
-    shape = (new_length,) + self._data.shape[1:]
-    dtype = self._data.dtype.name
-    # rewrite the header, update metadata
-    f.seek(len(_HEADER))
-    meta = marshal.dumps([dtype, shape])
     size = '%8d' % len(meta)
+    f.seek(len(_HEADER))
     f.write(size.encode(encoding='utf-8'))
     f.write(meta)
     f.flush()
+    self._is_header_dirty = False
+
+  def _new_capacity(self, new_length):
+    capacity = self._data.shape[0]
+    if self._growth_factor > 1.0:
+      capacity = int(np.ceil(capacity * self._growth_factor))
+    capacity = max(capacity, new_length)
+    if self._growth_chunk > 0:
+      chunk = self._growth_chunk
+      capacity = int(np.ceil(capacity / chunk) * chunk)
+    return capacity
+
+  def _remap(self, capacity):
+    """ Close the current memmap and map the file again with given number
+    of rows """
+    shape = (capacity,) + self._data.shape[1:]
+    dtype = self._data.dtype.name
     # close old data
     self._data._mmap.close()
     del self._data
+    self._file.close()
     # extend the memmap, by open numpy.memmap with bigger shape
     f = open(self.path, 'rb+')
     self._file = f
-    mmap = np.memmap(f,
-                     dtype=dtype,
-                     shape=shape,
-                     mode='r+',
-                     offset=_aligned_memmap_offset(dtype))
-    self._data = mmap
+    self._data = np.memmap(f,
+                           dtype=dtype,
+                           shape=shape,
+                           mode='r+',
+                           offset=self._data_offset)
+    return self
+
+  def _resize(self, new_length):
+    old_length = self._length
+    # ====== check new shape ====== #
+    if new_length < old_length:
+      raise ValueError(
+          'Only support extending memmap, and cannot shrink the memory.')
+    # nothing to resize
+    elif new_length == old_length:
+      return self
+    # ====== enough reserved capacity ====== #
+    self._length = new_length
+    if new_length <= self._data.shape[0]:
+      self._is_header_dirty = True
+      return self
+    # ====== flush previous changes ====== #
+    token = _METRICS.start()
+    old_capacity = self._data.shape[0]
+    # rewrite the header, update metadata
+    self._update_header()
+    self._remap(self._new_capacity(new_length))
+    if token is not None:
+      rows = self._data.shape[0] - old_capacity
+      row_size = self._data.itemsize * int(
+          np.prod(self._data.shape[1:], dtype='int64'))
+      _METRICS.stop('resize', token, rows * row_size, rows)
+    return self
+
+  def _shrink_to_length(self):
+    """ Truncate the reserved capacity, return `True` if the file is
+    truncated """
+    if self._data.shape[0] <= self._length:
+      return False
+    self._data.flush()
+    dtype = self._data.dtype
+    row_size = int(np.prod(self._data.shape[1:], dtype='int64')) * \
+      dtype.itemsize
+    self._file.truncate(self._data_offset + self._length * row_size)
+    self._remap(self._length)
+    return True
+
+  def _copy_rows(self, start_position, array, begin, end):
+    """ Copy `array[begin:end]` to the rows from
+    `start_position + begin` """
+    if self._write_mode == 'mmap':
+      self._data[start_position + begin:start_position + end] = \
+        array[begin:end]
+      return
+    row_size = array.itemsize * int(np.prod(array.shape[1:], dtype='int64'))
+    offset = self._data_offset + (start_position + begin) * row_size
+    data = memoryview(array[begin:end]).cast('B')
+    fd = self._file.fileno()
+    while len(data) > 0:
+      n = os.pwrite(fd, data, offset)
+      data = data[n:]
+      offset += n
+
+  def _copy(self, start_position, array):
+    if self._write_mode == 'pwrite':
+      array = np.ascontiguousarray(array, dtype=self._data.dtype)
+    n = array.shape[0]
+    workers = min(self._write_workers, n)
+    # ====== single thread ====== #
+    if workers <= 1 or array.nbytes < _PARALLEL_WRITE_SIZE:
+      self._copy_rows(start_position, array, 0, n)
+      return
+    # ====== split the rows among the workers ====== #
+    if self._executor is None:
+      self._executor = ThreadPoolExecutor(max_workers=self._write_workers)
+    bounds = np.linspace(0, n, workers + 1).astype('int64').tolist()
+    futures = [
+        self._executor.submit(self._copy_rows, start_position, array, begin,
+                              end) for begin, end in zip(bounds, bounds[1:])
+    ]
+    for f in futures:
+      f.result()
+
+  def _remove_statistics(self):
+    """ Remove the statistics cached in the metadata """
+    if self._header_version >= 2:
+      fd = self._fileno()
+      metadata = _read_metadata(fd)
+      if metadata.pop('statistics', None) is not None:
+        _write_metadata(fd, metadata)
+    self._has_statistics = False
+
+  @property
+  def metadata(self) -> dict:
+    """ A copy of the metadata stored in the header """
+    return _read_metadata(self._fileno())
+
+  def update_metadata(self, **items):
+    """ Add (or replace) the items of the metadata stored in the header, see
+    `write_mmaparray_metadata`
+
+    Return
+    ------
+    `MmapArrayWriter` for method chaining
+    """
+    fd = self._fileno()
+    metadata = _read_metadata(fd)
+    metadata.update(items)
+    _write_metadata(fd, metadata)
+    if 'statistics' in items:
+      self._has_statistics = True
     return self
 
   def write(self, arrays: Iterable, start_position=None):
@@ -280,6 +1311,7 @@ class MmapArrayWriter(object):
     """
     if self.is_closed:
       raise RuntimeError("The MmapArrayWriter is closed!")
+    token = _METRICS.start()
     # only get arrays matched the shape
     add_size = 0
     if not isinstance(arrays, Iterable) or isinstance(arrays, np.ndarray):
@@ -304,42 +1336,117 @@ class MmapArrayWriter(object):
       given_start_position = True
       if start_position < 0:
         start_position = self.shape[0] - start_position
+    # the cached statistics are outdated
+    if self._has_statistics:
+      self._remove_statistics()
     add_length = add_size - (self.shape[0] - start_position)
     # resize and append data (resize only once will be faster)
     if add_length > 0:
       self._resize(self.shape[0] + add_length)
     # ====== update values ====== #
-    data = self._data
     for a in accepted_arrays:
-      data[start_position:start_position + a.shape[0]] = a
+      self._copy(start_position, a)
       start_position += a.shape[0]
     if not given_start_position:
       self._start_position = start_position
+    if token is not None:
+      _METRICS.stop('write', token, sum(a.nbytes for a in accepted_arrays),
+                    add_size)
     return self
 
   def __enter__(self):
     return self
 
   def __exit__(self, *exc):
-    self.flush()
+    # `close` flushes the writer
     self.close()
 
-  def flush(self):
-    self._data.flush()
+  def _sync(self, asynchronous):
+    """ Synchronize the file to the disk, in a background thread if
+    `asynchronous=True` """
+    data = self._data
+    if not asynchronous:
+      data.flush()
+      # `msync` only covers the mapped data, the header (and the indices of
+      # `PointerArrayWriter`) are written to the file descriptor
+      os.fsync(self._file.fileno())
+      return self
+    if self._flush_executor is None:
+      self._flush_executor = ThreadPoolExecutor(max_workers=1)
+    # a duplicated descriptor, the writer could be remapped or closed
+    # while the data is being synchronized
+    fd = os.dup(self._file.fileno())
+
+    def fsync():
+      try:
+        os.fsync(fd)
+      finally:
+        os.close(fd)
+      return self
+
+    return self._flush_executor.submit(fsync)
+
+  def _check_durability(self, durability):
+    if durability not in DURABILITY_LEVELS:
+      raise ValueError("durability must be one of: %s; given: %s" %
+                       (', '.join(DURABILITY_LEVELS), str(durability)))
+
+  def flush(self, durability: Text = 'data', asynchronous: bool = False):
+    """ Save the changes to the file
+
+    Parameters
+    ----------
+    durability : {'none', 'page_cache', 'data', 'index'}
+      'none' - do nothing
+      'page_cache' - only update the header, the data stays in the page cache
+      'data', 'index' - synchronize the data to the disk
+    asynchronous : `bool`
+      if `True`, the synchronization runs on a background thread and a
+      `concurrent.futures.Future` is returned, the writer could keep
+      writing meanwhile
+
+    Return
+    ------
+    `MmapArrayWriter`, or `Future` if `asynchronous=True`
+    """
+    self._check_durability(durability)
+    token = _METRICS.start()
+    result = self._flush(durability, asynchronous)
+    _METRICS.stop('flush', token)
+    return result
+
+  def _flush(self, durability, asynchronous):
+    if durability != 'none' and self._is_header_dirty:
+      self._update_header()
+    if durability in ('none', 'page_cache'):
+      return _completed_future(self) if asynchronous else self
+    return self._sync(asynchronous)
 
   def close(self):
     if self.is_closed:
       return
+    # an unmapped writer is mapped again to save the changes
+    if not self.is_mapped:
+      self._map()
     self._is_closed = True
 
     if self.path in _INSTANCES_WRITER:
       del _INSTANCES_WRITER[self.path]
-    # flush in read-write mode
+    # remove the reserved capacity, then flush in read-write mode
+    self._shrink_to_length()
     self.flush()
+    for executor in (self._executor, self._flush_executor):
+      if executor is not None:
+        executor.shutdown(wait=True)
+    self._executor = None
+    self._flush_executor = None
     # close mmap and file
-    self._data._mmap.close()
-    del self._data
-    self._file.close()
+    if self.is_mapped:
+      data = self._data
+      self._unmapped_info = (data.dtype, data.shape)
+      data._mmap.close()
+      del self._data
+      self._file.close()
     del self._file
 
   def __del__(self):
@@ -372,7 +1479,7 @@ class MmapArray(np.memmap):
     ----------
     path : str, file-like object, or pathlib.Path instance
         The file name or file object to be used as the array data buffer.
-    mode : {'r+', 'r', 'w+', 'c'}, optional
+    mode : {'r+', 'r', 'c'}, optional
         The file is opened in this mode:
 
         +------+-------------------------------------------------------------+
@@ -380,16 +1487,29 @@ class MmapArray(np.memmap):
         +------+-------------------------------------------------------------+
         | 'r+' | Open existing file for reading and writing.                 |
         +------+-------------------------------------------------------------+
-        | 'w+' | Create or overwrite existing file for reading and writing.  |
-        +------+-------------------------------------------------------------+
         | 'c'  | Copy-on-write: assignments affect data in memory, but       |
         |      | changes are not saved to disk.  The file on disk is         |
         |      | read-only.                                                  |
         +------+-------------------------------------------------------------+
-        Default is 'r+'.
+        Default is 'r+'. The file is created (or overwritten) by
+        `MmapArrayWriter`.
+    access_pattern : {None, 'normal', 'random', 'sequential', 'willneed'}
+        hint for the kernel how the whole array will be accessed
+        (i.e. `madvise`), for example, 'random' disables the readahead which
+        is wasteful for random access training, 'sequential' is for scanning
+        the array once.
+
+    Note
+    ----
+    The mapped files are cached by a process-wide pool, opening the same
+    (unchanged) file again reuses the mapping, see `set_mmap_pool_limits`
+    and `get_mmap_pool_stats`.
   """
+  # the cache of the rows read by an integer index, see `set_cache`
+  _row_cache = None
+  _cache_offset = 0
 
-  def __new__(subtype, path, mode='r+'):
+  def __new__(subtype, path, mode='r+', access_pattern=None):
     if isinstance(path, string_types):
       path = os.path.abspath(path)
       if not os.path.exists(path) and os.path.isfile(path):
@@ -397,22 +1517,493 @@ class MmapArray(np.memmap):
             'path must be existed file created by MmapArrayWriter.')
     else:
       raise ValueError("Only support file path, and not file descriptor ID")
-    dtype, shape = read_mmaparray_header(path)
-    offset = _aligned_memmap_offset(dtype)
-    new_array = super(MmapArray, subtype).__new__(subtype=subtype,
-                                                  filename=path,
-                                                  dtype=dtype,
-                                                  mode=mode,
-                                                  offset=offset,
-                                                  shape=shape)
+    if mode in ('w+', 'write'):
+      raise ValueError("%s cannot create or overwrite the file, use %sWriter"
+                       " to write '%s'" %
+                       (subtype.__name__, subtype.__name__, path))
+    token = _METRICS.start()
+    # the mapped file and its header are reused from the process-wide pool
+    mm, dtype, shape, offset = _POOL.get(path, mode)
+    new_array = np.ndarray.__new__(subtype,
+                                   shape,
+                                   dtype=dtype,
+                                   buffer=mm,
+                                   offset=offset)
+    new_array._mmap = mm
+    new_array.filename = path
+    new_array.offset = offset
+    new_array.mode = mode
     new_array._path = path
+    if access_pattern is not None:
+      new_array.advise(access_pattern)
+    _METRICS.stop('open', token)
     return new_array
 
+  def __array_finalize__(self, obj):
+    super(MmapArray, self).__array_finalize__(obj)
+    # the views of the mapped file keep the path
+    self._path = getattr(obj, '_path', None) if self._mmap is not None \
+      else None
+
+  def __getitem__(self, key):
+    cache = self._row_cache
+    if cache is not None and isinstance(key, (int, np.integer)):
+      n = self.shape[0]
+      idx = int(key) + n if key < 0 else int(key)
+      if 0 <= idx < n:
+        return cache.get_or_load(
+            (self._path, self._cache_offset, idx),
+            lambda: super(MmapArray, self).__getitem__(idx))
+    # the scattered rows are read in the sorted order and the nearby rows
+    # are merged into contiguous reads
+    if COALESCE_READS and isinstance(key, (np.ndarray, list)) and \
+      self._mmap is not None and self.ndim > 0:
+      indices = np.asarray(key)
+      if indices.ndim == 1 and indices.dtype.kind in 'iu' and \
+        indices.shape[0] >= _COALESCE_MIN_ROWS:
+        n = self.shape[0]
+        indices = indices.astype('int64')
+        if indices.min() < -n or indices.max() >= n:
+          raise IndexError("index is out of bounds for axis 0 with size %d" % n)
+        indices = np.where(indices < 0, indices + n, indices)
+        array = self.view(np.ndarray)
+        coalesced = _read_coalesced(array, indices, indices + 1)
+        if coalesced is None:
+          data = array[indices]
+        else:
+          buffer, shifts = coalesced
+          data = buffer[shifts]
+        return data.view(type(self))
+    return super(MmapArray, self).__getitem__(key)
+
+  def __reduce_ex__(self, protocol):
+    # the views of the file are pickled as a descriptor
+    # `(path, offset, shape, strides, dtype)` instead of the data,
+    # copy-on-write mappings and in-memory copies still send the data
+    mm = self._mmap
+    if mm is None or self._path is None or \
+      _MMAP_ACCESS.get(self.mode, mmap.ACCESS_COPY) == mmap.ACCESS_COPY:
+      return super(MmapArray, self).__reduce_ex__(protocol)
+    offset = self.ctypes.data - _mmap_address(mm)
+    return (_rebuild_mmaparray, (type(self), self._path, self.mode, offset,
+                                 self.shape, self.strides, self.dtype))
+
   @property
   def path(self):
     return self._path
 
+  @property
+  def metadata(self) -> dict:
+    """ The metadata stored in the header """
+    return read_mmaparray_metadata(self.path)
+
+  def set_cache(self, cache: Optional[RowCache]):
+    """ Cache the rows read by an integer index (and the data of the keys
+    of `PointerArray`) in `cache`, a `RowCache` can be shared by many arrays
+    and threads, `None` disables the cache.
+
+    The hits return the same read-only copy of the row, writing to the file
+    does not update the cached rows (see `RowCache.invalidate`). Only this
+    array uses the cache, its views and unpickled copies do not.
+
+    Return
+    ------
+    the array itself
+    """
+    if cache is not None:
+      if self._mmap is None or self._path is None or self.ndim == 0:
+        raise ValueError("The array is not a memory-mapped file")
+      self._cache_offset = self.ctypes.data - _mmap_address(self._mmap)
+    self._row_cache = cache
+    return self
+
+  def _direct_range(self):
+    """ The file offset and the size (in bytes) of a row, the rows must be
+    contiguous for reading with `O_DIRECT` """
+    if self._mmap is None or self._path is None or self.ndim == 0:
+      raise ValueError("The array is not a memory-mapped file")
+    row_size = self.itemsize * int(np.prod(self.shape[1:], dtype='int64'))
+    if not (self[:1].flags['C_CONTIGUOUS'] and
+            (self.shape[0] <= 1 or self.strides[0] == row_size)):
+      raise ValueError("Reading with O_DIRECT requires contiguous rows, "
+                       "given strides: %s" % str(self.strides))
+    return self.ctypes.data - _mmap_address(self._mmap), row_size
+
+  def _row_range(self, key):
+    """ Return `(start, end)` if `key` selects contiguous rows """
+    if isinstance(key, (int, np.integer)):
+      idx = int(key)
+      if idx < 0:
+        idx += self.shape[0]
+      if not 0 <= idx < self.shape[0]:
+        raise IndexError("index %d is out of bounds for axis 0 with size %d" %
+                         (int(key), self.shape[0]))
+      return idx, idx + 1
+    if isinstance(key, slice):
+      start, end, step = key.indices(self.shape[0])
+      if step == 1:
+        return start, max(start, end)
+    return None
+
+  async def aread(self, key=slice(None)) -> np.ndarray:
+    """ Read `self[key]` into memory without blocking the event loop, the
+    contiguous rows are read with `os.preadv` into the output array by a
+    bounded thread pool (see `set_aio_limits`), concurrent requests for
+    overlapping rows share a single read.
+
+    Parameters
+    ----------
+    key : {`int`, `slice`, array of `int`, others}
+      the rows, the scattered rows of an array of indices are sorted and
+      merged into contiguous reads (see `COALESCE_GAP`), any other index
+      is copied from the mapped memory on the thread pool
+
+    Return
+    ------
+    `numpy.ndarray`, a copy of `self[key]`
+    """
+    rows = None if self.mode in ('c', 'copyonwrite') else self._row_range(key)
+    indices = None
+    if rows is None and self.mode not in ('c', 'copyonwrite') and \
+      isinstance(key, (np.ndarray, list)) and self.ndim > 0:
+      indices = np.asarray(key)
+      if indices.ndim != 1 or indices.dtype.kind not in 'iu' or \
+        indices.shape[0] == 0:
+        indices = None
+    if rows is not None or indices is not None:
+      try:
+        offset, row_size = self._direct_range()
+      except ValueError:
+        rows = indices = None
+    # ====== copy from the memory ====== #
+    if rows is None and indices is None:
+      array = self.view(np.ndarray)
+      return await _AIO.run(lambda: np.array(array[key]))
+    # ====== scattered rows, coalesced reads ====== #
+    if indices is not None:
+      n = self.shape[0]
+      indices = indices.astype('int64')
+      if indices.min() < -n or indices.max() >= n:
+        raise IndexError("index is out of bounds for axis 0 with size %d" % n)
+      indices = np.where(indices < 0, indices + n, indices)
+      buffer, shifts = await _aread_coalesced(self, indices, indices + 1)
+      return buffer[shifts]
+    # ====== read the file ====== #
+    start, end = rows
+    out = np.empty((end - start,) + self.shape[1:], dtype=self.dtype)
+    if out.nbytes > 0:
+      await _AIO.read(self._path, offset + start * row_size, out)
+    if isinstance(key, (int, np.integer)):
+      return out[0]
+    return out
+
+  def read_direct(self, start: int = 0, end: Optional[int] = None):
+    """ Copy the rows `[start, end)` into memory with `O_DIRECT` reads that
+    bypass the page cache, so a bulk read does not evict the hot pages of
+    other arrays. If `O_DIRECT` is not supported (e.g. tmpfs, macOS), the
+    file is read normally and the pages are dropped from the page cache.
+
+    Return
+    ------
+    `numpy.ndarray`, a copy of the rows
+    """
+    offset, row_size = self._direct_range()
+    n = self.shape[0]
+    end = n if end is None else end
+    start, end, _ = slice(start, end).indices(n)
+    end = max(start, end)
+    nbytes = (end - start) * row_size
+    buffer = _direct_buffer(nbytes)
+    fd, is_direct = _open_direct(self._path)
+    try:
+      shift, _ = _read_direct(fd, is_direct, buffer, offset + start * row_size,
+                              nbytes)
+    finally:
+      os.close(fd)
+    return np.frombuffer(buffer,
+                         dtype=self.dtype,
+                         count=nbytes // self.itemsize,
+                         offset=shift).reshape((end - start,) + self.shape[1:])
+
+  def iter_direct(self,
+                  block_rows: Optional[int] = None,
+                  prefetch: bool = True):
+    """ Scan the rows in blocks read with `O_DIRECT` (see `read_direct`),
+    the next block is read by a background thread while the current block
+    is consumed.
+
+    Parameters
+    ----------
+    block_rows : `int` (optional)
+      number of rows in each block, by default, blocks of 8MB
+    prefetch : `bool`
+      if `True`, read the next block in the background
+
+    Return
+    ------
+    generator of `numpy.ndarray`, the blocks are views of two reused
+    buffers, a block is overwritten after the next block is consumed,
+    copy it to keep it longer
+    """
+    offset, row_size = self._direct_range()
+    n = self.shape[0]
+    if block_rows is None:
+      block_rows = _DIRECT_IO_CHUNK // max(row_size, 1)
+    block_rows = max(1, int(block_rows))
+    buffers = [_direct_buffer(block_rows * row_size) for _ in range(2)]
+    fd, is_direct = _open_direct(self._path)
+    states = [is_direct]
+
+    def read(i, start):
+      end = min(start + block_rows, n)
+      shift, states[0] = _read_direct(fd, states[0], buffers[i],
+                                      offset + start * row_size,
+                                      (end - start) * row_size)
+      return np.frombuffer(buffers[i],
+                           dtype=self.dtype,
+                           count=(end - start) * row_size // self.itemsize,
+                           offset=shift).reshape((end - start,) +
+                                                 self.shape[1:])
+
+    executor = ThreadPoolExecutor(max_workers=1) if prefetch else None
+    future = None
+    try:
+      for i, start in enumerate(range(0, n, block_rows)):
+        if future is None:
+          block = read(i % 2, start)
+        else:
+          block = future.result()
+        if executor is not None and start + block_rows < n:
+          future = executor.submit(read, (i + 1) % 2, start + block_rows)
+        else:
+          future = None
+        yield block
+    finally:
+      if future is not None:
+        future.cancel()
+        try:
+          future.result()
+        except Exception:
+          pass
+      if executor is not None:
+        executor.shutdown(wait=True)
+      os.close(fd)
+
+  def _map_writer(self, path, shape, dtype):
+    """ The writer of the output of `map_blocks` """
+    return MmapArrayWriter(path, shape, dtype, remove_exist=True)
+
   @property
   def filesize(self):
     """ Return the size of the mmap file in bytes """
     return os.stat(self.path).st_size
+
+  def advise(self, pattern: Text, start: int = 0, end: Optional[int] = None):
+    """ Advise the kernel how the rows `[start, end)` will be accessed,
+    the rows are mapped to the byte range within the file (after the header)
+
+    Parameters
+    ----------
+    pattern : {'normal', 'random', 'sequential', 'willneed', 'dontneed'}
+      'dontneed' drops the pages of rows that are already consumed
+    start : `int`
+      the first row
+    end : `int` (optional)
+      the row after the last row, `None` for the end of the array
+
+    Return
+    ------
+    `True` if the advice is applied, `False` if `madvise` is not supported
+    by the platform
+    """
+    if pattern not in _ACCESS_PATTERNS:
+      raise ValueError("Only support access pattern: %s; given: %s" %
+                       (', '.join(_ACCESS_PATTERNS.keys()), str(pattern)))
+    advice = getattr(mmap, _ACCESS_PATTERNS[pattern], None)
+    if advice is None:
+      return False
+    if end is None:
+      end = self.shape[0]
+    return _madvise_rows(self, advice, int(start), int(end))
+
+  def iter_batches(self,
+                   batch_size: int = 256,
+                   prefetch: int = 2,
+                   shuffle: bool = False,
+                   workers: int = 1,
+                   seed: Optional[int] = None,
+                   drop_last: bool = False):
+    """ Iterate over the first dimension in mini-batches, the upcoming
+    batches are materialized by a thread pool (and `madvise(MADV_WILLNEED)`
+    is called on their ranges), so reading from disk overlaps with the
+    computation of the consumer.
+
+    Parameters
+    ----------
+    batch_size : `int`
+      number of rows in each batch
+    prefetch : `int`
+      number of batches that are read ahead of the consumer
+    shuffle : `bool`
+      if `True`, each batch contains random rows, and every row is returned
+      once per iteration
+    workers : `int`
+      number of threads for reading the batches
+    seed : `int` (optional)
+      seed for the random permutation when `shuffle=True`
+    drop_last : `bool`
+      if `True`, drop the last batch that is smaller than `batch_size`
+
+    Return
+    ------
+    generator of `numpy.ndarray`, each batch is a copy of the data
+    """
+    n = self.shape[0]
+    stop = n - n % batch_size if drop_last else n
+    batches = [
+        (i, min(i + batch_size, stop)) for i in range(0, stop, batch_size)
+    ]
+    if shuffle:
+      order = np.random.RandomState(seed).permutation(n)
+      batches = [order[i:j] for i, j in batches]
+    array = self.view(np.ndarray)
+
+    def read(batch):
+      if isinstance(batch, tuple):
+        return np.array(array[batch[0]:batch[1]])
+      return array[batch]
+
+    def submit(executor, batch):
+      if isinstance(batch, tuple):
+        self.advise('willneed', batch[0], batch[1])
+      return executor.submit(read, batch)
+
+    executor = ThreadPoolExecutor(max_workers=max(1, int(workers)))
+    futures = deque()
+    batches = iter(batches)
+    try:
+      for batch in batches:
+        futures.append(submit(executor, batch))
+        if len(futures) > max(0, int(prefetch)):
+          break
+      while len(futures) > 0:
+        data = futures.popleft().result()
+        for batch in batches:
+          futures.append(submit(executor, batch))
+          break
+        yield data
+    finally:
+      for f in futures:
+        f.cancel()
+      executor.shutdown(wait=True)
+
+  def map_blocks(self,
+                 fn,
+                 out_path: Text,
+                 out_dtype: Optional[Union[Text, np.dtype]] = None,
+                 out_shape: Optional[List[int]] = None,
+                 workers: int = 4,
+                 block_rows: Optional[int] = None,
+                 executor: Text = 'thread',
+                 remove_exist: bool = False):
+    """ Apply `fn` to the blocks of rows and write the results to a new
+    array, the output is preallocated and each worker writes its block
+    directly at the rows of the block, so only `workers` blocks are in
+    memory at any time.
+
+    Parameters
+    ----------
+    fn : callable
+      a function maps a block of rows `numpy.ndarray` of shape
+      `[n, ...]` to an array of shape `[n, ...out_shape[1:]]` (the same
+      number of rows), must be picklable for `executor='process'`
+    out_path : str
+      path to the output file
+    out_dtype : numpy.dtype (optional)
+      data type of the output, inferred from the first block if `None`
+    out_shape : `tuple` (optional)
+      shape of the output, the first dimension could be `None`, inferred
+      from the first block if `None`
+    workers : `int`
+      number of threads or processes
+    block_rows : `int` (optional)
+      number of rows in each block, by default, blocks of 16MB
+    executor : {'thread', 'process'}
+      'thread' - for `fn` releasing the GIL (most numpy functions)
+      'process' - for pure python `fn`, the blocks are sent to the workers
+        as file descriptors and the results are written with `os.pwrite`
+    remove_exist : `bool`
+      if `True`, overwrite the file at `out_path`
+
+    Return
+    ------
+    the output array opened in read-only mode (a `PointerArray` with the
+    same keys for a `PointerArray`)
+    """
+    if executor not in ('thread', 'process'):
+      raise ValueError("executor must be 'thread' or 'process', given: %s" %
+                       str(executor))
+    out_path = os.path.abspath(out_path)
+    if out_path == self.path:
+      raise ValueError("Cannot write the output to the input file: %s" %
+                       out_path)
+    if os.path.exists(out_path) and not remove_exist:
+      raise RuntimeError("File at path '%s' exists, use remove_exist=True to "
+                         "overwrite it" % out_path)
+    n = self.shape[0]
+    if block_rows is None:
+      row_size = self.itemsize * int(np.prod(self.shape[1:], dtype='int64'))
+      block_rows = _MAP_BLOCK_SIZE // max(row_size, 1)
+    block_rows = max(1, int(block_rows))
+    bounds = [(i, min(i + block_rows, n)) for i in range(0, n, block_rows)]
+    # ====== infer the output from the first block ====== #
+    first = None
+    if out_dtype is None or out_shape is None:
+      if n == 0:
+        raise ValueError("out_dtype and out_shape must be given for an empty "
+                         "array")
+      start, end = bounds.pop(0)
+      first = np.asarray(fn(np.asarray(self[start:end])))
+    row_shape = first.shape[1:] if out_shape is None else \
+      tuple(int(i) for i in out_shape[1:])
+    out_dtype = first.dtype if out_dtype is None else np.dtype(out_dtype)
+    if out_shape is not None and out_shape[0] not in (None, n):
+      raise ValueError("The output must have %d rows, given out_shape: %s" %
+                       (n, str(out_shape)))
+    # ====== preallocate the output ====== #
+    writer = self._map_writer(out_path, (0,) + row_shape, out_dtype)
+    try:
+      writer._resize(n)
+      if first is not None:
+        first = _map_block(lambda x: x, first, row_shape, out_dtype)
+        writer._copy_rows(0, first, 0, first.shape[0])
+        del first
+      # ====== map the blocks ====== #
+      if executor == 'thread':
+
+        def job(bound):
+          start, end = bound
+          result = _map_block(fn, self[start:end], row_shape, out_dtype)
+          writer._copy_rows(start, result, 0, end - start)
+
+        pool = ThreadPoolExecutor(max_workers=max(1, int(workers)))
+        futures = [pool.submit(job, bound) for bound in bounds]
+      else:
+        # the file must be readable by the workers
+        writer._update_header()
+        pool = ProcessPoolExecutor(max_workers=max(1, int(workers)))
+        futures = [
+            pool.submit(_map_block_to_file, fn, self[start:end], start,
+                        out_path, writer._data_offset, row_shape, out_dtype)
+            for start, end in bounds
+        ]
+      try:
+        for f in futures:
+          f.result()
+      finally:
+        for f in futures:
+          f.cancel()
+        pool.shutdown(wait=True)
+    finally:
+      writer.close()
+    return type(self)(out_path, mode='r')
@@ -1,22 +1,48 @@
 from __future__ import absolute_import, division, print_function
 
+import glob
 import os
 import pickle
 from collections import OrderedDict
+from collections.abc import Mapping
+from contextlib import contextmanager
 from multiprocessing import Lock, Manager, Value
-from multiprocessing.managers import DictProxy
 from typing import Dict, Iterable, List, Optional, Text, Tuple, Union
 
 import numpy as np
 from six import string_types
 
-from bigarray.mmap_array import (_HEADER, _MAXIMUM_HEADER_SIZE, MmapArray,
-                                 MmapArrayWriter)
+try:
+  import fcntl
+except ImportError:  # `flock` is not supported on Windows
+  fcntl = None
+
+from bigarray.metrics import _METRICS
+from bigarray.mmap_array import (_AIO, _HEADER, _MAXIMUM_HEADER_SIZE, MmapArray,
+                                 MmapArrayWriter, _aread_coalesced,
+                                 _gather_ranges)
 
 __all__ = ['PointerArrayWriter', 'PointerArray']
 
 _MANAGER = []
 _PROXY_DICT = {}
+# trailer of the binary indices: [section][8 bytes size][magic]
+_INDEX_MAGIC = b'ptrindx1'
+# append-only indices log, each flush appends a segment (a section of the
+# new entries) and a footer listing all segments:
+# [segment][footer]...[segment][footer][8 bytes footer size]
+# [8 bytes log size][magic]
+# footer: int64 `[token, n_records, n, offsets (n), sizes (n)]`, the offsets
+# are relative to the log start. A new segment overwrites the superseded
+# footer, only the last footer is kept
+_INDEX_LOG_MAGIC = b'ptrindx2'
+_INDEX_PREAMBLE = 4
+# byte offset of `[sealed, seal token]` in the preamble of a segment, the
+# segment written by `close` is sealed so the readers could memory-map it.
+# A writer reopening the file clears the flag before moving (or rewriting)
+# the segment, and every seal has a new token, so the readers that mapped
+# it detect the change and read the indices again
+_SEALED_OFFSET = 16
 
 
 # ===========================================================================
@@ -39,31 +65,455 @@ class _ReadOnlyDict(dict):
   del __readonly__
 
 
+class _PointerIndex(Mapping):
+  """ A read-only mapping from `str` to `(start, end)` stored as a sorted
+  string table, the buffer could be a `numpy.memmap` so the keys are
+  looked up lazily without unpickling the whole indices.
+
+  Layout of the buffer (all integers are little-endian int64):
+    - preamble: `[n, width, sealed, seal token]`
+    - keys: `n` fixed-width byte strings (utf-8), sorted, padded to 8 bytes
+    - starts, ends: `n` integers each, following the order of the keys
+    - order: `n` integers, the position of each key in the iteration order
+  """
+
+  def __init__(self, buffer):
+    buffer = np.asarray(buffer, dtype=np.uint8)
+    # a view of the (mapped) preamble, the seal is checked by `is_stale`
+    self._preamble = buffer[:_INDEX_PREAMBLE * 8].view('<i8')
+    n, width, sealed, seal_token = [int(i) for i in self._preamble]
+    self._seal = (sealed, seal_token)
+    pos = _INDEX_PREAMBLE * 8
+    self._keys = buffer[pos:pos + n * width].view('S%d' % width)
+    pos += _pad8(n * width)
+    self._starts = buffer[pos:pos + n * 8].view('<i8')
+    pos += n * 8
+    self._ends = buffer[pos:pos + n * 8].view('<i8')
+    pos += n * 8
+    self._order = buffer[pos:pos + n * 8].view('<i8')
+    self._width = width
+
+  @staticmethod
+  def dumps(keys, starts, ends, sealed=False):
+    """ Serialize the indices, `keys` is an array of bytes in the iteration
+    order """
+    keys = np.asarray(keys, dtype=np.bytes_)
+    n = keys.shape[0]
+    width = max(1, keys.dtype.itemsize)
+    keys = keys.astype('S%d' % width)
+    sorted_ids = np.argsort(keys, kind='stable')
+    order = np.empty(n, dtype='<i8')
+    order[sorted_ids] = np.arange(n, dtype='<i8')
+    keys_data = keys[sorted_ids].tobytes()
+    return b''.join([
+        np.array([n, width] + _new_seal(sealed), dtype='<i8').tobytes(),
+        keys_data,
+        b'\x00' * (_pad8(len(keys_data)) - len(keys_data)),
+        np.asarray(starts, dtype='<i8')[sorted_ids].tobytes(),
+        np.asarray(ends, dtype='<i8')[sorted_ids].tobytes(),
+        order.tobytes(),
+    ])
+
+  @property
+  def is_stale(self):
+    """ Whether the indices were sealed, but then unsealed (or sealed again)
+    by a writer, i.e. the mapped buffer is being overwritten """
+    return self._seal[0] == 1 and \
+      (int(self._preamble[2]), int(self._preamble[3])) != self._seal
+
+  def arrays(self):
+    """ Return `(keys, starts, ends)` in the iteration order, `keys` is an
+    array of utf-8 encoded bytes """
+    order = self._order
+    return self._keys[order], self._starts[order], self._ends[order]
+
+  def lookup(self, keys):
+    """ Vectorized lookup of many keys, return `(starts, ends)` arrays """
+    queries = _encode_keys(keys)
+    n = self._keys.shape[0]
+    if n == 0:
+      if queries.shape[0] > 0:
+        raise KeyError(queries[0].decode('utf-8'))
+      return np.empty((0,), 'int64'), np.empty((0,), 'int64')
+    ids = np.searchsorted(self._keys, queries)
+    ids = np.minimum(ids, n - 1)
+    found = self._keys[ids] == queries
+    if not np.all(found):
+      raise KeyError(queries[np.argmin(found)].decode('utf-8'))
+    return self._starts[ids], self._ends[ids]
+
+  def _find(self, key):
+    if not isinstance(key, string_types):
+      return -1
+    key = key.encode('utf-8')
+    if len(key) > self._width:
+      return -1
+    i = int(np.searchsorted(self._keys, key))
+    if i < self._keys.shape[0] and self._keys[i] == key:
+      return i
+    return -1
+
+  def __getitem__(self, key):
+    i = self._find(key)
+    if i < 0:
+      raise KeyError(key)
+    return int(self._starts[i]), int(self._ends[i])
+
+  def __contains__(self, key):
+    return self._find(key) >= 0
+
+  def __len__(self):
+    return self._keys.shape[0]
+
+  def __iter__(self):
+    keys, _, _ = self.arrays()
+    for k in keys.tolist():
+      yield k.decode('utf-8')
+
+  def items(self):
+    keys, starts, ends = self.arrays()
+    for k, s, e in zip(keys.tolist(), starts.tolist(), ends.tolist()):
+      yield k.decode('utf-8'), (s, e)
+
+  def values(self):
+    _, starts, ends = self.arrays()
+    return zip(starts.tolist(), ends.tolist())
+
+  __setitem__ = _ReadOnlyDict.__setitem__
+  __delitem__ = _ReadOnlyDict.__delitem__
+
+
+def _new_seal(sealed=True):
+  """ `[sealed, seal token]` of the preamble of a segment """
+  if not sealed:
+    return [0, 0]
+  return [1, int.from_bytes(os.urandom(7), 'little')]
+
+
+def _pad8(size):
+  return int(np.ceil(size / 8) * 8)
+
+
+def _encode_keys(keys):
+  """ Convert a list of `str` to an array of utf-8 encoded bytes """
+  if isinstance(keys, np.ndarray):
+    if keys.dtype.kind == 'U':
+      return np.char.encode(keys, 'utf-8')
+    if keys.dtype.kind == 'S':
+      return keys
+  return np.array([k.encode('utf-8') for k in keys], dtype=np.bytes_)
+
+
+def _lookup_indices(indices, keys):
+  """ Return `(starts, ends)` arrays for the list of keys """
+  token = _METRICS.start()
+  if isinstance(indices, _PointerIndex):
+    starts, ends = indices.lookup(keys)
+  else:
+    ranges = np.array([indices[k] for k in keys], dtype='int64').reshape(-1, 2)
+    starts, ends = ranges[:, 0], ranges[:, 1]
+  _METRICS.stop('key_lookup', token, rows=starts.shape[0])
+  return starts, ends
+
+
+def _index_arrays(indices):
+  """ Return `(keys, starts, ends)` arrays of any mapping of indices """
+  if isinstance(indices, _PointerIndex):
+    return indices.arrays()
+  keys = np.array([k.encode('utf-8') for k in indices.keys()], dtype=np.bytes_)
+  ranges = np.array(list(indices.values()), dtype='<i8').reshape(-1, 2)
+  return keys, ranges[:, 0], ranges[:, 1]
+
+
+def _merge_indices(base, new):
+  """ Merge two mappings of indices into `(keys, starts, ends)`, entries
+  in `new` override the ones in `base` """
+  if len(base) == 0:
+    return _index_arrays(new)
+  base_keys, base_starts, base_ends = _index_arrays(base)
+  if len(new) == 0:
+    return base_keys, base_starts, base_ends
+  new_keys, new_starts, new_ends = _index_arrays(new)
+  keep = ~np.isin(base_keys, new_keys)
+  return (np.concatenate([base_keys[keep], new_keys]),
+          np.concatenate([base_starts[keep], new_starts]),
+          np.concatenate([base_ends[keep], new_ends]))
+
+
+def _merge_segments(segments):
+  """ Merge the segments of the indices log into `(keys, starts, ends)`,
+  the entries of later segments override the earlier ones """
+  if len(segments) == 1:
+    return segments[0].arrays()
+  return _concat_indices([seg.arrays() for seg in segments])
+
+
+def _concat_indices(arrays):
+  """ Concatenate a list of `(keys, starts, ends)`, the later entries
+  override the earlier ones """
+  keys, starts, ends = zip(*arrays)
+  width = max([1] + [k.dtype.itemsize for k in keys])
+  keys = np.concatenate([k.astype('S%d' % width) for k in keys])
+  starts = np.concatenate(starts)
+  ends = np.concatenate(ends)
+  # the last occurrence of each key, in the order of appearance
+  _, ids = np.unique(keys[::-1], return_index=True)
+  ids = np.sort(keys.shape[0] - 1 - ids)
+  return keys[ids], starts[ids], ends[ids]
+
+
+@contextmanager
+def _locked(f, shared=False):
+  """ Hold an advisory lock of the opened file `f`, the writer processes
+  (and threads) serialize the read-modify-write of the indices log """
+  if fcntl is None:
+    yield f
+    return
+  fcntl.flock(f.fileno(), fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+  try:
+    yield f
+  finally:
+    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def _read_log_footer(f):
+  """ Read the footer of the indices log at the end of opened file `f`,
+  return `None` if the file does not end with an indices log, otherwise
+  `(log_start, token, n_records, offsets, sizes)` """
+  filesize = f.seek(0, os.SEEK_END)
+  if filesize < 24:
+    return None
+  f.seek(filesize - 24)
+  trailer = f.read(24)
+  if trailer[16:] != _INDEX_LOG_MAGIC:
+    return None
+  footer_size = int.from_bytes(trailer[:8], 'little')
+  log_size = int.from_bytes(trailer[8:16], 'little')
+  f.seek(filesize - 24 - footer_size)
+  footer = np.frombuffer(f.read(footer_size), dtype='<i8')
+  token, n_records, n = [int(i) for i in footer[:3]]
+  return (filesize - log_size, token, n_records, footer[3:3 + n],
+          footer[3 + n:3 + 2 * n])
+
+
+def _append_log(f,
+                log_start,
+                offsets,
+                sizes,
+                keys,
+                starts,
+                ends,
+                token,
+                n_records,
+                sealed=False):
+  """ Append a segment and a new footer to the indices log of opened file
+  `f`, the log starts at `log_start`, the segment overwrites the previous
+  footer. Return the new footer """
+  if len(offsets) > 0:
+    position = _pad8(log_start + int(offsets[-1]) + int(sizes[-1]))
+  else:
+    position = _pad8(max(f.seek(0, os.SEEK_END), log_start))
+  section = _PointerIndex.dumps(keys, starts, ends, sealed=sealed)
+  offsets = list(offsets) + [position - log_start]
+  sizes = list(sizes) + [len(section)]
+  footer = np.array([token, n_records, len(offsets)] + offsets + sizes,
+                    dtype='<i8').tobytes()
+  log_size = position + len(section) + len(footer) + 24 - log_start
+  f.seek(position)
+  f.write(section + footer + len(footer).to_bytes(8, 'little') +
+          log_size.to_bytes(8, 'little') + _INDEX_LOG_MAGIC)
+  f.truncate()
+  return log_start, token, n_records, offsets, sizes
+
+
+def _is_sealed(f, offset):
+  f.seek(offset + _SEALED_OFFSET)
+  return f.read(8) == (1).to_bytes(8, 'little')
+
+
+def _has_sealed_indices(path):
+  """ Whether the readers of the file could memory-map its indices, i.e.
+  a sealed log or the legacy binary indices """
+  if not os.path.isfile(path) or os.stat(path).st_size < 24:
+    return False
+  with open(path, 'rb') as f:
+    f.seek(-8, os.SEEK_END)
+    magic = f.read(8)
+    if magic == _INDEX_MAGIC:
+      return True
+    if magic != _INDEX_LOG_MAGIC:
+      return False
+    log_start, _, _, offsets, _ = _read_log_footer(f)
+    return len(offsets) == 1 and _is_sealed(f, log_start + int(offsets[0]))
+
+
+def _has_indices(path):
+  """ Whether the file stores the binary indices (or the indices log) of
+  `PointerArray` """
+  if not os.path.isfile(path) or os.stat(path).st_size < 8:
+    return False
+  with open(path, 'rb') as f:
+    f.seek(-8, os.SEEK_END)
+    return f.read(8) in (_INDEX_MAGIC, _INDEX_LOG_MAGIC)
+
+
+def _unseal(path):
+  """ Clear the flag of the sealed segment before the writer moves (or
+  rewrites) it, the readers mapping the segment read the indices again """
+  with open(path, 'rb+') as f, _locked(f):
+    footer = _read_log_footer(f)
+    if footer is None or len(footer[3]) != 1:
+      return
+    offset = footer[0] + int(footer[3][0])
+    if _is_sealed(f, offset):
+      f.seek(offset + _SEALED_OFFSET)
+      f.write((0).to_bytes(8, 'little'))
+
+
+def _fsync(f):
+  f.flush()
+  os.fsync(f.fileno())
+
+
+def _compact_indices(path, min_log_start=0):
+  """ Rewrite the indices log as a single sealed segment and synchronize it
+  to the disk, return `True` if the log is compacted """
+  with open(path, 'rb+') as f, _locked(f):
+    footer = _read_log_footer(f)
+    if footer is None:
+      return False
+    log_start, token, n_records, offsets, sizes = footer
+    start = _pad8(min_log_start)
+    if len(offsets) <= 1 and log_start <= start:
+      if len(offsets) == 1:
+        f.seek(log_start + int(offsets[0]) + _SEALED_OFFSET)
+        f.write(np.array(_new_seal(), dtype='<i8').tobytes())
+        _fsync(f)
+      return False
+    segments = []
+    for offset, size in zip(offsets.tolist(), sizes.tolist()):
+      f.seek(log_start + offset)
+      segments.append(_PointerIndex(np.frombuffer(f.read(size),
+                                                  dtype=np.uint8)))
+    keys, starts, ends = _merge_segments(segments)
+    # the stale segments and footers before the log are removed as well
+    start = max(min(start, log_start), 0)
+    f.truncate(start)
+    _append_log(f,
+                start, [], [],
+                keys,
+                starts,
+                ends,
+                token,
+                n_records,
+                sealed=True)
+    _fsync(f)
+  return True
+
+
+def _map_section(path, offset, size, buffer=None):
+  """ Memory-map `size` bytes of the file, or view them from `buffer` (the
+  already mapped file) """
+  if buffer is not None:
+    return np.frombuffer(buffer, dtype=np.uint8, count=size, offset=offset)
+  return np.memmap(path, dtype=np.uint8, mode='r', offset=offset, shape=(size,))
+
+
+def _read_indices(path, in_memory=False, buffer=None):
+  """ Read the indices stored at the end of the file, return `_PointerIndex`
+  for the binary format, or `_ReadOnlyDict` for the legacy pickled indices.
+
+  Only the sealed indices (written by `close`) are memory-mapped, the
+  indices of a file being written are copied into memory, since the writer
+  overwrites them when the data grows. If `in_memory=True`, the indices are
+  always copied. If `buffer` (the mapped file) is given, the indices are
+  viewed from it instead of mapping the file again.
+  """
+  token = _METRICS.start()
+  indices = _load_indices(path, in_memory, buffer)
+  _METRICS.stop('index_load', token, rows=len(indices))
+  return indices
+
+
+def _load_indices(path, in_memory, buffer):
+  with open(path, 'rb') as f, _locked(f, shared=True):
+    filesize = f.seek(0, os.SEEK_END)
+    f.seek(filesize - 8)
+    magic = f.read(8)
+    # ====== indices log ====== #
+    if magic == _INDEX_LOG_MAGIC:
+      log_start, _, _, offsets, sizes = _read_log_footer(f)
+      offsets = (log_start + offsets).tolist()
+      sizes = sizes.tolist()
+      # a single sealed segment is memory-mapped
+      if len(offsets) == 1 and not in_memory and \
+        _is_sealed(f, offsets[0]):
+        return _PointerIndex(_map_section(path, offsets[0], sizes[0], buffer))
+      segments = []
+      for offset, size in zip(offsets, sizes):
+        f.seek(offset)
+        segments.append(
+            _PointerIndex(np.frombuffer(f.read(size), dtype=np.uint8)))
+      if len(segments) == 1:
+        return segments[0]
+      return _PointerIndex(
+          np.frombuffer(_PointerIndex.dumps(*_merge_segments(segments)),
+                        dtype=np.uint8))
+    # ====== legacy pickled dictionary ====== #
+    if magic != _INDEX_MAGIC:
+      indices_size = int.from_bytes(magic, 'big')
+      f.seek(filesize - 8 - indices_size)
+      return _ReadOnlyDict(pickle.loads(f.read(indices_size)))
+    # ====== binary indices (single section) ====== #
+    f.seek(filesize - 16)
+    indices_size = int.from_bytes(f.read(8), 'little')
+    offset = filesize - 16 - indices_size
+    if in_memory:
+      f.seek(offset)
+      return _PointerIndex(np.frombuffer(f.read(indices_size), dtype=np.uint8))
+  return _PointerIndex(_map_section(path, offset, indices_size, buffer))
+
+
 class _SharedDictWriter(object):
-  """ A multiprocessing syncrhonized dictionary for writing """
+  """ A multiprocessing syncrhonized dictionary for writing, the items are
+  stored as a shared list of records in the order of writing """
 
   def __init__(self, init_dict, path):
     assert isinstance(init_dict, dict)
     if len(_MANAGER) == 0:
       _MANAGER.append(Manager())
     if path not in _PROXY_DICT:
-      _PROXY_DICT[path] = _MANAGER[0].dict(init_dict)
+      _PROXY_DICT[path] = _MANAGER[0].list(list(init_dict.items()))
       # TODO: is there any case that the `init_dict` contents mismatch
       # the one stored in _PROXY_DICT
-    self._dict = _PROXY_DICT[path]
+    self._records = _PROXY_DICT[path]
     self._path = path
     self._lock = Lock()
     self._pid = os.getpid()
     self._is_closed = False
 
+  @property
+  def is_owner(self):
+    return True
+
   def update(self, items):
     with self._lock:
-      self._dict.update(items)
+      self._records.extend(list(items.items()))
+
+  def collect(self):
+    return 0
+
+  def records(self, start=0):
+    """ Return the records written after the first `start` records, and
+    the total number of records """
+    with self._lock:
+      records = self._records[start:]
+    return records, start + len(records)
 
   @property
-  def values(self) -> DictProxy:
+  def values(self) -> OrderedDict:
     with self._lock:
-      return self._dict
+      return OrderedDict(self._records[:])
 
   def dispose(self):
     if self._is_closed:
@@ -71,11 +521,109 @@ class _SharedDictWriter(object):
 
     self._is_closed = True
     del self._lock
-    del self._dict
+    del self._records
     if self._path in _PROXY_DICT:
       del _PROXY_DICT[self._path]
 
 
+class _LocalDictWriter(object):
+  """ A dictionary for writing without inter-process communication or lock.
+
+  The owner (the process created the writer) keeps the indices in memory,
+  other processes (forked or unpickled copies) append each update to their
+  own shard file `'<path>.indices.<pid>'`, the shards are merged into the
+  owner's indices by `collect` (i.e. when flushing).
+  """
+
+  def __init__(self, init_dict, path, is_owner=True):
+    assert isinstance(init_dict, dict)
+    self._dict = OrderedDict(init_dict)
+    # the items in the order of writing (or merging)
+    self._records = list(self._dict.items())
+    self._path = path
+    self._owner_pid = os.getpid() if is_owner else None
+    self._shard_fd = None
+    self._shard_pid = None
+    # number of bytes merged from each shard file
+    self._shard_offsets = {}
+    self._is_closed = False
+
+  @staticmethod
+  def remove_shards(path):
+    for shard in glob.glob(glob.escape(path) + '.indices.*'):
+      os.remove(shard)
+
+  @property
+  def is_owner(self):
+    return self._owner_pid == os.getpid()
+
+  def _shard(self):
+    pid = os.getpid()
+    if self._shard_pid != pid:
+      self._shard_fd = os.open('%s.indices.%d' % (self._path, pid),
+                               os.O_WRONLY | os.O_CREAT | os.O_APPEND)
+      self._shard_pid = pid
+    return self._shard_fd
+
+  def update(self, items):
+    self._dict.update(items)
+    if self.is_owner:
+      self._records.extend(items.items())
+    else:
+      # a single append, the record is never interleaved with other process
+      data = pickle.dumps(dict(items))
+      os.write(self._shard(), len(data).to_bytes(8, 'little') + data)
+
+  def collect(self):
+    """ Merge new records from the shard files, return the number of
+    merged entries """
+    if not self.is_owner:
+      return 0
+    n = 0
+    for shard in sorted(glob.glob(glob.escape(self._path) + '.indices.*')):
+      offset = self._shard_offsets.get(shard, 0)
+      with open(shard, 'rb') as f:
+        f.seek(offset)
+        data = f.read()
+      pos = 0
+      while pos + 8 <= len(data):
+        size = int.from_bytes(data[pos:pos + 8], 'little')
+        # incomplete record, the process is still writing
+        if pos + 8 + size > len(data):
+          break
+        items = pickle.loads(data[pos + 8:pos + 8 + size])
+        self._dict.update(items)
+        self._records.extend(items.items())
+        n += len(items)
+        pos += 8 + size
+      self._shard_offsets[shard] = offset + pos
+    return n
+
+  def records(self, start=0):
+    """ Return the records written after the first `start` records, and
+    the total number of records """
+    self.collect()
+    return self._records[start:], len(self._records)
+
+  @property
+  def values(self) -> OrderedDict:
+    self.collect()
+    return self._dict
+
+  def dispose(self):
+    if self._is_closed:
+      return
+
+    self._is_closed = True
+    if self._shard_fd is not None and self._shard_pid == os.getpid():
+      os.close(self._shard_fd)
+    self._shard_fd = None
+    if self.is_owner:
+      for shard in self._shard_offsets:
+        if os.path.exists(shard):
+          os.remove(shard)
+
+
 # ===========================================================================
 # PointerArray
 # ===========================================================================
@@ -97,43 +645,139 @@ class PointerArrayWriter(MmapArrayWriter):
     data type
   remove_exist : boolean (default=False)
     if file at given path exists, remove it
+  index_mode : {'shared', 'local'}
+    'shared' - the indices are synchronized among processes by a
+      `multiprocessing.Manager` dictionary, every process could flush them.
+    'local' - the writer process keeps the indices in memory, other
+      processes append their indices to per-process shard files without
+      any lock or inter-process communication, the shards are merged when
+      the writer process calls `flush`. Copies of the writer in other
+      processes only flush the data.
+  **kwargs : other options of `MmapArrayWriter`, e.g. `growth_factor`,
+    `growth_chunk`, `write_workers`, `write_mode`
 
   Note
   ----
   All changes won't be saved until you call `PointerArrayWriter.flush`
+
+  The indices are stored as an append-only log after the data, each flush
+  only appends the entries written since the last flush, the log is
+  compacted into a single sealed segment on `close`. The log is moved when
+  the data grows over it, use `growth_factor` to amortize the moves.
+
+  The readers only memory-map the sealed indices, the unsealed log is
+  copied into memory since the writer overwrites it. Reopening a sealed
+  file unseals the indices in place (only the indices are moved with the
+  log, the data is never copied), the opened readers then read the
+  indices again on the next lookup.
   """
+  _DEFAULT_OPTIONS = dict(MmapArrayWriter._DEFAULT_OPTIONS, index_mode='shared')
 
-  def _init(self, path, shape, dtype, remove_exist, indices=None):
-    super(PointerArrayWriter, self)._init(path, shape, dtype, remove_exist)
-    self._is_indices_saved = False
-    if indices is not None:
-      self._indices = _SharedDictWriter(indices, self.path)
+  def __init__(self,
+               path: Text,
+               shape: Optional[List[int]] = None,
+               dtype: Optional[Union[Text, np.dtype]] = None,
+               remove_exist: bool = False,
+               index_mode: Text = 'shared',
+               **kwargs):
+    # the opened writer of the same path is reused as it is
+    if not self.is_closed:
+      self._check_reopen(shape,
+                         dtype,
+                         remove_exist,
+                         index_mode=index_mode,
+                         **kwargs)
       return
+    self._init(path,
+               shape,
+               dtype,
+               remove_exist,
+               index_mode=index_mode,
+               **kwargs)
 
+  def _init(self,
+            path,
+            shape,
+            dtype,
+            remove_exist,
+            index_mode='shared',
+            indices=None,
+            creator_pid=None,
+            **kwargs):
+    if index_mode not in ('shared', 'local'):
+      raise ValueError("index_mode must be 'shared' or 'local', given: %s" %
+                       str(index_mode))
+    is_copy = indices is not None
+    # the readers memory-map the sealed indices, they are unsealed before
+    # the data grows over them, the segment is moved with the log
+    if not is_copy and not remove_exist and \
+      _has_sealed_indices(os.path.abspath(path)):
+      _unseal(os.path.abspath(path))
+    super(PointerArrayWriter, self)._init(path, shape, dtype, remove_exist,
+                                          **kwargs)
+    self._is_indices_saved = False
+    # the indices stored in the file, and the new indices of this writer
+    if is_copy:
+      base_indices, indices = indices
+      if not isinstance(base_indices, _PointerIndex):
+        base_indices = _ReadOnlyDict(base_indices)
     # first time create the file
-    if self._start_position == 0 or self.shape[0] == 0:
-      self._indices = _SharedDictWriter(OrderedDict(), self.path)
-    # MmapArray already existed
+    elif self._start_position == 0 or self.shape[0] == 0:
+      base_indices = _ReadOnlyDict()
+      indices = OrderedDict()
+    # MmapArray already existed, the indices are copied into memory since
+    # appending data will overwrite the end of the file
     else:
-      cur_pos = self._file.tell()
-      filesize = os.stat(self.path).st_size
-      self._file.seek(filesize - 8)
-      indices_size = int.from_bytes(self._file.read(8), 'big')
-      self._file.seek(filesize - 8 - indices_size)
-      self._indices = _SharedDictWriter(
-          pickle.loads(self._file.read(indices_size)), self.path)
-      self._file.seek(cur_pos)
+      base_indices = _read_indices(self.path, in_memory=True)
+      indices = OrderedDict()
+    self._base_indices = base_indices
+    self._index_mode = index_mode
+    # identify the log segments appended by this writer (and its forked
+    # processes), unpickled copies use their own token
+    self._log_token = int.from_bytes(os.urandom(7), 'little')
+    # only the process that created the writer compacts the log, the pid is
+    # passed to the copies since `_init` runs again when unpickling
+    self._creator_pid = os.getpid() if creator_pid is None else creator_pid
+    if index_mode == 'shared':
+      self._indices = _SharedDictWriter(indices, self.path)
+    else:
+      if remove_exist:
+        _LocalDictWriter.remove_shards(self.path)
+      # unpickled copies are never the owner
+      self._indices = _LocalDictWriter(indices, self.path, is_owner=not is_copy)
+
+  def _options(self):
+    options = super(PointerArrayWriter, self)._options()
+    options['index_mode'] = self._index_mode
+    return options
 
   def __getstate__(self):
-    return self.path, self.shape, self.dtype, dict(self._indices.values)
+    states = super(PointerArrayWriter, self).__getstate__()
+    base_indices = self._base_indices
+    if not isinstance(base_indices, _PointerIndex):
+      base_indices = dict(base_indices)
+    # the copies of a 'local' writer only record their own indices
+    if self._index_mode == 'shared':
+      indices = dict(self._indices.values)
+    else:
+      indices = {}
+    return states + ((base_indices, indices), self._creator_pid)
 
   def __setstate__(self, states):
-    path, shape, dtype, indices = states
-    self._init(path, shape, dtype, remove_exist=False, indices=indices)
+    path, shape, dtype, options, indices, creator_pid = states
+    self._init(path,
+               shape,
+               dtype,
+               remove_exist=False,
+               indices=indices,
+               creator_pid=creator_pid,
+               **options)
 
   @property
   def indices(self):
-    return _ReadOnlyDict(self._indices.values)
+    indices = OrderedDict(self._base_indices.items())
+    indices.update(self._indices.values)
+    return _ReadOnlyDict(indices)
 
   def write(self, arrays: Dict[Text, np.ndarray], start_position=None):
     """ Extending the memory-mapped data and copy the array
@@ -185,25 +829,133 @@ class PointerArrayWriter(MmapArrayWriter):
     return super(PointerArrayWriter, self).write(accepted_arrays,
                                                  start_position)
 
-  def flush(self):
-    super(PointerArrayWriter, self).flush()
+  def _log_offset(self, capacity=None):
+    """ The smallest position of the indices log, right after the reserved
+    capacity """
+    if capacity is None:
+      capacity = self._data.shape[0]
+    dtype = self._data.dtype
+    row_size = int(np.prod(self._data.shape[1:], dtype='int64')) * \
+      dtype.itemsize
+    return _pad8(self._data_offset + capacity * row_size)
+
+  def _remap(self, capacity):
+    # the data will overwrite the indices log, move the log after the new
+    # capacity, the segment offsets are relative to the log start so the
+    # log is copied as it is
+    if capacity <= self._data.shape[0]:
+      super(PointerArrayWriter, self)._remap(capacity)
+      return self
+    old_offset = self._log_offset()
+    with open(self.path, 'rb') as lock, _locked(lock):
+      log = None
+      footer = _read_log_footer(lock)
+      if footer is not None and footer[0] >= old_offset:
+        lock.seek(footer[0])
+        log = lock.read()
+      super(PointerArrayWriter, self)._remap(capacity)
+      if log is not None and footer[0] < self._log_offset():
+        f = self._file
+        f.seek(self._log_offset())
+        f.write(log)
+        f.truncate()
+        f.flush()
+    return self
+
+  def _shrink_to_length(self):
+    truncated = super(PointerArrayWriter, self)._shrink_to_length()
+    # the indices stored after the reserved capacity are removed
+    if truncated:
+      self._is_indices_saved = False
+    return truncated
+
+  def _save_indices(self):
+    """ Append the new entries to the indices log (page cache) """
+    # only the owner of 'local' indices could write the indices
+    if not self._indices.is_owner:
+      return
+    if self._indices.collect() > 0:
+      self._is_indices_saved = False
     if self._is_indices_saved:
       return
     self._is_indices_saved = True
 
-    try:  # skip if the manager is already closed
-      indices = dict(self._indices.values)
-    except FileNotFoundError:
-      return
+    with open(self.path, 'rb+') as f, _locked(f):
+      footer = _read_log_footer(f)
+      # the log is valid if it is not overwritten by the data
+      is_valid = footer is not None and footer[0] >= self._log_offset()
+      # only the records since the last flush of this writer
+      start = 0
+      if is_valid and footer[1] == self._log_token:
+        start = footer[2]
+      try:  # skip if the manager is already closed
+        records, n_records = self._indices.records(start)
+      except FileNotFoundError:
+        return
+      if is_valid:
+        if len(records) == 0 and start > 0:
+          return
+        log_start, _, _, offsets, sizes = footer
+        keys, starts, ends = _index_arrays(OrderedDict(records))
+      # write all the indices to a new log
+      else:
+        log_start, offsets, sizes = _pad8(f.seek(0, os.SEEK_END)), [], []
+        keys, starts, ends = _merge_indices(self._base_indices,
+                                            OrderedDict(records))
+      _append_log(f, log_start, offsets, sizes, keys, starts, ends,
+                  self._log_token, n_records)
 
-    with open(self.path, 'ab') as f:
-      indices_data = pickle.dumps(indices)
-      size = len(indices_data).to_bytes(8, 'big')
-      f.write(indices_data + size)
-    return self
+  def flush(self, durability: Text = 'index', asynchronous: bool = False):
+    """ Save the data and the indices to the file
+
+    Parameters
+    ----------
+    durability : {'none', 'page_cache', 'data', 'index'}
+      'none' - do nothing
+      'page_cache' - write the header and the indices to the page cache
+      'data' - synchronize the data to the disk, then write the indices to
+        the page cache
+      'index' - write the indices, then synchronize both the data and the
+        indices to the disk
+    asynchronous : `bool`
+      if `True`, the synchronization runs on a background thread and a
+      `concurrent.futures.Future` is returned, the writer could keep
+      writing meanwhile
+
+    Return
+    ------
+    `PointerArrayWriter`, or `Future` if `asynchronous=True`
+
+    Note
+    ----
+    The indices log is stored right after the capacity of the data, with
+    the default `growth_factor=1.0` every write after a flush grows the
+    data over the log and copies the whole log. Use `growth_factor > 1` (or
+    `growth_chunk`) when flushing frequently, the reserved capacity is
+    removed on `close`.
+    """
+    return super(PointerArrayWriter, self).flush(durability, asynchronous)
+
+  def _flush(self, durability, asynchronous):
+    if durability in ('none', 'page_cache', 'data'):
+      result = super(PointerArrayWriter, self)._flush(durability, asynchronous)
+      if durability != 'none':
+        self._save_indices()
+      return result
+    super(PointerArrayWriter, self)._flush('page_cache', False)
+    self._save_indices()
+    return self._sync(asynchronous)
 
   def close(self):
+    if self.is_closed:
+      return
+    # the reserved capacity is removed when closing
+    log_offset = self._log_offset(self._length)
     super(PointerArrayWriter, self).close()
+    # merge the segments of the indices log (synchronized after the flush of
+    # the writer, the data is already on the disk)
+    if self._indices.is_owner and self._creator_pid == os.getpid():
+      _compact_indices(self.path, min_log_start=log_offset)
     self._indices.dispose()
 
 
@@ -220,7 +972,7 @@ class PointerArray(MmapArray):
     ----------
     path : str, file-like object, or pathlib.Path instance
         The file name or file object to be used as the array data buffer.
-    mode : {'r+', 'r', 'w+', 'c'}, optional
+    mode : {'r+', 'r', 'c'}, optional
         The file is opened in this mode:
 
         +------+-------------------------------------------------------------+
@@ -228,30 +980,126 @@ class PointerArray(MmapArray):
         +------+-------------------------------------------------------------+
         | 'r+' | Open existing file for reading and writing.                 |
         +------+-------------------------------------------------------------+
-        | 'w+' | Create or overwrite existing file for reading and writing.  |
-        +------+-------------------------------------------------------------+
         | 'c'  | Copy-on-write: assignments affect data in memory, but       |
         |      | changes are not saved to disk.  The file on disk is         |
         |      | read-only.                                                  |
         +------+-------------------------------------------------------------+
-        Default is 'r+'.
+        Default is 'r+'. The file is created (or overwritten) by
+        `PointerArrayWriter`.
+    access_pattern : {None, 'normal', 'random', 'sequential', 'willneed'}
+        hint for the kernel how the whole array will be accessed,
+        see `MmapArray.advise`
   """
 
   def __init__(self, *args, **kwargs):
     super(PointerArray, self).__init__()
-    with open(self.path, 'rb') as f:
-      filesize = os.stat(self.path).st_size
-      f.seek(filesize - 8)
-      indices_size = int.from_bytes(f.read(8), 'big')
-      f.seek(filesize - 8 - indices_size)
-      self._indices = _ReadOnlyDict(pickle.loads(f.read(indices_size)))
+    # the binary indices are memory-mapped and looked up lazily,
+    # legacy files with pickled indices are still supported
+    self._indices = _read_indices(self.path, buffer=self._mmap)
+    self._n_rows = self.shape[0]
+
+  def __array_finalize__(self, obj):
+    super(PointerArray, self).__array_finalize__(obj)
+    self._indices = getattr(obj, '_indices', None)
+    self._n_rows = getattr(obj, '_n_rows', None)
 
   @property
   def indices(self):
-    return self._indices
+    indices = self._indices
+    # unpickled views read the indices on the first access
+    if indices is None and self._mmap is not None:
+      self._indices = indices = _read_indices(self.path, buffer=self._mmap)
+    # a writer reopened the file, the mapped indices are being overwritten,
+    # keep the entries of the rows of this array (unknown for unpickled views)
+    elif isinstance(indices, _PointerIndex) and indices.is_stale:
+      keys, starts, ends = _index_arrays(
+          _read_indices(self.path, in_memory=True))
+      keep = slice(None) if self._n_rows is None else ends <= self._n_rows
+      self._indices = indices = _PointerIndex(
+          np.frombuffer(_PointerIndex.dumps(keys[keep], starts[keep],
+                                            ends[keep]),
+                        dtype=np.uint8))
+    return indices
+
+  def _map_writer(self, path, shape, dtype):
+    # the rows are mapped one-to-one, the output has the same keys
+    writer = PointerArrayWriter(path,
+                                shape,
+                                dtype,
+                                remove_exist=True,
+                                index_mode='local')
+    writer._indices.update(OrderedDict(self.indices.items()))
+    return writer
 
   def __getitem__(self, key):
     if isinstance(key, string_types):
-      start, end = self._indices[key]
-      return self[start:end]
+      cache = self._row_cache
+      if cache is not None:
+        return cache.get_or_load((self._path, self._cache_offset, key),
+                                 lambda: self._get_key(key))
+      return self._get_key(key)
     return super(PointerArray, self).__getitem__(key)
+
+  def _get_key(self, key):
+    token = _METRICS.start()
+    start, end = self.indices[key]
+    _METRICS.stop('key_lookup', token, rows=1)
+    return self[start:end]
+
+  async def aget(self, key: Text) -> np.ndarray:
+    """ Read the data of `key` into memory without blocking the event loop,
+    see `MmapArray.aread` """
+    start, end = self.indices[key]
+    return await self.aread(slice(start, end))
+
+  async def agather(self,
+                    keys: Iterable[Text],
+                    padding: bool = False,
+                    pad_value=0):
+    """ Read the data of many keys without blocking the event loop, the
+    ranges are sorted and the nearby ranges are merged into contiguous
+    reads (see `COALESCE_GAP`), which are run concurrently with `os.preadv`,
+    see `gather` for the parameters and the returned values """
+    starts, ends = _lookup_indices(self.indices, keys)
+    lengths = ends - starts
+    try:
+      self._direct_range()
+    except ValueError:
+      return await _AIO.run(
+          lambda: self.gather(keys, padding=padding, pad_value=pad_value))
+    buffer, shifts = await _aread_coalesced(self, starts, ends)
+    return _gather_ranges(buffer,
+                          shifts,
+                          shifts + lengths,
+                          padding=padding,
+                          pad_value=pad_value,
+                          coalesce=False)
+
+  def gather(self, keys: Iterable[Text], padding: bool = False, pad_value=0):
+    """ Read the data of many keys at once, the keys are resolved into
+    vectorized `(start, end)` arrays and the data is copied with a single
+    fancy indexing.
+
+    Parameters
+    ----------
+    keys : list of `str`
+      the identities
+    padding : `bool` (default=False)
+      if `True`, return a padded batch of shape `[n_keys, max_length, ...]`
+      instead of the concatenated data
+    pad_value : scalar
+      value for the padded positions
+
+    Return
+    ------
+    if `padding=False`: `(data, offsets)`, the data of `keys[i]` is
+      `data[offsets[i]:offsets[i + 1]]`
+    if `padding=True`: `(batch, lengths)`, the data of `keys[i]` is
+      `batch[i, :lengths[i]]`
+    """
+    starts, ends = _lookup_indices(self.indices, keys)
+    return _gather_ranges(self,
+                          starts,
+                          ends,
+                          padding=padding,
+                          pad_value=pad_value)
@@ -0,0 +1,270 @@
+from __future__ import absolute_import, division, print_function
+
+import os
+from typing import Iterable, List, Optional, Text, Union
+
+import numpy as np
+from six import string_types
+
+from bigarray.mmap_array import MmapArray, MmapArrayWriter, _gather_ranges
+
+__all__ = [
+    'RaggedMmapArrayWriter',
+    'RaggedMmapArray',
+]
+
+_OFFSETS_SUFFIX = '.offsets'
+
+
+# ===========================================================================
+# Writer
+# ===========================================================================
+class RaggedMmapArrayWriter(object):
+  """ Writer for `RaggedMmapArray`, the rows are appended to the data file,
+  and the end position of each row is appended to the offsets file
+  `path + '.offsets'` (an int64 `MmapArray`).
+
+  Parameters
+  ----------
+  path : str
+    path to the data file
+  shape : `tuple`
+    the shape of the data, the first dimension is the total number of
+    elements of all rows (e.g. `(0, 80)` for rows of 80-dim frames)
+  dtype : numpy.dtype
+    data type
+  remove_exist : boolean (default=False)
+    if file at given path exists, remove it
+  **kwargs : other options of `MmapArrayWriter`, e.g. `growth_factor`
+  """
+
+  def __init__(self,
+               path: Text,
+               shape: Optional[List[int]] = None,
+               dtype: Optional[Union[Text, np.dtype]] = None,
+               remove_exist: bool = False,
+               **kwargs):
+    if not isinstance(path, string_types):
+      raise ValueError("Only support file path, and not file descriptor ID")
+    path = os.path.abspath(path)
+    offsets_path = path + _OFFSETS_SUFFIX
+    if remove_exist and os.path.exists(offsets_path):
+      os.remove(offsets_path)
+    is_new = not os.path.exists(offsets_path)
+    if is_new and not remove_exist and os.path.exists(path) and \
+      os.stat(path).st_size > 0:
+      raise RuntimeError("Found data at path '%s' but no offsets file, use "
+                         "remove_exist=True to overwrite it" % path)
+    self._data = MmapArrayWriter(path,
+                                 shape=shape,
+                                 dtype=dtype,
+                                 remove_exist=remove_exist,
+                                 **kwargs)
+    self._offsets = MmapArrayWriter(offsets_path,
+                                    shape=(0,),
+                                    dtype='int64',
+                                    **kwargs)
+    if is_new:
+      self._offsets.write(np.zeros((1,), dtype='int64'))
+    # the data written after the last row (e.g. interrupted writing) is
+    # overwritten
+    self._end = int(self._offsets._data[self._offsets.shape[0] - 1])
+
+  @property
+  def path(self):
+    return self._data.path
+
+  @property
+  def shape(self):
+    """ The shape of the flat data """
+    return (self._end,) + self._data.shape[1:]
+
+  @property
+  def dtype(self):
+    return self._data.dtype
+
+  def __len__(self):
+    return self._offsets.shape[0] - 1
+
+  def write(self,
+            arrays: Union[Iterable[np.ndarray], np.ndarray],
+            lengths: Optional[Iterable[int]] = None):
+    """ Append rows to the array
+
+    Parameters
+    ----------
+    arrays : list of `numpy.ndarray`, or `numpy.ndarray`
+      the rows, or the concatenated data of all rows if `lengths` is given
+    lengths : array of `int` (optional)
+      the length of each row in the concatenated data
+
+    Return
+    ------
+    `RaggedMmapArrayWriter` for method chaining
+    """
+    if lengths is None:
+      arrays = list(arrays)
+      lengths = np.array([a.shape[0] for a in arrays], dtype='int64')
+      data = np.concatenate(arrays, axis=0) if len(arrays) > 0 else \
+        np.empty((0,) + self._data.shape[1:], dtype=self.dtype)
+    else:
+      data = arrays
+      lengths = np.asarray(lengths, dtype='int64')
+      if int(np.sum(lengths)) != data.shape[0]:
+        raise ValueError("Sum of lengths (%d) mismatch the length of the data "
+                         "(%d)" % (int(np.sum(lengths)), data.shape[0]))
+    if lengths.shape[0] == 0:
+      return self
+    # the data is written before the offsets, so the offsets never point to
+    # unwritten data
+    self._data.write(data, start_position=self._end)
+    offsets = self._end + np.cumsum(lengths)
+    self._offsets.write(offsets)
+    self._end = int(offsets[-1])
+    return self
+
+  def flush(self, *args, **kwargs):
+    self._data.flush(*args, **kwargs)
+    self._offsets.flush(*args, **kwargs)
+    return self
+
+  def close(self):
+    self._data.close()
+    self._offsets.close()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    self.close()
+
+
+# ===========================================================================
+# Reader
+# ===========================================================================
+class RaggedMmapArray(object):
+  """ A memory-mapped array of variable-length rows, stored as the flat data
+  and an int64 offsets array (`path + '.offsets'`), row `i` is
+  `data[offsets[i]:offsets[i + 1]]`.
+
+  Opening the array only maps the two files. Indexing with a slice or an
+  array of indices returns a `RaggedMmapArray` view of the selected rows
+  without copying any data.
+
+  Parameters
+  ----------
+  path : str
+    path to the data file
+  mode : {'r', 'r+', 'c'}
+    mode for opening the files, see `MmapArray`
+  """
+
+  def __init__(self, path: Text, mode: Text = 'r'):
+    if not isinstance(path, string_types):
+      raise ValueError("Only support file path, and not file descriptor ID")
+    path = os.path.abspath(path)
+    offsets = MmapArray(path + _OFFSETS_SUFFIX, mode='r')
+    self._data = MmapArray(path, mode=mode)
+    self._starts = offsets[:-1]
+    self._ends = offsets[1:]
+
+  @classmethod
+  def _view(cls, data, starts, ends):
+    array = cls.__new__(cls)
+    array._data = data
+    array._starts = starts
+    array._ends = ends
+    return array
+
+  @property
+  def path(self):
+    return self._data.path
+
+  @property
+  def data(self) -> MmapArray:
+    """ The flat data of all rows """
+    return self._data
+
+  @property
+  def starts(self) -> np.ndarray:
+    return self._starts
+
+  @property
+  def ends(self) -> np.ndarray:
+    return self._ends
+
+  @property
+  def lengths(self) -> np.ndarray:
+    """ The length of each row """
+    return np.asarray(self._ends) - np.asarray(self._starts)
+
+  @property
+  def dtype(self):
+    return self._data.dtype
+
+  @property
+  def row_shape(self):
+    """ The shape of each row except the first (variable) dimension """
+    return self._data.shape[1:]
+
+  def __len__(self):
+    return self._starts.shape[0]
+
+  def __getitem__(self, key):
+    if isinstance(key, (int, np.integer)):
+      idx = int(key)
+      if idx < 0:
+        idx += len(self)
+      if not 0 <= idx < len(self):
+        raise IndexError("index %d is out of bounds for axis 0 with size %d" %
+                         (int(key), len(self)))
+      return self._data[int(self._starts[idx]):int(self._ends[idx])]
+    if not isinstance(key, slice):
+      key = np.asarray(key)
+      if key.dtype == np.bool_:
+        key = np.nonzero(key)[0]
+      elif key.dtype.kind not in 'iu':
+        raise IndexError("Only integers, slices and integer or boolean "
+                         "arrays are valid indices, given: %s" % str(key))
+    return self._view(self._data, self._starts[key], self._ends[key])
+
+  def __iter__(self):
+    data = self._data
+    for start, end in zip(
+        np.asarray(self._starts).tolist(),
+        np.asarray(self._ends).tolist()):
+      yield data[start:end]
+
+  def gather(self,
+             indices: Optional[Iterable[int]] = None,
+             padding: bool = False,
+             pad_value=0):
+    """ Copy the rows at once with a single fancy indexing.
+
+    Parameters
+    ----------
+    indices : array of `int` (optional)
+      the rows, all rows if `None`
+    padding : `bool` (default=False)
+      if `True`, return a padded batch of shape `[n_rows, max_length, ...]`
+      instead of the concatenated data
+    pad_value : scalar
+      value for the padded positions
+
+    Return
+    ------
+    if `padding=False`: `(data, offsets)`, the row `i` is
+      `data[offsets[i]:offsets[i + 1]]`
+    if `padding=True`: `(batch, lengths)`, the row `i` is
+      `batch[i, :lengths[i]]`
+    """
+    array = self if indices is None else self[indices]
+    return _gather_ranges(self._data,
+                          array.starts,
+                          array.ends,
+                          padding=padding,
+                          pad_value=pad_value)
+
+  def __repr__(self):
+    return '<RaggedMmapArray rows:%d row_shape:%s dtype:%s path:%s>' % (
+        len(self), str(self.row_shape), str(self.dtype), self.path)
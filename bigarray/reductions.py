@@ -0,0 +1,288 @@
+from __future__ import absolute_import, division, print_function
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Optional, Tuple
+
+import numpy as np
+
+from bigarray.mmap_array import (MmapArray, _mark_statistics, _mmap_address,
+                                 _read_header, _read_metadata, _write_metadata)
+
+__all__ = [
+    'compute_statistics',
+]
+
+# default size of each block of rows (in bytes, after casting to float64)
+_BLOCK_BYTES = 32 * 1024 * 1024
+# the quantile sketches of this number of blocks are merged into one
+_SKETCH_MERGE = 8
+
+
+# ===========================================================================
+# Helper
+# ===========================================================================
+def _block_bounds(n, row_size, block_rows):
+  if block_rows is None:
+    block_rows = max(1, _BLOCK_BYTES // max(row_size * 8, 1))
+  block_rows = max(1, int(block_rows))
+  return [(i, min(i + block_rows, n)) for i in range(0, n, block_rows)]
+
+
+def _block_moments(block):
+  """ `(count, sum, mean, M2, min, max)` of a block of float64 rows """
+  n = block.shape[0]
+  total = np.sum(block, axis=0)
+  mean = total / n
+  m2 = np.sum(np.square(block - mean), axis=0)
+  return n, total, mean, m2, np.min(block, axis=0), np.max(block, axis=0)
+
+
+def _merge_moments(a, b):
+  """ Merge the moments of two blocks (Chan et al. parallel algorithm) """
+  na, sa, ma, m2a, mina, maxa = a
+  nb, sb, mb, m2b, minb, maxb = b
+  n = na + nb
+  delta = mb - ma
+  mean = ma + delta * (nb / n)
+  m2 = m2a + m2b + np.square(delta) * (na * nb / n)
+  return (n, sa + sb, mean, m2, np.minimum(mina, minb), np.maximum(maxa, maxb))
+
+
+def _block_histogram(block, edges):
+  """ Histogram of each column, `edges` has shape `[bins + 1, n_columns]`,
+  the values outside the edges (and NaN) are ignored like `np.histogram` """
+  bins = edges.shape[0] - 1
+  n_columns = block.shape[1]
+  ids = np.empty(block.shape, dtype='int64')
+  for col in range(n_columns):
+    ids[:, col] = np.searchsorted(edges[1:-1, col], block[:, col], side='right')
+  ids = ids * n_columns + np.arange(n_columns)
+  valid = (block >= edges[0]) & (block <= edges[-1])
+  return np.bincount(ids[valid],
+                     minlength=bins * n_columns).reshape(bins, n_columns)
+
+
+def _weighted_quantiles(values, weights, quantiles):
+  """ Quantiles of each column of `values` (shape `[n, n_columns]`) where
+  each value has a weight """
+  order = np.argsort(values, axis=0, kind='stable')
+  values = np.take_along_axis(values, order, axis=0)
+  weights = np.take_along_axis(weights, order, axis=0)
+  cumulative = np.cumsum(weights, axis=0) - weights / 2.
+  cumulative /= np.sum(weights, axis=0)
+  return np.stack([
+      np.interp(quantiles, cumulative[:, col], values[:, col])
+      for col in range(values.shape[1])
+  ],
+                  axis=1)
+
+
+def _merge_sketches(sketches, sketch_size):
+  """ Merge the `(values, weights)` sketches into one sketch of
+  `sketch_size` equally weighted quantiles of each column """
+  values = np.concatenate([v for v, _ in sketches], axis=0)
+  weights = np.concatenate([w for _, w in sketches], axis=0)
+  # the midpoint ranks, the positions of equally weighted values in
+  # `_weighted_quantiles`
+  n = min(sketch_size, values.shape[0])
+  q = (np.arange(n) + 0.5) / n
+  merged = _weighted_quantiles(values, weights, q)
+  return merged, np.full(merged.shape, np.sum(weights, axis=0) / len(q))
+
+
+def _cache_header(array):
+  """ The header of the file if the cached statistics are supported, i.e.
+  `array` is the whole data of a `MmapArray` file (not a view of a part of
+  it) with the version 2 header """
+  if not isinstance(array, MmapArray) or array._mmap is None or \
+    array.path is None:
+    return None
+  with open(array.path, 'rb') as f:
+    header = _read_header(f.fileno())
+  if header.version < 2 or tuple(header.shape) != array.shape or \
+    not array.flags['C_CONTIGUOUS'] or \
+    array.ctypes.data != _mmap_address(array._mmap) + header.data_offset:
+    return None
+  return header
+
+
+def _encode(results):
+  """ Encode the arrays of the results for `marshal` """
+  return {
+      k: (v.dtype.str, v.shape, v.tobytes()) if isinstance(v, np.ndarray) else v
+      for k, v in results.items()
+  }
+
+
+def _decode(results):
+  return {
+      k:
+          np.frombuffer(v[2], dtype=v[0]).reshape(v[1])
+          if isinstance(v, tuple) else v for k, v in results.items()
+  }
+
+
+def _load_cache(path, shape, key):
+  with open(path, 'rb') as f:
+    statistics = _read_metadata(f.fileno()).get('statistics', None)
+  if statistics is None or tuple(statistics['shape']) != shape or \
+    key not in statistics['results']:
+    return None
+  return _decode(statistics['results'][key])
+
+
+def _save_cache(path, shape, key, results):
+  """ Store the results in the metadata, the results are not cached if the
+  metadata exceeds the capacity of the header """
+  with open(path, 'rb+') as f:
+    fd = f.fileno()
+    metadata = _read_metadata(fd)
+    statistics = metadata.get('statistics', None)
+    if statistics is None or tuple(statistics['shape']) != shape:
+      statistics = dict(shape=shape, results={})
+    statistics['results'][key] = _encode(results)
+    metadata['statistics'] = statistics
+    try:
+      _write_metadata(fd, metadata)
+    except ValueError:
+      return False
+  _mark_statistics(path)
+  return True
+
+
+# ===========================================================================
+# Main
+# ===========================================================================
+def compute_statistics(array,
+                       block_rows: Optional[int] = None,
+                       workers: int = 4,
+                       bins: Optional[int] = None,
+                       value_range: Optional[Tuple[float, float]] = None,
+                       quantiles: Optional[Iterable[float]] = None,
+                       sketch_size: int = 128,
+                       cache: bool = False) -> dict:
+  """ Compute the statistics along the first axis by streaming blocks of
+  rows, so the memory is bounded by `workers * block_rows` rows.
+
+  The blocks are reduced by a thread pool (numpy releases the GIL), the
+  moments of the blocks are merged with the parallel variance algorithm
+  (Chan et al.), which is numerically stable for big arrays.
+
+  Parameters
+  ----------
+  array : {`MmapArray`, `PointerArray`, `ShardedMmapArray`,
+    `CompressedArray`, `numpy.ndarray`}
+    the array, any object supports `shape` and slicing of the first axis
+  block_rows : `int` (optional)
+    number of rows in each block, by default, blocks of 32MB (float64)
+  workers : `int`
+    number of threads
+  bins : `int` (optional)
+    if given, compute the histogram of each column with this number of bins
+  value_range : `(float, float)` (optional)
+    the range of the histogram, `(min, max)` of each column by default
+    (which requires a second pass over the array), the values outside the
+    range are ignored
+  quantiles : list of `float` (optional)
+    if given, estimate these quantiles (in `[0, 1]`) of each column
+  sketch_size : `int`
+    number of quantiles kept for each block, the error of the estimated
+    quantiles is about `1 / sketch_size` of the block ranks. The sketches
+    are merged every 8 blocks into a sketch of `8 * sketch_size`
+    quantiles, so the memory is bounded for any number of blocks.
+  cache : `bool`
+    if `True` and `array` is the whole `MmapArray` file (with the version 2
+    header), the results are stored in the metadata of the file and
+    returned the next time. The cache is invalidated by the next write of a
+    writer opened after caching or opened in this process (a writer of
+    another process does not see it), results bigger than the metadata
+    capacity are not cached.
+
+  Return
+  ------
+  a dictionary: 'count', 'sum', 'mean', 'var', 'std', 'min', 'max', and
+    'histogram', 'bin_edges' (if `bins` is given), 'quantiles' (if
+    `quantiles` is given). The statistics have the shape of a row.
+  """
+  shape = tuple(array.shape)
+  if len(shape) == 0 or shape[0] == 0:
+    raise ValueError("Cannot compute statistics of an empty array with "
+                     "shape: %s" % str(shape))
+  row_shape = shape[1:]
+  n_columns = int(np.prod(row_shape, dtype='int64'))
+  quantiles = None if quantiles is None else \
+    tuple(float(q) for q in quantiles)
+  # ====== check the cache ====== #
+  if value_range is not None:
+    value_range = (float(value_range[0]), float(value_range[1]))
+  cache = cache and _cache_header(array) is not None
+  key = (block_rows, bins, value_range, quantiles, sketch_size)
+  if cache:
+    results = _load_cache(array.path, shape, key)
+    if results is not None:
+      return results
+  # ====== reduce the blocks ====== #
+  bounds = _block_bounds(shape[0], n_columns, block_rows)
+
+  def read(start, end):
+    return np.asarray(array[start:end],
+                      dtype='float64').reshape(end - start, n_columns)
+
+  def reduce_block(bound):
+    block = read(*bound)
+    moments = _block_moments(block)
+    if quantiles is None:
+      return moments, None
+    q = np.linspace(0., 1., min(sketch_size, block.shape[0]))
+    sketch = np.quantile(block, q, axis=0)
+    return moments, (sketch, np.full(sketch.shape, block.shape[0] / len(q)))
+
+  with ThreadPoolExecutor(max_workers=max(1, int(workers))) as executor:
+    moments = None
+    sketches = []
+    for block_moments, sketch in executor.map(reduce_block, bounds):
+      moments = block_moments if moments is None else \
+        _merge_moments(moments, block_moments)
+      # the memory of the sketches is bounded for any number of blocks
+      if sketch is not None:
+        sketches.append(sketch)
+        if len(sketches) > _SKETCH_MERGE:
+          sketches = [_merge_sketches(sketches, sketch_size * _SKETCH_MERGE)]
+    n, total, mean, m2, vmin, vmax = moments
+    results = dict(count=n,
+                   sum=total.reshape(row_shape),
+                   mean=mean.reshape(row_shape),
+                   var=(m2 / n).reshape(row_shape),
+                   std=np.sqrt(m2 / n).reshape(row_shape),
+                   min=vmin.reshape(row_shape),
+                   max=vmax.reshape(row_shape))
+    # ====== histogram (second pass) ====== #
+    if bins is not None:
+      if value_range is None:
+        low, high = vmin, vmax
+      else:
+        low = np.full((n_columns,), value_range[0], dtype='float64')
+        high = np.full((n_columns,), value_range[1], dtype='float64')
+      # a constant column has the range `[value - 0.5, value + 0.5]`, like
+      # `np.histogram`
+      is_constant = low == high
+      low = np.where(is_constant, low - 0.5, low)
+      high = np.where(is_constant, high + 0.5, high)
+      edges = np.linspace(low, high, int(bins) + 1)
+      histogram = np.zeros((int(bins), n_columns), dtype='int64')
+      for counts in executor.map(
+          lambda bound: _block_histogram(read(*bound), edges), bounds):
+        histogram += counts
+      results['histogram'] = histogram.reshape((int(bins),) + row_shape)
+      results['bin_edges'] = edges.reshape((int(bins) + 1,) + row_shape)
+  # ====== merge the quantile sketches ====== #
+  if quantiles is not None:
+    values = np.concatenate([s for s, _ in sketches], axis=0)
+    weights = np.concatenate([w for _, w in sketches], axis=0)
+    results['quantiles'] = _weighted_quantiles(
+        values, weights,
+        np.asarray(quantiles)).reshape((len(quantiles),) + row_shape)
+  # ====== save the cache ====== #
+  if cache:
+    _save_cache(array.path, shape, key, results)
+  return results
@@ -0,0 +1,186 @@
+from __future__ import absolute_import, division, print_function
+
+import threading
+from collections import OrderedDict
+from typing import Callable, Hashable, Optional, Text
+
+import numpy as np
+
+__all__ = [
+    'MAX_CACHE_BYTES',
+    'RowCache',
+]
+
+# default budget of a `RowCache`
+MAX_CACHE_BYTES = 64 * 1024 * 1024
+_MISSING = object()
+
+
+# ===========================================================================
+# Helper
+# ===========================================================================
+def _freeze(value):
+  """ Materialize a read-only copy of `value`, so it is shared by all the
+  threads without copying on hit and never changes the cached bytes """
+  if isinstance(value, np.ndarray):
+    value = np.array(value, copy=True, subok=False)
+    value.flags.writeable = False
+  return value
+
+
+def _nbytes(value):
+  return int(value.nbytes) if hasattr(value, 'nbytes') else \
+    np.asarray(value).nbytes
+
+
+# ===========================================================================
+# Main
+# ===========================================================================
+class RowCache(object):
+  """ A thread-safe in-process cache of materialized rows, bounded by the
+  total number of bytes.
+
+  The eviction is a segmented LRU: new entries are put in the probationary
+  segment, an entry read again is promoted to the protected segment
+  (`protected_ratio` of the budget). The entries of a one-off scan are
+  only seen once, they are evicted from the probationary segment without
+  evicting the frequently read entries.
+
+  The cached values are read-only copies, the same object is returned on
+  every hit. The arrays use the keys `(path, offset, key)`, see
+  `MmapArray.set_cache`.
+
+  Parameters
+  ----------
+  max_bytes : `int`
+    the budget of the cache, values bigger than the budget are not cached
+  protected_ratio : `float`
+    the fraction of the budget for the protected segment
+  """
+
+  def __init__(self,
+               max_bytes: int = MAX_CACHE_BYTES,
+               protected_ratio: float = 0.8):
+    if not 0. <= protected_ratio < 1.:
+      raise ValueError("protected_ratio must be in [0, 1), given: %s" %
+                       str(protected_ratio))
+    self.max_bytes = max(0, int(max_bytes))
+    self.protected_ratio = float(protected_ratio)
+    self._probation = OrderedDict()
+    self._protected = OrderedDict()
+    self._probation_bytes = 0
+    self._protected_bytes = 0
+    self._lock = threading.Lock()
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+
+  @property
+  def nbytes(self):
+    return self._probation_bytes + self._protected_bytes
+
+  def __len__(self):
+    return len(self._probation) + len(self._protected)
+
+  def __contains__(self, key):
+    with self._lock:
+      return key in self._protected or key in self._probation
+
+  def _evict(self):
+    # the demoted entries of the protected segment get a second chance in
+    # the probationary segment
+    protected_bytes = self.max_bytes * self.protected_ratio
+    while self._protected_bytes > protected_bytes:
+      key, (value, nbytes) = self._protected.popitem(last=False)
+      self._protected_bytes -= nbytes
+      self._probation[key] = (value, nbytes)
+      self._probation_bytes += nbytes
+    while self.nbytes > self.max_bytes:
+      if len(self._probation) > 0:
+        _, (_, nbytes) = self._probation.popitem(last=False)
+        self._probation_bytes -= nbytes
+      else:
+        _, (_, nbytes) = self._protected.popitem(last=False)
+        self._protected_bytes -= nbytes
+      self.evictions += 1
+
+  def get(self, key: Hashable, default=None):
+    """ Return the cached value of `key`, or `default` """
+    with self._lock:
+      if key in self._protected:
+        self._protected.move_to_end(key)
+        self.hits += 1
+        return self._protected[key][0]
+      if key in self._probation:
+        entry = self._probation.pop(key)
+        self._probation_bytes -= entry[1]
+        self._protected[key] = entry
+        self._protected_bytes += entry[1]
+        self._evict()
+        self.hits += 1
+        return entry[0]
+      self.misses += 1
+      return default
+
+  def put(self, key: Hashable, value):
+    """ Cache a read-only copy of `value`, return the cached value """
+    value = _freeze(value)
+    nbytes = _nbytes(value)
+    with self._lock:
+      self._discard(key)
+      if nbytes <= self.max_bytes:
+        self._probation[key] = (value, nbytes)
+        self._probation_bytes += nbytes
+        self._evict()
+    return value
+
+  def get_or_load(self, key: Hashable, loader: Callable[[], object]):
+    """ Return the cached value of `key`, or cache the value returned by
+    `loader()`. The loader is called without holding the lock, so the
+    threads missing different keys read concurrently. """
+    value = self.get(key, _MISSING)
+    if value is not _MISSING:
+      return value
+    return self.put(key, loader())
+
+  def _discard(self, key):
+    if key in self._protected:
+      self._protected_bytes -= self._protected.pop(key)[1]
+    elif key in self._probation:
+      self._probation_bytes -= self._probation.pop(key)[1]
+
+  def invalidate(self, path: Optional[Text] = None):
+    """ Remove the cached rows of the file at `path` (e.g. after the file is
+    rewritten), or all the rows if `path` is `None` """
+    with self._lock:
+      if path is None:
+        self._probation.clear()
+        self._protected.clear()
+        self._probation_bytes = 0
+        self._protected_bytes = 0
+        return
+      for segment in (self._probation, self._protected):
+        for key in [
+            k for k in segment.keys() if isinstance(k, tuple) and k[0] == path
+        ]:
+          self._discard(key)
+
+  def clear(self):
+    self.invalidate(None)
+
+  def stats(self) -> dict:
+    """ Return the `hits`, `misses`, `evictions`, the number of `entries`,
+    the cached `bytes` (and of each segment) and the budget `max_bytes` """
+    with self._lock:
+      return dict(hits=self.hits,
+                  misses=self.misses,
+                  evictions=self.evictions,
+                  entries=len(self),
+                  bytes=self.nbytes,
+                  probation_bytes=self._probation_bytes,
+                  protected_bytes=self._protected_bytes,
+                  max_bytes=self.max_bytes)
+
+  def __repr__(self):
+    return '<RowCache entries:%d bytes:%d/%d>' % (len(self), self.nbytes,
+                                                  self.max_bytes)
@@ -0,0 +1,382 @@
+from __future__ import absolute_import, division, print_function
+
+import mmap
+import timeit
+from typing import Iterable, Optional, Union
+
+import numpy as np
+
+from bigarray.compressed_array import CompressedArray
+from bigarray.mmap_array import MmapArray
+from bigarray.pointer_array import PointerArray, _index_arrays
+from bigarray.ragged_array import RaggedMmapArray
+
+__all__ = [
+    'BlockShuffleSampler',
+    'BucketBatchSampler',
+]
+
+
+# ===========================================================================
+# Helper
+# ===========================================================================
+def _union_sizes(first, last, groups, n_groups):
+  """ Number of distinct integers covered by the intervals `[first, last]`
+  of each group """
+  sizes = np.zeros(n_groups, dtype='int64')
+  if first.shape[0] == 0:
+    return sizes
+  # shift each group so the intervals of different groups never overlap
+  shift = groups * (int(last.max()) + 2)
+  first, last = first + shift, last + shift
+  order = np.lexsort((first, groups))
+  first, last = first[order], last[order]
+  # the largest end of all previous intervals
+  prev_last = np.concatenate([[first[0] - 1], np.maximum.accumulate(last)[:-1]])
+  start = np.maximum(first, prev_last + 1)
+  np.add.at(sizes, groups[order], np.maximum(last - start + 1, 0))
+  return sizes
+
+
+# ===========================================================================
+# Sampler
+# ===========================================================================
+class BlockShuffleSampler(object):
+  """ Shuffled epoch orders that keep the page locality of the samples.
+
+  The samples are grouped into blocks of `block_pages` consecutive pages
+  (or chunks for `CompressedArray`), the order of the blocks is shuffled,
+  then the samples are shuffled within each window of `window` consecutive
+  blocks (in the shuffled order). A window of a single block gives the
+  best locality, a window covering all the blocks is a full random shuffle.
+
+  Parameters
+  ----------
+  array : {`MmapArray`, `PointerArray`, `CompressedArray`}
+    the samples are the rows of the array, or the keys of a `PointerArray`
+  block_pages : `int`
+    number of pages (or chunks) in each block
+  window : `int`
+    number of blocks that are shuffled together
+  seed : `int` (optional)
+    seed for the random generator
+  """
+
+  def __init__(self,
+               array: Union[MmapArray, PointerArray, CompressedArray],
+               block_pages: int = 16,
+               window: int = 4,
+               seed: Optional[int] = None):
+    super(BlockShuffleSampler, self).__init__()
+    if isinstance(array, PointerArray):
+      keys, starts, ends = _index_arrays(array.indices)
+      self._keys = keys
+    else:
+      starts = np.arange(array.shape[0], dtype='int64')
+      ends = starts + 1
+      self._keys = None
+    # ====== first and last unit (page or chunk) of each sample ====== #
+    if isinstance(array, CompressedArray):
+      first = starts // array.chunk_rows
+      last = np.maximum(ends - 1, starts) // array.chunk_rows
+    else:
+      row_size = array.dtype.itemsize * \
+        int(np.prod(array.shape[1:], dtype='int64'))
+      offset = int(array.offset)
+      first = (offset + starts * row_size) // mmap.PAGESIZE
+      last = (offset + np.maximum(ends * row_size - 1, starts * row_size)) \
+        // mmap.PAGESIZE
+    self._first = np.asarray(first, dtype='int64')
+    self._last = np.asarray(last, dtype='int64')
+    self._blocks = self._first // max(1, int(block_pages))
+    self._block_pages = max(1, int(block_pages))
+    self._window = max(1, int(window))
+    self._rng = np.random.RandomState(seed)
+
+  def __len__(self):
+    return self._first.shape[0]
+
+  @property
+  def n_blocks(self):
+    return len(np.unique(self._blocks))
+
+  def _windows(self, rng):
+    """ Return the window of each sample, and the order of the blocks """
+    blocks, block_ids = np.unique(self._blocks, return_inverse=True)
+    rank = np.empty(blocks.shape[0], dtype='int64')
+    rank[rng.permutation(blocks.shape[0])] = np.arange(blocks.shape[0])
+    return rank[block_ids] // self._window
+
+  def epoch(self) -> np.ndarray:
+    """ Return the order of the samples for a new epoch, the row indices
+    for an array, or the keys for `PointerArray` """
+    windows = self._windows(self._rng)
+    order = np.lexsort((self._rng.rand(windows.shape[0]), windows))
+    if self._keys is not None:
+      return np.char.decode(self._keys[order], 'utf-8')
+    return order
+
+  def __iter__(self):
+    for i in self.epoch().tolist():
+      yield i
+
+  def expected_pages(self, cache_pages: Optional[int] = None) -> dict:
+    """ Estimate the number of pages (or chunks) touched per epoch.
+
+    Parameters
+    ----------
+    cache_pages : `int` (optional)
+      number of pages that could be kept in the page cache, if given,
+      also estimate the number of page loads per epoch assuming the cache
+      is evicted uniformly at random
+
+    Return
+    ------
+    a dictionary:
+      'pages' - distinct pages touched by an epoch
+      'window_pages' - average distinct pages in a window
+      'page_loads' - expected page loads of this sampler (if `cache_pages`)
+      'random_page_loads' - expected page loads of a full random shuffle
+        (if `cache_pages`)
+    """
+    windows = self._windows(np.random.RandomState(0))
+    n_windows = int(windows.max()) + 1 if windows.shape[0] > 0 else 0
+    # distinct pages and page accesses of each window
+    window_access = np.zeros(n_windows, dtype='int64')
+    np.add.at(window_access, windows, self._last - self._first + 1)
+    window_pages = _union_sizes(self._first, self._last, windows, n_windows)
+    pages = int(
+        _union_sizes(self._first, self._last, np.zeros_like(windows), 1)[0])
+    report = {
+        'pages': pages,
+        'window_pages': float(np.mean(window_pages)) if n_windows > 0 else 0.,
+    }
+    if cache_pages is not None:
+
+      def loads(n_pages, n_access):
+        hit = np.minimum(1., cache_pages / np.maximum(n_pages, 1))
+        return n_pages + np.maximum(n_access - n_pages, 0) * (1. - hit)
+
+      report['page_loads'] = float(np.sum(loads(window_pages, window_access)))
+      report['random_page_loads'] = float(
+          loads(pages, int(np.sum(window_access))))
+    return report
+
+
+class BucketBatchSampler(object):
+  """ Batches of entries with similar lengths, to reduce the padding of
+  variable-length sequences.
+
+  The entries are binned into length buckets, within each bucket the
+  entries are sorted by length (ties are shuffled) and split into batches
+  whose padded size `batch_size * max_length` is at most `max_rows`
+  (a single entry longer than `max_rows` is its own batch). The order of
+  the batches is shuffled for every epoch.
+
+  Parameters
+  ----------
+  array : {`PointerArray`, `RaggedMmapArray`}
+    the entries are the keys of a `PointerArray`, or the rows of a
+    `RaggedMmapArray`
+  max_rows : `int`
+    the budget of padded rows (e.g. tokens or frames) of each batch
+  bucket_width : `int`
+    the width of the length buckets, ignored if `boundaries` is given
+  boundaries : list of `int` (optional)
+    the upper (exclusive) length of each bucket, the entries not shorter
+    than the last boundary are put in an extra bucket
+  max_batch_size : `int` (optional)
+    maximum number of entries in a batch
+  shuffle : `bool`
+    shuffle the batches (and the entries with the same length)
+  drop_last : `bool`
+    drop the last incomplete batch of each bucket, i.e. the batch with
+    fewer entries than its budget allows
+  seed : `int` (optional)
+    seed for the random generator
+  """
+
+  def __init__(self,
+               array: Union[PointerArray, RaggedMmapArray],
+               max_rows: int = 4096,
+               bucket_width: int = 8,
+               boundaries: Optional[Iterable[int]] = None,
+               max_batch_size: Optional[int] = None,
+               shuffle: bool = True,
+               drop_last: bool = False,
+               seed: Optional[int] = None):
+    super(BucketBatchSampler, self).__init__()
+    if isinstance(array, PointerArray):
+      keys, starts, ends = _index_arrays(array.indices)
+      self._keys = keys
+    elif isinstance(array, RaggedMmapArray):
+      starts, ends = array.starts, array.ends
+      self._keys = None
+    else:
+      raise ValueError("Only support PointerArray or RaggedMmapArray, "
+                       "given: %s" % str(type(array)))
+    self._array = array
+    self._starts = np.asarray(starts, dtype='int64')
+    self._lengths = np.asarray(ends, dtype='int64') - self._starts
+    # ====== buckets ====== #
+    if boundaries is not None:
+      boundaries = np.sort(np.asarray(boundaries, dtype='int64'))
+      self._buckets = np.searchsorted(boundaries, self._lengths, side='right')
+    else:
+      self._buckets = self._lengths // max(1, int(bucket_width))
+    self._max_rows = max(1, int(max_rows))
+    self._max_batch_size = None if max_batch_size is None else \
+      max(1, int(max_batch_size))
+    self._shuffle = bool(shuffle)
+    self._drop_last = bool(drop_last)
+    self._rng = np.random.RandomState(seed)
+    self._buffer = None
+    self._reset_statistics()
+
+  def __len__(self):
+    return self._lengths.shape[0]
+
+  def _reset_statistics(self):
+    self._statistics = dict(batches=0,
+                            entries=0,
+                            rows=0,
+                            padded_rows=0,
+                            timed_batches=0,
+                            batch_time=0.,
+                            batch_time_max=0.)
+
+  def _record(self, lengths, batch_time=None):
+    stats = self._statistics
+    stats['batches'] += 1
+    stats['entries'] += lengths.shape[0]
+    stats['rows'] += int(np.sum(lengths))
+    stats['padded_rows'] += lengths.shape[0] * int(np.max(lengths))
+    # running aggregates, the memory is constant for any number of batches
+    if batch_time is not None:
+      stats['timed_batches'] += 1
+      stats['batch_time'] += batch_time
+      stats['batch_time_max'] = max(stats['batch_time_max'], batch_time)
+
+  @property
+  def lengths(self) -> np.ndarray:
+    return self._lengths
+
+  @property
+  def n_buckets(self):
+    return len(np.unique(self._buckets))
+
+  def _batches(self, rng):
+    """ Return a list of arrays, the positions of the entries in each
+    batch """
+    n = self._lengths.shape[0]
+    ties = rng.rand(n) if self._shuffle else np.arange(n)
+    # bucket, then decreasing length, so the first entry of each batch is
+    # the longest one
+    order = np.lexsort((ties, -self._lengths, self._buckets))
+    lengths = self._lengths[order]
+    buckets = self._buckets[order]
+    bucket_ends = np.append(np.nonzero(np.diff(buckets))[0] + 1, n).tolist()
+    budget = np.maximum(self._max_rows // np.maximum(lengths, 1), 1)
+    if self._max_batch_size is not None:
+      budget = np.minimum(budget, self._max_batch_size)
+    budget = budget.tolist()
+    batches = []
+    start = 0
+    for end in bucket_ends:
+      i = start
+      while i < end:
+        j = min(i + budget[i], end)
+        if not (self._drop_last and j - i < budget[i]):
+          batches.append(order[i:j])
+        i = j
+      start = end
+    if self._shuffle:
+      batches = [batches[i] for i in rng.permutation(len(batches))]
+    return batches
+
+  def epoch(self) -> list:
+    """ Return the batches for a new epoch, each batch is an array of row
+    indices for `RaggedMmapArray`, or the keys for `PointerArray` """
+    batches = self._batches(self._rng)
+    for batch in batches:
+      self._record(self._lengths[batch])
+    if self._keys is not None:
+      return [np.char.decode(self._keys[b], 'utf-8') for b in batches]
+    return batches
+
+  def __iter__(self):
+    for batch in self.epoch():
+      yield batch
+
+  def _pad(self, batch, pad_value):
+    """ Copy the entries of `batch` (positions) into the reused buffer """
+    data = self._array.data if self._keys is None else self._array
+    lengths = self._lengths[batch]
+    n, max_length = len(batch), int(np.max(lengths))
+    size = n * max_length
+    if self._buffer is None or self._buffer.shape[0] < size:
+      self._buffer = np.empty((max(size, self._max_rows),) + data.shape[1:],
+                              dtype=data.dtype)
+    out = self._buffer[:size].reshape((n, max_length) + data.shape[1:])
+    positions = np.arange(max_length, dtype='int64')
+    mask = positions[None, :] < lengths[:, None]
+    # the padded positions read the first row (always valid, unlike the start
+    # of a zero-length entry at the end of the data), then are overwritten
+    if size > 0 and data.shape[0] > 0:
+      rows = np.where(mask, self._starts[batch][:, None] + positions[None, :],
+                      0)
+      np.take(data.view(np.ndarray), rows, axis=0, out=out)
+    out[~mask] = pad_value
+    return out, lengths
+
+  def iter_padded(self, pad_value=0):
+    """ Iterate the padded batches of a new epoch, the batches are copied
+    into a preallocated buffer which is reused, i.e. each batch is only
+    valid until the next one is generated (copy it to keep it).
+
+    Return
+    ------
+    iterator of `(batch, padded_data, lengths)`, `padded_data` has shape
+      `[batch_size, max_length, ...]`
+    """
+    keys = self._keys
+    for batch in self._batches(self._rng):
+      start = timeit.default_timer()
+      data, lengths = self._pad(batch, pad_value)
+      self._record(lengths, timeit.default_timer() - start)
+      yield (batch if keys is None else np.char.decode(keys[batch], 'utf-8'),
+             data, lengths)
+
+  def statistics(self, reset: bool = False) -> dict:
+    """ Return the statistics of the generated batches
+
+    Parameters
+    ----------
+    reset : `bool`
+      reset the statistics after returning them
+
+    Return
+    ------
+    a dictionary:
+      'batches' - number of batches
+      'rows' - number of rows of all entries
+      'padded_rows' - number of rows after padding
+      'padding_ratio' - fraction of the padded rows that are padding
+      'mean_batch_size' - average number of entries per batch
+      'batch_time_mean', 'batch_time_max' - time (in second) for copying
+        and padding a batch (`iter_padded`)
+    """
+    stats = self._statistics
+    padded = max(stats['padded_rows'], 1)
+    report = dict(
+        batches=stats['batches'],
+        rows=stats['rows'],
+        padded_rows=stats['padded_rows'],
+        padding_ratio=1. - stats['rows'] / padded,
+        mean_batch_size=stats['entries'] / max(stats['batches'], 1),
+        batch_time_mean=stats['batch_time'] / max(stats['timed_batches'], 1),
+        batch_time_max=stats['batch_time_max'],
+    )
+    if reset:
+      self._reset_statistics()
+    return report
@@ -0,0 +1,311 @@
+from __future__ import absolute_import, division, print_function
+
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Iterable, List, Optional, Text, Union
+
+import numpy as np
+from six import string_types
+
+from bigarray.mmap_array import (_POOL, MmapArray, MmapArrayWriter,
+                                 _gather_ranges, _read_header)
+from bigarray.pointer_array import (PointerArrayWriter, _concat_indices,
+                                    _has_indices, _index_arrays,
+                                    _lookup_indices, _PointerIndex,
+                                    _read_indices)
+
+__all__ = [
+    'ShardedMmapArray',
+]
+
+_SHARD_NAME = 'shard_%05d'
+_SHARD_PATTERN = re.compile(r'^shard_(\d+)$')
+
+
+# ===========================================================================
+# Helper
+# ===========================================================================
+def _list_shards(path):
+  """ Return the paths of all shards in the folder, sorted by shard id """
+  shards = []
+  for name in os.listdir(path):
+    match = _SHARD_PATTERN.match(name)
+    if match is not None:
+      shards.append((int(match.group(1)), os.path.join(path, name)))
+  return [p for _, p in sorted(shards)]
+
+
+# ===========================================================================
+# Sharded array
+# ===========================================================================
+class ShardedMmapArray(object):
+  """ A read-only view of a folder of `MmapArray` (or `PointerArray`) shards
+  as a single array, the rows of all shards are concatenated in the order
+  of the shard ids.
+
+  Only the headers are read when creating the array, the shards are
+  memory-mapped on the first access and at most `max_open` shards are kept
+  opened (least recently used are closed first). The mapping of a closed
+  shard is evicted from the pool of mapped files, and unmapped when the
+  arrays read from it are released.
+
+  Each shard is written by its own `MmapArrayWriter` (see
+  `ShardedMmapArray.writer`), so many processes could write to different
+  shards without any synchronization.
+
+  Parameters
+  ----------
+  path : str
+    path to the folder of shards
+  max_open : `int` (default=16)
+    maximum number of memory-mapped shards kept opened
+  mode : {'r', 'r+', 'c'}
+    mode for opening the shards, see `MmapArray`
+  """
+
+  def __init__(self, path: Text, max_open: int = 16, mode: Text = 'r'):
+    if not isinstance(path, string_types):
+      raise ValueError("Only support file path, and not file descriptor ID")
+    path = os.path.abspath(path)
+    if not os.path.isdir(path):
+      raise ValueError("path must be an existed folder of shards, given: %s" %
+                       path)
+    shards = _list_shards(path)
+    if len(shards) == 0:
+      raise ValueError("No shard found at path: %s" % path)
+    dtype = None
+    lengths = []
+    is_pointer = []
+    for shard in shards:
+      with open(shard, 'rb') as f:
+        header = _read_header(f.fileno())
+      shard_dtype, shape = header.dtype, header.shape
+      shard_dtype = np.dtype(shard_dtype)
+      if dtype is None:
+        dtype, row_shape = shard_dtype, tuple(shape[1:])
+      elif shard_dtype != dtype or tuple(shape[1:]) != row_shape:
+        raise RuntimeError(
+            "Shard at path '%s' has dtype=%s shape=%s, mismatch "
+            "dtype=%s shape=%s of the other shards" %
+            (shard, str(shard_dtype), str(shape), str(dtype), str(row_shape)))
+      lengths.append(shape[0])
+      # the reserved capacity of a plain shard is also stored after the
+      # data, the indices are identified by their magic
+      is_pointer.append(_has_indices(shard))
+    self._path = path
+    self._mode = mode
+    self._shards = shards
+    self._is_pointer = is_pointer
+    self._dtype = dtype
+    self._row_shape = row_shape
+    self._offsets = np.zeros((len(shards) + 1,), dtype='int64')
+    np.cumsum(lengths, out=self._offsets[1:])
+    self._indices = None
+    self._opened = OrderedDict()
+    self._max_open = max(1, int(max_open))
+    self._lock = threading.Lock()
+
+  def __getstate__(self):
+    return self.path, self._max_open, self._mode
+
+  def __setstate__(self, states):
+    self.__init__(*states)
+
+  @staticmethod
+  def writer(path: Text,
+             shard: int,
+             shape: Optional[List[int]] = None,
+             dtype: Optional[Union[Text, np.dtype]] = None,
+             pointer: bool = False,
+             **kwargs) -> MmapArrayWriter:
+    """ Create the writer for a shard of the folder at `path`.
+
+    Parameters
+    ----------
+    path : str
+      path to the folder of shards, created if not existed
+    shard : `int`
+      the shard id, the rows of the shards are ordered by the ids
+    shape, dtype : the shape and dtype of the shard
+    pointer : `bool`
+      if `True`, return a `PointerArrayWriter` instead of `MmapArrayWriter`
+    **kwargs : other arguments for the writer
+
+    Return
+    ------
+    `MmapArrayWriter` or `PointerArrayWriter`
+    """
+    if not os.path.exists(path):
+      os.makedirs(path, exist_ok=True)
+    shard_path = os.path.join(path, _SHARD_NAME % int(shard))
+    writer_cls = PointerArrayWriter if pointer else MmapArrayWriter
+    return writer_cls(shard_path, shape=shape, dtype=dtype, **kwargs)
+
+  @property
+  def path(self):
+    return self._path
+
+  @property
+  def shape(self):
+    return (int(self._offsets[-1]),) + self._row_shape
+
+  @property
+  def dtype(self):
+    return self._dtype
+
+  @property
+  def ndim(self):
+    return len(self._row_shape) + 1
+
+  @property
+  def n_shards(self):
+    return len(self._shards)
+
+  @property
+  def shard_offsets(self) -> np.ndarray:
+    """ The first row of each shard, and the total number of rows """
+    return self._offsets
+
+  @property
+  def n_opened(self):
+    return len(self._opened)
+
+  @property
+  def indices(self) -> _PointerIndex:
+    """ The merged indices of all `PointerArray` shards, the positions are
+    global rows, a key in later shard overrides the earlier ones """
+    if self._indices is None:
+      arrays = [(np.empty((0,), dtype='S1'), np.empty(
+          (0,), dtype='int64'), np.empty((0,), dtype='int64'))]
+      for i, shard in enumerate(self._shards):
+        if not self._is_pointer[i]:
+          continue
+        keys, starts, ends = _index_arrays(_read_indices(shard))
+        arrays.append(
+            (keys, starts + self._offsets[i], ends + self._offsets[i]))
+      self._indices = _PointerIndex(
+          np.frombuffer(_PointerIndex.dumps(*_concat_indices(arrays)),
+                        dtype=np.uint8))
+    return self._indices
+
+  def __len__(self):
+    return self.shape[0]
+
+  def __array__(self, dtype=None, copy=None):
+    array = self[:]
+    return array if dtype is None else array.astype(dtype)
+
+  def shard(self, idx: int) -> MmapArray:
+    """ Return the memory-mapped data of shard `idx` """
+    with self._lock:
+      if idx in self._opened:
+        self._opened.move_to_end(idx)
+        return self._opened[idx]
+    array = MmapArray(self._shards[idx], mode=self._mode)
+    with self._lock:
+      self._opened[idx] = array
+      # the mmap is closed when all the views of the shard are released
+      while len(self._opened) > self._max_open:
+        closed, _ = self._opened.popitem(last=False)
+        _POOL.discard(self._shards[closed], self._mode)
+    return array
+
+  def _read_range(self, start, stop):
+    """ Read contiguous rows `[start, stop)` """
+    if stop <= start:
+      return np.empty((0,) + self._row_shape, dtype=self._dtype)
+    offsets = self._offsets
+    first = int(np.searchsorted(offsets, start, side='right')) - 1
+    last = int(np.searchsorted(offsets, stop - 1, side='right')) - 1
+    parts = []
+    for idx in range(first, last + 1):
+      offset = int(offsets[idx])
+      parts.append(
+          self.shard(idx)[max(start - offset, 0):stop - offset].view(
+              np.ndarray))
+    if len(parts) == 1:
+      return parts[0]
+    return np.concatenate(parts, axis=0)
+
+  def _read_rows(self, indices):
+    """ Read the rows given by an integer array """
+    n = self.shape[0]
+    indices = np.asarray(indices, dtype='int64')
+    indices = np.where(indices < 0, indices + n, indices)
+    if np.any((indices < 0) | (indices >= n)):
+      raise IndexError("index out of bounds for axis 0 with size %d" % n)
+    out = np.empty(indices.shape + self._row_shape, dtype=self._dtype)
+    shard_ids = np.searchsorted(self._offsets, indices, side='right') - 1
+    for idx in np.unique(shard_ids).tolist():
+      mask = shard_ids == idx
+      out[mask] = self.shard(idx)[indices[mask] - self._offsets[idx]]
+    return out
+
+  def __getitem__(self, key):
+    if isinstance(key, string_types):
+      start, end = self.indices[key]
+      return self._read_range(start, end)
+    if isinstance(key, tuple):
+      if len(key) == 0:
+        key, rest = slice(None), ()
+      else:
+        key, rest = key[0], key[1:]
+    else:
+      rest = ()
+    if key is Ellipsis:
+      key, rest = slice(None), (Ellipsis,) + rest
+    # ====== select the rows ====== #
+    if isinstance(key, slice):
+      start, stop, step = key.indices(self.shape[0])
+      if step == 1:
+        array = self._read_range(start, stop)
+      else:
+        array = self._read_rows(np.arange(start, stop, step))
+      n_dims = 1
+    elif isinstance(key, (int, np.integer)):
+      idx = int(key)
+      if idx < 0:
+        idx += self.shape[0]
+      if not 0 <= idx < self.shape[0]:
+        raise IndexError("index %d is out of bounds for axis 0 with size %d" %
+                         (int(key), self.shape[0]))
+      shard_id = int(np.searchsorted(self._offsets, idx, side='right')) - 1
+      array = self.shard(shard_id)[idx - self._offsets[shard_id]]
+      array = array.view(np.ndarray)
+      n_dims = 0
+    else:
+      key = np.asarray(key)
+      if key.dtype == np.bool_:
+        key = np.nonzero(key)[0]
+      array = self._read_rows(key)
+      n_dims = key.ndim
+    # ====== the other dimensions ====== #
+    if len(rest) > 0:
+      array = array[(slice(None),) * n_dims + rest]
+    return array
+
+  def gather(self, keys: Iterable[Text], padding: bool = False, pad_value=0):
+    """ Read the data of many keys at once, see `PointerArray.gather` """
+    starts, ends = _lookup_indices(self.indices, keys)
+    return _gather_ranges(self,
+                          starts,
+                          ends,
+                          padding=padding,
+                          pad_value=pad_value)
+
+  def __iter__(self):
+    for idx in range(self.n_shards):
+      for row in self.shard(idx):
+        yield row
+
+  def close(self):
+    with self._lock:
+      for idx in self._opened.keys():
+        _POOL.discard(self._shards[idx], self._mode)
+      self._opened.clear()
+
+  def __repr__(self):
+    return '<ShardedMmapArray shape:%s dtype:%s shards:%d path:%s>' % (str(
+        self.shape), str(self.dtype), self.n_shards, self.path)
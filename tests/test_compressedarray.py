@@ -0,0 +1,85 @@
+from __future__ import absolute_import, division, print_function
+
+import os
+import pickle
+import unittest
+from tempfile import mkstemp
+
+import numpy as np
+
+from bigarray import CompressedArray, CompressedArrayWriter
+
+np.random.seed(8)
+
+
+# ===========================================================================
+# Helper function
+# ===========================================================================
+def _get_tempfile():
+  fid, fpath = mkstemp()
+  os.close(fid)
+  return fpath
+
+
+# ===========================================================================
+# Test cases
+# ===========================================================================
+class CompressedArrayTest(unittest.TestCase):
+
+  def test_write_read(self):
+    fpath = _get_tempfile()
+    array = np.random.randint(0, 16, size=(1000, 4, 5)).astype('int16')
+    for codec in ('zlib', 'lzma', 'bz2'):
+      with CompressedArrayWriter(fpath,
+                                 shape=(0, 4, 5),
+                                 dtype=array.dtype,
+                                 chunk_rows=64,
+                                 codec=codec,
+                                 remove_exist=True) as f:
+        for i in range(0, array.shape[0], 30):
+          f.write(array[i:i + 30])
+      x = CompressedArray(fpath, cache_size=2)
+      self.assertEqual(x.shape, array.shape)
+      self.assertEqual(x.n_chunks, 16)
+      self.assertTrue(x.filesize < array.nbytes)
+      self.assertTrue(np.all(np.asarray(x) == array))
+    # slicing
+    self.assertTrue(np.all(x[10:300] == array[10:300]))
+    self.assertTrue(np.all(x[-100:] == array[-100:]))
+    self.assertTrue(np.all(x[5:900:7] == array[5:900:7]))
+    self.assertTrue(np.all(x[63] == array[63]))
+    self.assertTrue(np.all(x[-1, 2] == array[-1, 2]))
+    self.assertTrue(np.all(x[100:200, :, 1:3] == array[100:200, :, 1:3]))
+    self.assertTrue(np.all(x[..., 0] == array[..., 0]))
+    indices = np.random.randint(0, 1000, size=(50,))
+    self.assertTrue(np.all(x[indices] == array[indices]))
+    self.assertTrue(np.all(x[indices, 1] == array[indices, 1]))
+    self.assertTrue(np.all(x[array[:, 0, 0] > 8] == array[array[:, 0, 0] > 8]))
+    # pickling
+    y = pickle.loads(pickle.dumps(x))
+    self.assertTrue(np.all(y[:] == array))
+    os.remove(fpath)
+
+  def test_append(self):
+    fpath = _get_tempfile()
+    array = np.random.rand(500, 3).astype('float32')
+    with CompressedArrayWriter(fpath,
+                               shape=(0, 3),
+                               dtype='float32',
+                               chunk_rows=128,
+                               remove_exist=True) as f:
+      f.write(array[:200])
+    # the incomplete chunk is rewritten when appending
+    with CompressedArrayWriter(fpath) as f:
+      f.write([array[200:300], array[300:]])
+    x = CompressedArray(fpath)
+    self.assertEqual(x.n_chunks, 4)
+    self.assertTrue(np.all(x[:] == array))
+    os.remove(fpath)
+
+
+# ===========================================================================
+# Main
+# ===========================================================================
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,108 @@
+from __future__ import absolute_import, division, print_function
+
+import logging
+import os
+import unittest
+from tempfile import mkstemp
+
+import numpy as np
+
+from bigarray import (MmapArray, MmapArrayWriter, PointerArray,
+                      PointerArrayWriter, enable_metrics, format_metrics,
+                      get_metrics, log_metrics, reset_metrics)
+
+
+# ===========================================================================
+# Helper function
+# ===========================================================================
+def _get_tempfile():
+  fid, fpath = mkstemp()
+  os.close(fid)
+  return fpath
+
+
+# ===========================================================================
+# Test cases
+# ===========================================================================
+class MetricsTest(unittest.TestCase):
+
+  def setUp(self):
+    enable_metrics(True)
+    reset_metrics()
+
+  def tearDown(self):
+    enable_metrics(False)
+    reset_metrics()
+
+  def test_operations(self):
+    array = np.arange(300, dtype='float32').reshape(100, 3)
+    fpath = _get_tempfile()
+    with MmapArrayWriter(fpath, (0, 3),
+                         'float32',
+                         remove_exist=True,
+                         growth_factor=1.0) as f:
+      for i in range(0, 100, 10):
+        f.write(array[i:i + 10])
+    x = MmapArray(fpath, mode='r')
+    self.assertTrue(np.all(x == array))
+    ops = get_metrics()['operations']
+    self.assertEqual(ops['write']['count'], 10)
+    self.assertEqual(ops['write']['rows'], 100)
+    self.assertEqual(ops['write']['bytes'], array.nbytes)
+    self.assertEqual(ops['resize']['count'], 10)
+    self.assertEqual(ops['resize']['rows'], 100)
+    # only flushed by closing when exiting the context
+    self.assertEqual(ops['flush']['count'], 1)
+    self.assertEqual(ops['open']['count'], 1)
+    self.assertGreaterEqual(ops['header_read']['count'], 1)
+    for op in ops.values():
+      self.assertEqual(sum(op['histogram']), op['count'])
+      self.assertLessEqual(op['p50_us'], op['p99_us'])
+      self.assertLessEqual(op['p99_us'], op['max_us'])
+    # the metrics are reset
+    metrics = get_metrics(reset=True)
+    self.assertTrue(metrics['enabled'])
+    self.assertGreaterEqual(metrics['minor_faults'], 0)
+    self.assertEqual(len(get_metrics()['operations']), 0)
+    # nothing is recorded when disabled
+    enable_metrics(False)
+    MmapArray(fpath, mode='r')
+    self.assertEqual(len(get_metrics()['operations']), 0)
+    os.remove(fpath)
+
+  def test_pointerarray(self):
+    data = {
+        'name%d' % i: np.full((i + 1, 2), i, dtype='float64') for i in range(10)
+    }
+    fpath = _get_tempfile()
+    with PointerArrayWriter(fpath, (0, 2), 'float64', remove_exist=True) as f:
+      f.write(data)
+    x = PointerArray(fpath, mode='r')
+    self.assertTrue(np.all(x['name3'] == data['name3']))
+    x.gather(['name1', 'name2', 'name5'])
+    ops = get_metrics()['operations']
+    self.assertEqual(ops['index_load']['count'], 1)
+    self.assertEqual(ops['index_load']['rows'], 10)
+    self.assertEqual(ops['key_lookup']['count'], 2)
+    self.assertEqual(ops['key_lookup']['rows'], 4)
+    # only flushed by closing when exiting the context
+    self.assertEqual(ops['flush']['count'], 1)
+    line = format_metrics()
+    self.assertNotIn('\n', line)
+    self.assertIn('key_lookup n:2', line)
+    # periodic log line
+    with self.assertLogs('bigarray', level=logging.INFO) as logs:
+      thread = log_metrics(interval=0.01)
+      while len(logs.output) == 0:
+        thread.join(0.01)
+      thread.stop()
+    self.assertIn('index_load', logs.output[0])
+    self.assertFalse(thread.is_alive())
+    os.remove(fpath)
+
+
+# ===========================================================================
+# Main
+# ===========================================================================
+if __name__ == '__main__':
+  unittest.main()
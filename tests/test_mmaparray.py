@@ -1,6 +1,9 @@
 from __future__ import absolute_import, division, print_function
 
+import asyncio
+import mmap
 import os
+import pickle
 import unittest
 import zlib
 from io import BytesIO
@@ -9,7 +12,10 @@ from tempfile import mkstemp
 
 import numpy as np
 
-from bigarray import MmapArray, MmapArrayWriter
+from bigarray import (MmapArray, MmapArrayWriter, get_aio_stats,
+                      get_mmap_pool_stats, set_aio_limits, mmap_array,
+                      read_mmaparray_header, read_mmaparray_metadata,
+                      set_mmap_pool_limits, write_mmaparray_metadata)
 
 np.random.seed(8)
 
@@ -29,6 +35,15 @@ def _fn_write(job):
     f.write(array, start_position=idx * array.shape[0])
 
 
+def _fn_view(job):
+  marray, start = job
+  return start, marray[start:start + 500]
+
+
+def _fn_block(x):
+  return np.concatenate([x.sum(axis=1), x.max(axis=1)], axis=1)
+
+
 def _fn_read(job):
   marray, (start, end) = job
   data = marray[start:end].tobytes()
@@ -77,6 +92,412 @@ class MmapArrayTest(unittest.TestCase):
     x = MmapArray(fpath)
     self.assertTrue(np.all(array == x))
 
+  def test_write_growth(self):
+    fpath = _get_tempfile()
+    array = np.arange(0, 3000, dtype='float32').reshape(-1, 2, 5)
+
+    f = MmapArrayWriter(path=fpath,
+                        shape=(0, 2, 5),
+                        dtype=array.dtype,
+                        remove_exist=True,
+                        growth_factor=2.0,
+                        growth_chunk=16)
+    for i in range(0, array.shape[0], 7):
+      f.write(array[i:i + 7])
+    self.assertEqual(f.shape, array.shape)
+    self.assertTrue(f.capacity >= array.shape[0])
+    self.assertEqual(f.capacity % 16, 0)
+    # the header is updated on flush, reserved rows are not visible
+    f.flush()
+    x = MmapArray(fpath)
+    self.assertTrue(np.all(array == x))
+    f.close()
+    # the reserved capacity is truncated
+    x = MmapArray(fpath)
+    self.assertTrue(np.all(array == x))
+    self.assertEqual(os.stat(fpath).st_size, x.offset + array.nbytes)
+
+  def test_reopen_writer(self):
+    fpath = _get_tempfile()
+    array = np.arange(0, 34, dtype='float32').reshape(-1, 2)
+    f = MmapArrayWriter(path=fpath,
+                        shape=(0, 2),
+                        dtype=array.dtype,
+                        remove_exist=True,
+                        growth_factor=2.0)
+    for i in range(16):
+      f.write(array[i:i + 1])
+    # the opened writer is returned, its dirty header is not read again
+    g = MmapArrayWriter(path=fpath, shape=(0, 2), dtype=array.dtype)
+    self.assertIs(g, f)
+    self.assertEqual(g.shape, (16, 2))
+    self.assertIs(MmapArrayWriter(fpath, growth_factor=2.0), f)
+    # the arguments conflict with the opened writer
+    for kwargs in (dict(remove_exist=True), dict(dtype='float64'),
+                   dict(shape=(0, 3)), dict(growth_factor=4.0),
+                   dict(write_mode='pwrite')):
+      self.assertRaises(ValueError, lambda: MmapArrayWriter(fpath, **kwargs))
+    self.assertEqual(f.shape, (16, 2))
+    g.write(array[16:])
+    self.assertEqual(g.shape, array.shape)
+    g.close()
+    self.assertTrue(np.all(MmapArray(fpath) == array))
+    os.remove(fpath)
+
+  def test_parallel_write(self):
+    fpath = _get_tempfile()
+    # bigger than the threshold for splitting the copy
+    array = np.random.rand(2200, 1000)
+    for write_mode in ('mmap', 'pwrite'):
+      with MmapArrayWriter(fpath, (None, 1000),
+                           'float64',
+                           remove_exist=True,
+                           write_workers=4,
+                           write_mode=write_mode) as f:
+        f.write(array)
+        f.write(array[:10].astype('float32'))
+        f.write(array[10:20], start_position=5)
+      x = MmapArray(fpath)
+      y = np.concatenate([array, array[:10].astype('float32')], axis=0)
+      y[5:15] = array[10:20]
+      self.assertTrue(np.all(x == y))
+    os.remove(fpath)
+
+  def test_iter_batches(self):
+    fpath = _get_tempfile()
+    array = np.arange(0, 1000, dtype='float32').reshape(-1, 4)
+    with MmapArrayWriter(fpath, (None, 4), array.dtype) as f:
+      f.write(array)
+    x = MmapArray(fpath)
+
+    batches = list(x.iter_batches(batch_size=32, prefetch=3, workers=2))
+    self.assertEqual(len(batches), 8)
+    self.assertTrue(np.all(np.concatenate(batches, axis=0) == array))
+
+    batches = list(
+        x.iter_batches(batch_size=32, shuffle=True, seed=1, drop_last=True))
+    self.assertEqual(len(batches), 7)
+    rows = np.concatenate(batches, axis=0)
+    self.assertEqual(len(np.unique(rows[:, 0])), 7 * 32)
+    self.assertFalse(np.all(rows == array[:7 * 32]))
+    self.assertTrue(np.all(rows == array[rows[:, 0].astype('int64') // 4]))
+    os.remove(fpath)
+
+  def test_access_pattern(self):
+    fpath = _get_tempfile()
+    array = np.random.rand(5000, 10)
+    with MmapArrayWriter(fpath, (None, 10), array.dtype) as f:
+      f.write(array)
+    x = MmapArray(fpath, access_pattern='random')
+    self.assertTrue(np.all(array == x))
+    if hasattr(mmap.mmap, 'madvise'):
+      self.assertTrue(x.advise('sequential'))
+      self.assertTrue(x.advise('willneed', 100, 2000))
+      self.assertTrue(x[1000:].advise('dontneed', 5, 10))
+      self.assertFalse(x.advise('normal', 10, 10))
+    self.assertRaises(ValueError, lambda: x.advise('unknown'))
+    self.assertTrue(np.all(array == x))
+    os.remove(fpath)
+
+  def test_mmap_pool(self):
+    paths = [_get_tempfile() for _ in range(6)]
+    arrays = [np.random.rand(100 + i, 4) for i in range(len(paths))]
+    # more writers than the limit, the least recently used are unmapped
+    max_open = mmap_array.MAX_OPEN_MMAP
+    mmap_array.MAX_OPEN_MMAP = 2
+    try:
+      writers = [
+          MmapArrayWriter(p, (None, 4), 'float64', remove_exist=True)
+          for p in paths
+      ]
+      self.assertEqual(sum(w.is_mapped for w in writers), 2)
+      for w, a in zip(writers, arrays):
+        w.write(a[:50])
+      for w, a in zip(writers, arrays):
+        w.write(a[50:])
+        self.assertTrue(sum(w.is_mapped for w in writers) <= 2)
+      # the metadata of an unmapped writer
+      self.assertFalse(writers[0].is_mapped)
+      self.assertEqual(writers[0].metadata, {})
+      self.assertFalse(writers[1].is_mapped)
+      writers[1].update_metadata(name='array1')
+      self.assertEqual(writers[1].metadata, {'name': 'array1'})
+      for w in writers:
+        w.close()
+      # the closed writers are never mapped again
+      for w, a in zip(writers, arrays):
+        self.assertEqual(w.shape, a.shape)
+        self.assertEqual(w.dtype, np.float64)
+        self.assertFalse(w.is_mapped)
+        self.assertRaises(RuntimeError, lambda: w.write(a))
+        self.assertRaises(RuntimeError, lambda: w.flush())
+        self.assertFalse(w.is_mapped)
+    finally:
+      mmap_array.MAX_OPEN_MMAP = max_open
+    # readers reuse the mapped files
+    set_mmap_pool_limits(max_handles=3)
+    try:
+      stats = get_mmap_pool_stats()
+      x = MmapArray(paths[0], mode='r')
+      y = MmapArray(paths[0], mode='r')
+      new_stats = get_mmap_pool_stats()
+      self.assertEqual(new_stats['misses'] - stats['misses'], 1)
+      self.assertEqual(new_stats['hits'] - stats['hits'], 1)
+      for p, a in zip(paths, arrays):
+        self.assertTrue(np.all(MmapArray(p, mode='r') == a))
+      self.assertTrue(get_mmap_pool_stats()['handles'] <= 3)
+      # the evicted mapping is still valid for the existing arrays
+      self.assertTrue(np.all(x == arrays[0]))
+      self.assertTrue(np.all(y == arrays[0]))
+      # modified file is mapped again
+      with MmapArrayWriter(paths[0]) as f:
+        f.write(arrays[0])
+      x = MmapArray(paths[0], mode='r')
+      self.assertTrue(np.all(x == np.concatenate([arrays[0]] * 2, axis=0)))
+      # the files are only created by the writer
+      with self.assertRaisesRegex(ValueError, 'MmapArrayWriter'):
+        MmapArray(paths[0], mode='w+')
+      self.assertRaises(ValueError, lambda: MmapArray(paths[0], mode='w'))
+    finally:
+      set_mmap_pool_limits()
+    self.assertEqual(read_mmaparray_metadata(paths[1]), {'name': 'array1'})
+    for p in paths:
+      os.remove(p)
+
+  def test_header_versions(self):
+    fpath = _get_tempfile()
+    array = np.random.rand(100, 3, 4).astype('float32')
+    for version in (1, 2):
+      with MmapArrayWriter(fpath, (None, 3, 4),
+                           'float32',
+                           remove_exist=True,
+                           header_version=version) as f:
+        f.write(array[:60])
+      # the existing file keeps its version
+      with MmapArrayWriter(fpath, header_version=3 - version) as f:
+        f.write(array[60:])
+      with open(fpath, 'rb') as f:
+        self.assertEqual(f.read(8),
+                         b'mmapdata' if version == 1 else b'mmapdat2')
+      dtype, shape = read_mmaparray_header(fpath)
+      self.assertEqual(np.dtype(dtype), np.float32)
+      self.assertEqual(tuple(shape), (100, 3, 4))
+      x = MmapArray(fpath, mode='r')
+      self.assertTrue(np.all(x == array))
+      if version == 1:
+        self.assertEqual(x.metadata, {})
+        self.assertRaises(ValueError,
+                          lambda: write_mmaparray_metadata(fpath, {'a': 1}))
+    # the data is page-aligned
+    self.assertEqual(x.offset % mmap.PAGESIZE, 0)
+    self.assertEqual(os.stat(fpath).st_size, x.offset + array.nbytes)
+    # metadata
+    with MmapArrayWriter(fpath) as f:
+      f.update_metadata(name='features', scale=(1.5, 2.0))
+      self.assertEqual(f.metadata['name'], 'features')
+    write_mmaparray_metadata(fpath, dict(MmapArray(fpath).metadata, id=8))
+    self.assertEqual(read_mmaparray_metadata(fpath),
+                     dict(name='features', scale=(1.5, 2.0), id=8))
+    self.assertRaises(
+        ValueError,
+        lambda: write_mmaparray_metadata(fpath, {'data': b'0' * 8192}))
+    self.assertTrue(np.all(MmapArray(fpath, mode='r') == array))
+    # a bigger metadata section
+    with MmapArrayWriter(fpath, (None, 3, 4),
+                         'float32',
+                         remove_exist=True,
+                         metadata_size=10000) as f:
+      f.write(array)
+      f.update_metadata(data=b'0' * 8192)
+    x = MmapArray(fpath, mode='r')
+    self.assertEqual(x.metadata['data'], b'0' * 8192)
+    self.assertTrue(np.all(x == array))
+    os.remove(fpath)
+
+  def test_read_direct(self):
+    fpath = _get_tempfile()
+    array = np.random.rand(3001, 7, 3).astype('float32')
+    with MmapArrayWriter(fpath, (None, 7, 3),
+                         'float32',
+                         remove_exist=True,
+                         alignment=2 * 1024 * 1024) as f:
+      f.write(array)
+    x = MmapArray(fpath, mode='r')
+    self.assertEqual(x.offset, 2 * 1024 * 1024)
+    self.assertTrue(np.all(x.read_direct() == array))
+    self.assertTrue(np.all(x.read_direct(13, 2000) == array[13:2000]))
+    self.assertTrue(np.all(x[100:].read_direct(-50) == array[-50:]))
+    self.assertEqual(x.read_direct(5, 5).shape, (0, 7, 3))
+    for prefetch in (True, False):
+      blocks = [
+          b.copy() for b in x.iter_direct(block_rows=333, prefetch=prefetch)
+      ]
+      self.assertTrue(np.all(np.concatenate(blocks, axis=0) == array))
+    self.assertRaises(ValueError, lambda: x[:, 1].read_direct())
+    self.assertRaises(
+        ValueError, lambda: MmapArrayWriter(
+            fpath, (None, 3), 'float32', remove_exist=True, alignment=1000))
+    os.remove(fpath)
+
+  def test_aread(self):
+    fpath = _get_tempfile()
+    array = np.random.rand(2000, 5, 3)
+    with MmapArrayWriter(fpath, (None, 5, 3), array.dtype) as f:
+      f.write(array)
+    x = MmapArray(fpath, mode='r')
+    keys = [
+        slice(None),
+        slice(10, 20),
+        slice(-300, None), 7, -1,
+        slice(None, None, 3), [1, 5, 8], (slice(2, 9), 1),
+        slice(5, 5)
+    ]
+
+    async def read_all():
+      # overlapping ranges are requested concurrently
+      return await asyncio.gather(
+          *[x.aread(k) for k in keys] +
+          [x.aread(slice(i, i + 100)) for i in range(0, 1000, 50)])
+
+    stats = get_aio_stats()
+    results = asyncio.run(read_all())
+    for k, y in zip(keys, results):
+      self.assertTrue(isinstance(y, np.ndarray))
+      self.assertEqual(y.shape, array[k].shape)
+      self.assertTrue(np.all(y == array[k]))
+    for i, y in zip(range(0, 1000, 50), results[len(keys):]):
+      self.assertTrue(np.all(y == array[i:i + 100]))
+    new_stats = get_aio_stats()
+    self.assertTrue(new_stats['reads'] + new_stats['coalesced'] -
+                    stats['reads'] - stats['coalesced'] >= 24)
+    self.assertTrue(new_stats['coalesced'] > stats['coalesced'])
+
+    # the coalesced requests never see the changes of the first caller
+    async def modify_first():
+
+      async def first():
+        y = await x.aread(slice(None))
+        y *= 100
+        return y
+
+      return await asyncio.gather(first(), x.aread(slice(10, 20)))
+
+    y, z = asyncio.run(modify_first())
+    self.assertTrue(np.all(y == array * 100))
+    self.assertTrue(np.all(z == array[10:20]))
+    # backpressure with a single read in flight
+    try:
+      set_aio_limits(max_workers=2, max_inflight=1)
+      results = asyncio.run(read_all())
+      self.assertTrue(all(np.all(y == array[k]) for k, y in zip(keys, results)))
+    finally:
+      set_aio_limits()
+    self.assertRaises(IndexError, lambda: asyncio.run(x.aread(2000)))
+    os.remove(fpath)
+
+  def test_coalesced_reads(self):
+    run_starts, run_ends, run_offsets, shifts = \
+      mmap_array._coalesce_ranges(np.array([50, 0, 12, 3, 40, 14]),
+                                  np.array([52, 5, 13, 10, 45, 20]), 1)
+    self.assertEqual(run_starts.tolist(), [0, 12, 40, 50])
+    self.assertEqual(run_ends.tolist(), [10, 20, 45, 52])
+    self.assertEqual(run_offsets.tolist(), [0, 10, 18, 23, 25])
+    self.assertEqual(shifts.tolist(), [23, 0, 10, 3, 18, 12])
+    fpath = _get_tempfile()
+    array = np.random.rand(5000, 6)
+    with MmapArrayWriter(fpath, (None, 6), array.dtype) as f:
+      f.write(array)
+    x = MmapArray(fpath, mode='r')
+    starts = np.random.randint(0, 4900, size=300)
+    ends = starts + np.random.randint(0, 100, size=300)
+    expected = mmap_array._gather_ranges(array, starts, ends, padding=True)
+    try:
+      mmap_array.COALESCE_READS = True
+      for indices in (np.random.permutation(1000) + 2000,
+                      np.random.randint(-5000, 5000,
+                                        size=3000), np.arange(4000, 2000, -1)):
+        self.assertTrue(np.all(x[indices] == array[indices]))
+      self.assertRaises(IndexError, lambda: x[np.arange(4990, 5040)])
+      for padding in (False, True):
+        for y, z in zip(
+            mmap_array._gather_ranges(x, starts, ends, padding=padding),
+            mmap_array._gather_ranges(array,
+                                      starts,
+                                      ends,
+                                      padding=padding,
+                                      coalesce=False)):
+          self.assertTrue(np.all(y == z))
+    finally:
+      mmap_array.COALESCE_READS = False
+    # the asynchronous reads are always coalesced
+    indices = np.random.randint(0, 5000, size=2000)
+    self.assertTrue(np.all(asyncio.run(x.aread(indices)) == array[indices]))
+    os.remove(fpath)
+
+  def test_pickling_views(self):
+    fpath = _get_tempfile()
+    array = np.random.rand(2000, 30)
+    with MmapArrayWriter(fpath, (None, 30), array.dtype) as f:
+      f.write(array)
+    x = MmapArray(fpath, mode='r')
+    for key in (slice(None), slice(100, 1500), slice(None, None, -3),
+                (slice(10, 20), slice(5, None, 2)), 7):
+      y = x[key]
+      data = pickle.dumps(y)
+      # only the descriptor is sent, not the data
+      self.assertTrue(len(data) < 1024)
+      z = pickle.loads(data)
+      self.assertTrue(isinstance(z, MmapArray))
+      self.assertEqual(z.path, fpath)
+      self.assertEqual(z.strides, y.strides)
+      self.assertTrue(np.all(z == array[key]))
+    # copies are pickled with the data
+    y = pickle.loads(pickle.dumps(x[[1, 5, 8]] + 1))
+    self.assertTrue(np.all(y == array[[1, 5, 8]] + 1))
+    y = MmapArray(fpath, mode='c')
+    y[0] = -1
+    self.assertTrue(np.all(pickle.loads(pickle.dumps(y[:2]))[0] == -1))
+    # the views returned from the worker processes
+    with Pool(2) as pool:
+      for start, view in pool.map(_fn_view,
+                                  [(x, i) for i in range(0, 2000, 500)]):
+        self.assertTrue(np.all(view == array[start:start + 500]))
+    os.remove(fpath)
+
+  def test_map_blocks(self):
+    fpath = _get_tempfile()
+    opath = _get_tempfile()
+    array = np.random.rand(1003, 4, 6)
+    with MmapArrayWriter(fpath, (None, 4, 6), array.dtype) as f:
+      f.write(array)
+    x = MmapArray(fpath, mode='r')
+    expected = _fn_block(array).astype('float32')
+    # the output is inferred from the first block
+    y = x.map_blocks(lambda a: _fn_block(a).astype('float32'),
+                     opath,
+                     workers=3,
+                     block_rows=100,
+                     remove_exist=True)
+    self.assertEqual(y.shape, (1003, 12))
+    self.assertEqual(y.dtype, np.float32)
+    self.assertTrue(np.allclose(y, expected))
+    self.assertRaises(RuntimeError, lambda: x.map_blocks(_fn_block, opath))
+    # worker processes
+    y = x.map_blocks(_fn_block,
+                     opath,
+                     out_dtype='float32',
+                     out_shape=(None, 12),
+                     workers=2,
+                     block_rows=128,
+                     executor='process',
+                     remove_exist=True)
+    self.assertTrue(np.allclose(y, expected))
+    self.assertRaises(
+        ValueError, lambda: x.map_blocks(
+            _fn_block, opath, 'float32', (None, 5), remove_exist=True))
+    os.remove(fpath)
+    os.remove(opath)
+
   def test_write_multiprocessing(self):
     fpath = _get_tempfile()
     jobs = [
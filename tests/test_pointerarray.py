@@ -1,15 +1,20 @@
 from __future__ import absolute_import, division, print_function
 
+import asyncio
+import glob
 import os
 import pickle
 import unittest
 import zlib
 from multiprocessing import Pool
 from tempfile import mkstemp
+from unittest import mock
 
 import numpy as np
 
-from bigarray import PointerArray, PointerArrayWriter
+from bigarray import (MmapArrayWriter, PointerArray, PointerArrayWriter,
+                      pointer_array)
+from bigarray.pointer_array import _has_sealed_indices, _read_log_footer
 
 np.random.seed(8)
 
@@ -44,6 +49,14 @@ def _fn_write2(job):
   writer.write(arrays, start_position=start_position)
 
 
+def _fn_write_flush(job):
+  writer, arrays = job
+  for name, x in arrays.items():
+    writer.write({name: x}, start_position=int(x[0, 0]))
+    writer.flush()
+  return writer._creator_pid
+
+
 def _fn_read(job):
   names, path = job
   x = PointerArray(path)
@@ -69,6 +82,12 @@ class PointerArrayTest(unittest.TestCase):
 
     with PointerArrayWriter(path, remove_exist=False) as f:
       f.write(data1)
+      # the arguments conflict with the opened writer
+      self.assertIs(PointerArrayWriter(path, shape=(0, 8)), f)
+      for kwargs in (dict(remove_exist=True), dict(index_mode='local'),
+                     dict(dtype='float32'), dict(growth_chunk=8)):
+        self.assertRaises(ValueError,
+                          lambda: PointerArrayWriter(path, **kwargs))
 
     x = PointerArray(path)
 
@@ -135,6 +154,322 @@ class PointerArrayTest(unittest.TestCase):
             all(np.all(dat == all_data[name]) for name, dat in data.items()))
     _del_file(path)
 
+  def test_local_indices_multiprocessing(self):
+    path = _get_tempfile()
+    jobs = []
+    n = 0
+    for job_idx in range(8):
+      job = {}
+      start = n
+      for i in range(50):
+        x = np.random.rand(np.random.randint(2, 6, dtype='int32'), 4)
+        n += x.shape[0]
+        job['name_%d_%d' % (job_idx, i)] = x
+      jobs.append((start, job))
+
+    global WRITER
+    WRITER = PointerArrayWriter(path,
+                                shape=(n, 4),
+                                dtype='float64',
+                                remove_exist=True,
+                                index_mode='local')
+    # the writer process also write a part of the data
+    WRITER.write(jobs[0][1], start_position=jobs[0][0])
+    with Pool(2) as pool:
+      pool.map(_fn_write, jobs[1:])
+    self.assertEqual(len(WRITER.indices), 8 * 50)
+    WRITER.flush()
+    WRITER.close()
+    self.assertEqual(len(glob.glob(path + '.indices.*')), 0)
+
+    x = PointerArray(path)
+    self.assertEqual(len(x.indices), 8 * 50)
+    for _, arrays in jobs:
+      for name, dat in arrays.items():
+        self.assertTrue(np.all(dat == x[name]))
+    _del_file(path)
+
+  def test_gather(self):
+    path = _get_tempfile()
+    data = {
+        'name%d' % i: np.random.rand(np.random.randint(1, 8), 3)
+        for i in range(100)
+    }
+    with PointerArrayWriter(path,
+                            shape=(0, 3),
+                            dtype='float64',
+                            remove_exist=True) as f:
+      f.write(data)
+    x = PointerArray(path)
+    keys = ['name%d' % i for i in np.random.permutation(100)[:32]]
+
+    dat, offsets = x.gather(keys)
+    self.assertEqual(offsets.shape, (33,))
+    for i, k in enumerate(keys):
+      self.assertTrue(np.all(dat[offsets[i]:offsets[i + 1]] == data[k]))
+
+    batch, lengths = x.gather(keys, padding=True, pad_value=-1)
+    self.assertEqual(batch.shape, (32, lengths.max(), 3))
+    for i, k in enumerate(keys):
+      self.assertTrue(np.all(batch[i, :lengths[i]] == data[k]))
+      self.assertTrue(np.all(batch[i, lengths[i]:] == -1))
+
+    self.assertRaises(KeyError, lambda: x.gather(['name1', 'unknown']))
+    # the array and its views are pickled without the data
+    y = pickle.loads(pickle.dumps(x))
+    self.assertTrue(np.all(y['name5'] == data['name5']))
+    y = pickle.loads(pickle.dumps(x[10:]))
+    self.assertTrue(np.all(y == x[10:]))
+    _del_file(path)
+
+  def test_legacy_pickled_indices(self):
+    path = _get_tempfile()
+    data = {'name%d' % i: np.random.rand(i + 1, 4) for i in range(20)}
+    # write the data with the old pickled indices trailer
+    indices = {}
+    with MmapArrayWriter(path, shape=(0, 4), dtype='float64',
+                         remove_exist=True) as f:
+      for name, dat in data.items():
+        indices[name] = (f.shape[0], f.shape[0] + dat.shape[0])
+        f.write(dat)
+    with open(path, 'ab') as f:
+      indices_data = pickle.dumps(indices)
+      f.write(indices_data + len(indices_data).to_bytes(8, 'big'))
+
+    x = PointerArray(path)
+    self.assertEqual(dict(x.indices), indices)
+    self.assertTrue(all(np.all(x[name] == dat) for name, dat in data.items()))
+    # appending to legacy file convert it to the binary indices
+    with PointerArrayWriter(path) as f:
+      f.write({'new': np.ones((3, 4))})
+    x = PointerArray(path)
+    self.assertEqual(len(x.indices), len(data) + 1)
+    self.assertTrue(np.all(x['new'] == 1))
+    self.assertTrue(np.all(x['name7'] == data['name7']))
+    self.assertTrue('name' not in x.indices)
+    self.assertRaises(KeyError, lambda: x['name'])
+    _del_file(path)
+
+  def test_incremental_indices(self):
+    path = _get_tempfile()
+    data = {'name%d' % i: np.random.rand(i % 7 + 1, 4) for i in range(300)}
+    names = list(data.keys())
+    f = PointerArrayWriter(path,
+                           shape=(0, 4),
+                           dtype='float64',
+                           remove_exist=True,
+                           growth_factor=2.0)
+    for i in range(0, 300, 50):
+      f.write({name: data[name] for name in names[i:i + 50]})
+      # overwrite an existing key
+      if i == 100:
+        data['name0'] = np.ones((3, 4))
+        f.write({'name0': data['name0']})
+      f.flush()
+      # each flush only appends the new entries
+      with open(path, 'rb') as fin:
+        _, _, _, offsets, _ = _read_log_footer(fin)
+      x = PointerArray(path)
+      self.assertEqual(len(x.indices), i + 50)
+      self.assertTrue(
+          all(np.all(x[name] == data[name]) for name in names[:i + 50]))
+    self.assertTrue(len(offsets) > 1)
+    f.close()
+    # compacted into a single segment
+    with open(path, 'rb') as fin:
+      _, _, _, offsets, _ = _read_log_footer(fin)
+    self.assertEqual(len(offsets), 1)
+    x = PointerArray(path)
+    self.assertEqual(sorted(x.indices.keys()), sorted(names))
+    self.assertTrue(all(np.all(x[name] == dat) for name, dat in data.items()))
+    # reopen and append
+    with PointerArrayWriter(path) as f:
+      f.write({'new': np.zeros((2, 4))})
+    x = PointerArray(path)
+    self.assertEqual(len(x.indices), 301)
+    self.assertTrue(np.all(x['new'] == 0))
+    self.assertTrue(np.all(x['name299'] == data['name299']))
+    _del_file(path)
+
+  def test_reader_during_writing(self):
+    path = _get_tempfile()
+    data = {'k%d' % i: np.full((i % 3 + 1, 4), i, 'float64') for i in range(40)}
+    for growth_factor in (1.0, 2.0):
+      # the reader opened while the writer is appending
+      f = PointerArrayWriter(path,
+                             shape=(0, 4),
+                             dtype='float64',
+                             remove_exist=True,
+                             growth_factor=growth_factor)
+      f.write({'k%d' % i: data['k%d' % i] for i in range(10)})
+      f.flush()
+      x = PointerArray(path, mode='r')
+      for i in range(10, 40):
+        f.write({'k%d' % i: data['k%d' % i]})
+        f.flush()
+      self.assertEqual(len(x.indices), 10)
+      self.assertTrue(all(np.all(x['k%d' % i] == i) for i in range(10)))
+      f.close()
+      # the sealed indices are memory-mapped, the writer moves them with the
+      # log instead of copying the file
+      self.assertTrue(_has_sealed_indices(path))
+      inode = os.stat(path).st_ino
+      y = PointerArray(path, mode='r')
+      self.assertFalse(y.indices.is_stale)
+      with PointerArrayWriter(path, growth_factor=growth_factor) as f:
+        self.assertFalse(_has_sealed_indices(path))
+        for i in range(40, 60):
+          f.write({'k%d' % i: np.full((3, 4), i, 'float64')})
+          f.flush()
+          self.assertTrue(np.all(y['k%d' % (i - 40)] == i - 40))
+      self.assertEqual(os.stat(path).st_ino, inode)
+      self.assertEqual(len(y.indices), 40)
+      self.assertTrue(all(np.all(y['k%d' % i] == i) for i in range(40)))
+      z = PointerArray(path, mode='r')
+      self.assertEqual(len(z.indices), 60)
+      self.assertTrue(all(np.all(z['k%d' % i] == i) for i in range(60)))
+    _del_file(path)
+
+  def test_flush_multiprocessing(self):
+    path = _get_tempfile()
+    arrays = {'name%d' % i: np.full((2, 3), 2 * i, 'float64') for i in range(40)}
+    f = PointerArrayWriter(path, (80, 3), 'float64', remove_exist=True)
+    items = list(arrays.items())
+    jobs = [(f, dict(items[i::4])) for i in range(4)]
+    # the copies append to the log concurrently, only the creator compacts
+    with Pool(2) as pool:
+      creators = pool.map(_fn_write_flush, jobs)
+    self.assertEqual(creators, [os.getpid()] * 4)
+    f.flush()
+    # a single footer, the superseded ones are overwritten
+    with open(path, 'rb') as fp:
+      log_start, _, _, offsets, sizes = _read_log_footer(fp)
+      filesize = fp.seek(0, os.SEEK_END)
+    footer_size = 8 * (3 + 2 * len(offsets)) + 24
+    self.assertEqual(filesize - log_start,
+                     int(offsets[-1] + sizes[-1] + 7) // 8 * 8 + footer_size)
+    f.close()
+    x = PointerArray(path)
+    self.assertTrue(_has_sealed_indices(path))
+    self.assertEqual(len(x.indices), 40)
+    self.assertTrue(all(np.all(x[name] == a) for name, a in arrays.items()))
+    _del_file(path)
+
+  def test_flush_durability(self):
+    path = _get_tempfile()
+    data = {'name%d' % i: np.random.rand(i + 1, 4) for i in range(20)}
+    f = PointerArrayWriter(path,
+                           shape=(0, 4),
+                           dtype='float64',
+                           remove_exist=True)
+    f.write({'name0': data['name0']})
+    # nothing is written
+    self.assertTrue(f.flush('none') is f)
+    # the indices are written to the page cache
+    self.assertTrue(f.flush('page_cache') is f)
+    self.assertEqual(len(PointerArray(path).indices), 1)
+    # keep writing while the previous flush is running
+    futures = []
+    for name, dat in data.items():
+      if name == 'name0':
+        continue
+      f.write({name: dat})
+      futures.append(f.flush(durability='index', asynchronous=True))
+    self.assertTrue(all(i.result() is f for i in futures))
+    x = PointerArray(path)
+    self.assertEqual(len(x.indices), len(data))
+    self.assertTrue(all(np.all(x[name] == dat) for name, dat in data.items()))
+    self.assertRaises(ValueError, lambda: f.flush('unknown'))
+    self.assertTrue(f.flush('data', asynchronous=True).result() is f)
+    f.close()
+    _del_file(path)
+
+  def test_flush_fsync(self):
+    path = _get_tempfile()
+    with PointerArrayWriter(path, (0, 4), 'float64', remove_exist=True) as f:
+      fd = f._file.fileno()
+      for asynchronous in (False, True):
+        with mock.patch('os.fsync', wraps=os.fsync) as fsync:
+          f.write({'name%d' % asynchronous: np.ones((2, 4))})
+          f.flush('page_cache', asynchronous=asynchronous)
+          fsync.assert_not_called()
+          result = f.flush('index', asynchronous=asynchronous)
+          if asynchronous:
+            result = result.result()
+          self.assertTrue(result is f)
+          # the synchronous flush syncs the writer descriptor, the
+          # asynchronous one a duplicate of it
+          self.assertEqual(fsync.call_count, 1)
+          if not asynchronous:
+            fsync.assert_called_with(fd)
+    self.assertEqual(len(PointerArray(path).indices), 2)
+    # closing syncs once before, and once after compacting the indices
+    events = []
+    compact_indices = pointer_array._compact_indices
+
+    def compact(*args, **kwargs):
+      events.append('compact')
+      return compact_indices(*args, **kwargs)
+
+    with mock.patch('os.fsync',
+                    side_effect=lambda fd: events.append('fsync')), \
+        mock.patch('bigarray.pointer_array._compact_indices', compact):
+      with PointerArrayWriter(path) as f:
+        f.write({'name2': np.ones((3, 4))})
+        f.flush('page_cache')
+        f.write({'name3': np.ones((3, 4))})
+    self.assertEqual(events, ['fsync', 'compact', 'fsync'])
+    self.assertTrue(_has_sealed_indices(path))
+    self.assertEqual(len(PointerArray(path).indices), 4)
+    with self.assertRaisesRegex(ValueError, 'PointerArrayWriter'):
+      PointerArray(path, mode='w+')
+    _del_file(path)
+
+  def test_aget(self):
+    path = _get_tempfile()
+    data = {'name%d' % i: np.random.rand(i % 7, 3) for i in range(40)}
+    with PointerArrayWriter(path, (0, 3), 'float64', remove_exist=True) as f:
+      f.write(data)
+    x = PointerArray(path)
+    keys = ['name%d' % i for i in np.random.permutation(40)]
+
+    async def read_all():
+      return await asyncio.gather(asyncio.gather(*[x.aget(k) for k in keys]),
+                                  x.agather(keys),
+                                  x.agather(keys, padding=True, pad_value=-1))
+
+    arrays, (batch, offsets), (padded, lengths) = asyncio.run(read_all())
+    expected_batch, expected_offsets = x.gather(keys)
+    self.assertTrue(np.all(batch == expected_batch))
+    self.assertTrue(np.all(offsets == expected_offsets))
+    expected_padded, _ = x.gather(keys, padding=True, pad_value=-1)
+    self.assertTrue(np.all(padded == expected_padded))
+    for i, k in enumerate(keys):
+      self.assertTrue(np.all(arrays[i] == data[k]))
+      self.assertEqual(lengths[i], data[k].shape[0])
+    self.assertRaises(KeyError, lambda: asyncio.run(x.aget('unknown')))
+    _del_file(path)
+
+  def test_map_blocks(self):
+    path = _get_tempfile()
+    opath = _get_tempfile()
+    data = {'name%d' % i: np.random.rand(i + 1, 3) for i in range(50)}
+    with PointerArrayWriter(path, (0, 3), 'float64', remove_exist=True) as f:
+      f.write(data)
+    x = PointerArray(path)
+    y = x.map_blocks(lambda a: np.sum(a, axis=-1),
+                     opath,
+                     block_rows=64,
+                     remove_exist=True)
+    self.assertTrue(isinstance(y, PointerArray))
+    self.assertEqual(list(y.indices.keys()), list(x.indices.keys()))
+    self.assertTrue(
+        all(
+            np.allclose(y[name], np.sum(dat, -1))
+            for name, dat in data.items()))
+    _del_file(path)
+    _del_file(opath)
+
   def test_pickling(self):
     path = _get_tempfile()
 
@@ -0,0 +1,82 @@
+from __future__ import absolute_import, division, print_function
+
+import os
+import pickle
+import unittest
+from tempfile import mkstemp
+
+import numpy as np
+
+from bigarray import RaggedMmapArray, RaggedMmapArrayWriter
+
+np.random.seed(8)
+
+
+# ===========================================================================
+# Helper function
+# ===========================================================================
+def _get_tempfile():
+  fid, fpath = mkstemp()
+  os.close(fid)
+  return fpath
+
+
+# ===========================================================================
+# Test cases
+# ===========================================================================
+class RaggedMmapArrayTest(unittest.TestCase):
+
+  def test_write_read(self):
+    fpath = _get_tempfile()
+    rows = [np.random.rand(np.random.randint(0, 20), 3) for _ in range(500)]
+    with RaggedMmapArrayWriter(fpath,
+                               shape=(0, 3),
+                               dtype='float64',
+                               remove_exist=True) as f:
+      f.write(rows[:100])
+      # the concatenated data and the lengths
+      f.write(np.concatenate(rows[100:300], axis=0),
+              lengths=[len(r) for r in rows[100:300]])
+      self.assertEqual(len(f), 300)
+    # appending to existed array
+    with RaggedMmapArrayWriter(fpath) as f:
+      f.write(rows[300:])
+    x = RaggedMmapArray(fpath)
+    self.assertEqual(len(x), 500)
+    self.assertEqual(x.row_shape, (3,))
+    self.assertTrue(np.all(x.lengths == [len(r) for r in rows]))
+    self.assertTrue(all(np.all(x[i] == r) for i, r in enumerate(rows)))
+    self.assertTrue(np.all(x[-1] == rows[-1]))
+    self.assertRaises(IndexError, lambda: x[500])
+    # views
+    y = x[20:200:3]
+    self.assertEqual(len(y), len(rows[20:200:3]))
+    self.assertTrue(all(np.all(i == j) for i, j in zip(y, rows[20:200:3])))
+    indices = np.random.permutation(500)[:50]
+    y = x[indices]
+    self.assertTrue(all(np.all(y[i] == rows[j]) for i, j in enumerate(indices)))
+    self.assertTrue(np.all(y[5:10].lengths == x.lengths[indices[5:10]]))
+    y = x[x.lengths > 10]
+    self.assertTrue(np.all(y.lengths > 10))
+    # gather
+    data, offsets = x.gather(indices)
+    self.assertTrue(
+        all(
+            np.all(data[offsets[i]:offsets[i + 1]] == rows[j])
+            for i, j in enumerate(indices)))
+    batch, lengths = x[:10].gather(padding=True, pad_value=-1)
+    self.assertEqual(batch.shape, (10, lengths.max(), 3))
+    self.assertTrue(
+        all(np.all(batch[i, :len(r)] == r) for i, r in enumerate(rows[:10])))
+    # pickling
+    y = pickle.loads(pickle.dumps(x[100:]))
+    self.assertTrue(np.all(y[0] == rows[100]))
+    os.remove(fpath)
+    os.remove(fpath + '.offsets')
+
+
+# ===========================================================================
+# Main
+# ===========================================================================
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,137 @@
+from __future__ import absolute_import, division, print_function
+
+import os
+import unittest
+from tempfile import mkstemp
+from unittest import mock
+
+import numpy as np
+
+from bigarray import (MmapArray, MmapArrayWriter, compute_statistics,
+                      mmap_array, read_mmaparray_metadata, reductions)
+
+np.random.seed(8)
+
+
+# ===========================================================================
+# Helper function
+# ===========================================================================
+def _get_tempfile():
+  fid, fpath = mkstemp()
+  os.close(fid)
+  return fpath
+
+
+# ===========================================================================
+# Test cases
+# ===========================================================================
+class ReductionsTest(unittest.TestCase):
+
+  def test_statistics(self):
+    array = (np.random.randn(10007, 3, 2) * 5 + 1000).astype('float32')
+    fpath = _get_tempfile()
+    with MmapArrayWriter(fpath, array.shape, array.dtype,
+                         remove_exist=True) as f:
+      f.write(array)
+    x = MmapArray(fpath)
+    stats = compute_statistics(x,
+                               block_rows=333,
+                               workers=3,
+                               bins=10,
+                               quantiles=[0.1, 0.5, 0.9])
+    data = array.astype('float64')
+    self.assertEqual(stats['count'], array.shape[0])
+    self.assertTrue(np.allclose(stats['sum'], np.sum(data, 0)))
+    self.assertTrue(np.allclose(stats['mean'], np.mean(data, 0)))
+    self.assertTrue(np.allclose(stats['var'], np.var(data, 0)))
+    self.assertTrue(np.allclose(stats['min'], np.min(data, 0)))
+    self.assertTrue(np.allclose(stats['max'], np.max(data, 0)))
+    self.assertEqual(stats['histogram'].shape, (10, 3, 2))
+    self.assertTrue(np.all(np.sum(stats['histogram'], 0) == array.shape[0]))
+    counts, _ = np.histogram(data[:, 1, 0], bins=stats['bin_edges'][:, 1, 0])
+    self.assertTrue(np.all(stats['histogram'][:, 1, 0] == counts))
+    self.assertTrue(
+        np.allclose(stats['quantiles'],
+                    np.quantile(data, [0.1, 0.5, 0.9], axis=0),
+                    atol=0.1))
+    # a view of the file
+    stats = compute_statistics(x[100:2000, 1], block_rows=100, cache=True)
+    self.assertTrue(np.allclose(stats['mean'], np.mean(data[100:2000, 1], 0)))
+    self.assertEqual(read_mmaparray_metadata(fpath), {})
+    # cached results, invalidated by the writer
+    stats = compute_statistics(x, cache=True)
+    self.assertTrue('statistics' in read_mmaparray_metadata(fpath))
+    self.assertTrue(
+        np.all(compute_statistics(x, cache=True)['mean'] == stats['mean']))
+    with MmapArrayWriter(fpath) as f:
+      f.write(np.zeros((10, 3, 2), dtype='float32'))
+    self.assertFalse('statistics' in read_mmaparray_metadata(fpath))
+    stats = compute_statistics(MmapArray(fpath), cache=True)
+    self.assertEqual(stats['count'], array.shape[0] + 10)
+    self.assertTrue(np.allclose(stats['min'], np.minimum(np.min(data, 0), 0)))
+    # every overwrite invalidates the statistics cached while writing
+    with MmapArrayWriter(fpath) as f:
+      for value in (-1., -2.):
+        f.write(np.full((10, 3, 2), value, dtype='float32'), start_position=0)
+        f.flush()
+        self.assertFalse('statistics' in read_mmaparray_metadata(fpath))
+        stats = compute_statistics(MmapArray(fpath), cache=True)
+        self.assertTrue(np.all(stats['min'] == value))
+    # the metadata is not read by the writes if no statistics are cached
+    with MmapArrayWriter(fpath) as f:
+      f.write(np.zeros((10, 3, 2), dtype='float32'), start_position=0)
+      self.assertFalse('statistics' in read_mmaparray_metadata(fpath))
+      with mock.patch('bigarray.mmap_array._read_metadata',
+                      wraps=mmap_array._read_metadata) as read_metadata:
+        for i in range(3):
+          f.write(np.zeros((10, 3, 2), dtype='float32'), start_position=i)
+        self.assertEqual(read_metadata.call_count, 0)
+    os.remove(fpath)
+
+  def test_bounded_sketches(self):
+    data = np.linspace(-1., 1., 20000).reshape(-1, 2)[::-1]**3
+    sizes = []
+    merge_sketches = reductions._merge_sketches
+
+    def merge(sketches, sketch_size):
+      sizes.append(sum(v.shape[0] for v, _ in sketches))
+      return merge_sketches(sketches, sketch_size)
+
+    with mock.patch.object(reductions, '_merge_sketches', merge):
+      stats = compute_statistics(data,
+                                 block_rows=50,
+                                 workers=2,
+                                 quantiles=[0.1, 0.5, 0.9],
+                                 sketch_size=16)
+    # 200 blocks, the sketches are merged while reducing
+    self.assertTrue(len(sizes) > 10)
+    self.assertTrue(
+        max(sizes) <= (reductions._SKETCH_MERGE + 1) * 16 *
+        reductions._SKETCH_MERGE)
+    self.assertTrue(
+        np.allclose(stats['quantiles'],
+                    np.quantile(data, [0.1, 0.5, 0.9], axis=0),
+                    atol=0.05))
+
+  def test_histogram_constant(self):
+    data = np.full((100, 2), 3.)
+    data[:, 1] = np.arange(100)
+    stats = compute_statistics(data, block_rows=30, bins=5)
+    for col in range(2):
+      counts, edges = np.histogram(data[:, col], bins=5)
+      self.assertTrue(np.all(stats['histogram'][:, col] == counts))
+      self.assertTrue(np.allclose(stats['bin_edges'][:, col], edges))
+
+  def test_histogram_range(self):
+    data = np.linspace(-2., 2., 401).reshape(-1, 1)
+    stats = compute_statistics(data, block_rows=50, bins=8, value_range=(-1, 1))
+    counts, edges = np.histogram(data[:, 0], bins=8, range=(-1, 1))
+    self.assertTrue(np.all(stats['histogram'][:, 0] == counts))
+    self.assertTrue(np.allclose(stats['bin_edges'][:, 0], edges))
+
+
+# ===========================================================================
+# Main
+# ===========================================================================
+if __name__ == '__main__':
+  unittest.main()
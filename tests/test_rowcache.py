@@ -0,0 +1,119 @@
+from __future__ import absolute_import, division, print_function
+
+import os
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from tempfile import mkstemp
+
+import numpy as np
+
+from bigarray import (MmapArray, MmapArrayWriter, PointerArray,
+                      PointerArrayWriter, RowCache)
+
+np.random.seed(8)
+
+
+# ===========================================================================
+# Helper function
+# ===========================================================================
+def _get_tempfile():
+  fid, fpath = mkstemp()
+  os.close(fid)
+  return fpath
+
+
+# ===========================================================================
+# Test cases
+# ===========================================================================
+class RowCacheTest(unittest.TestCase):
+
+  def test_eviction(self):
+    row = np.zeros((10,), dtype='int8')
+    cache = RowCache(max_bytes=100, protected_ratio=0.5)
+    for i in range(5):
+      cache.put(i, row)
+    # the hot rows are promoted to the protected segment
+    for i in range(3):
+      self.assertIsNotNone(cache.get(i))
+    self.assertEqual(cache.stats()['protected_bytes'], 30)
+    # a scan only evicts the rows seen once
+    for i in range(100, 120):
+      cache.get_or_load(i, lambda: row)
+    self.assertTrue(all(i in cache for i in range(3)))
+    self.assertFalse(3 in cache)
+    self.assertEqual(cache.nbytes, 100)
+    stats = cache.stats()
+    self.assertEqual(stats['hits'], 3)
+    self.assertEqual(stats['misses'], 20)
+    self.assertEqual(stats['evictions'], 15)
+    self.assertEqual(stats['entries'], 10)
+    # the protected segment is bounded, the demoted rows are kept
+    for i in range(110, 120):
+      cache.get(i)
+    self.assertEqual(cache.stats()['protected_bytes'], 50)
+    self.assertEqual(len(cache), 10)
+    # too big to be cached
+    cache.put('big', np.zeros((101,), dtype='int8'))
+    self.assertFalse('big' in cache)
+    cache.clear()
+    self.assertEqual(cache.nbytes, 0)
+
+  def test_mmaparray_cache(self):
+    array = np.random.rand(100, 3, 2)
+    fpath = _get_tempfile()
+    with MmapArrayWriter(fpath, array.shape, array.dtype,
+                         remove_exist=True) as f:
+      f.write(array)
+    cache = RowCache()
+    x = MmapArray(fpath, mode='r').set_cache(cache)
+    # the hits return the same read-only copy
+    a = x[5]
+    self.assertTrue(np.all(a == array[5]))
+    self.assertIs(x[5], a)
+    self.assertIs(x[-95], a)
+    self.assertFalse(a.flags.writeable)
+    self.assertRaises(IndexError, lambda: x[100])
+    # slices and views are not cached
+    self.assertTrue(np.all(x[5:7] == array[5:7]))
+    self.assertTrue(np.all(x[10:][5] == array[15]))
+    self.assertEqual(cache.stats()['hits'], 2)
+    self.assertEqual(cache.stats()['entries'], 1)
+    # shared by the threads
+    cache.clear()
+    n_reads = cache.hits + cache.misses
+    indices = np.random.randint(0, 10, size=1000)
+    with ThreadPoolExecutor(4) as executor:
+      rows = list(executor.map(lambda i: x[i], indices))
+    self.assertTrue(all(np.all(r == array[i]) for r, i in zip(rows, indices)))
+    self.assertEqual(cache.stats()['entries'], len(np.unique(indices)))
+    self.assertEqual(cache.hits + cache.misses - n_reads, 1000)
+    x.set_cache(None)
+    self.assertIsNot(x[5], x[5])
+    os.remove(fpath)
+
+  def test_pointerarray_cache(self):
+    data = {
+        'name%d' % i: np.random.rand(np.random.randint(1, 5), 2)
+        for i in range(20)
+    }
+    fpath = _get_tempfile()
+    with PointerArrayWriter(fpath, (0, 2), 'float64', remove_exist=True) as f:
+      f.write(data)
+    cache = RowCache()
+    x = PointerArray(fpath, mode='r').set_cache(cache)
+    y = PointerArray(fpath, mode='r').set_cache(cache)
+    self.assertTrue(all(np.all(x[k] == v) for k, v in data.items()))
+    # the arrays of the same file share the entries
+    self.assertIs(y['name3'], x['name3'])
+    self.assertEqual(cache.stats()['misses'], 20)
+    self.assertRaises(KeyError, lambda: x['unknown'])
+    cache.invalidate(fpath)
+    self.assertEqual(len(cache), 0)
+    os.remove(fpath)
+
+
+# ===========================================================================
+# Main
+# ===========================================================================
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,169 @@
+from __future__ import absolute_import, division, print_function
+
+import os
+import unittest
+from tempfile import mkstemp
+
+import numpy as np
+
+from bigarray import (BlockShuffleSampler, BucketBatchSampler, MmapArray,
+                      MmapArrayWriter, PointerArray, PointerArrayWriter,
+                      RaggedMmapArray, RaggedMmapArrayWriter)
+
+np.random.seed(8)
+
+
+# ===========================================================================
+# Helper function
+# ===========================================================================
+def _get_tempfile():
+  fid, fpath = mkstemp()
+  os.close(fid)
+  return fpath
+
+
+# ===========================================================================
+# Test cases
+# ===========================================================================
+class SamplersTest(unittest.TestCase):
+
+  def test_block_shuffle_rows(self):
+    fpath = _get_tempfile()
+    with MmapArrayWriter(fpath, (None, 128), 'float32', remove_exist=True) as f:
+      f.write(np.random.rand(20000, 128).astype('float32'))
+    x = MmapArray(fpath)
+
+    local = BlockShuffleSampler(x, block_pages=8, window=1, seed=1)
+    order = local.epoch()
+    self.assertEqual(len(local), 20000)
+    self.assertTrue(np.all(np.sort(order) == np.arange(20000)))
+    self.assertFalse(np.all(order == np.arange(20000)))
+    # every block is read at once
+    blocks = (x.offset + order * 512) // (8 * 4096)
+    self.assertEqual(np.sum(np.diff(blocks) != 0) + 1, local.n_blocks)
+    # different order for each epoch
+    self.assertFalse(np.all(local.epoch() == order))
+
+    random = BlockShuffleSampler(x, block_pages=8, window=10**6, seed=1)
+    local_report = local.expected_pages(cache_pages=64)
+    random_report = random.expected_pages(cache_pages=64)
+    self.assertEqual(local_report['pages'], random_report['pages'])
+    self.assertTrue(local_report['page_loads'] < random_report['page_loads'])
+    self.assertAlmostEqual(random_report['page_loads'],
+                           random_report['random_page_loads'])
+    os.remove(fpath)
+
+  def test_block_shuffle_keys(self):
+    fpath = _get_tempfile()
+    data = {
+        'name%d' % i: np.random.rand(np.random.randint(1, 500))
+        for i in range(300)
+    }
+    with PointerArrayWriter(fpath, (0,), 'float64', remove_exist=True) as f:
+      f.write(data)
+    x = PointerArray(fpath)
+    sampler = BlockShuffleSampler(x, block_pages=4, window=2, seed=2)
+    keys = list(sampler)
+    self.assertEqual(sorted(keys), sorted(data.keys()))
+    self.assertTrue(all(np.all(x[k] == data[k]) for k in keys[:10]))
+    os.remove(fpath)
+
+  def test_bucket_batch(self):
+    fpath = _get_tempfile()
+    data = {
+        'name%d' % i: np.random.rand(np.random.randint(1, 200), 2)
+        for i in range(1000)
+    }
+    with PointerArrayWriter(fpath, (0, 2), 'float64', remove_exist=True) as f:
+      f.write(data)
+    x = PointerArray(fpath)
+    sampler = BucketBatchSampler(x, max_rows=1000, bucket_width=16, seed=3)
+    batches = sampler.epoch()
+    self.assertEqual(sorted(np.concatenate(batches).tolist()),
+                     sorted(data.keys()))
+    for batch in batches:
+      lengths = [len(data[k]) for k in batch]
+      self.assertTrue(len(batch) * max(lengths) <= 1000 or len(batch) == 1)
+      self.assertTrue(max(lengths) // 16 == min(lengths) // 16)
+    # much less padding than random batches of the same average size
+    stats = sampler.statistics(reset=True)
+    lengths = np.array([len(i) for i in data.values()])
+    batch_size = int(stats['mean_batch_size'])
+    random = lengths[np.random.permutation(1000)[:1000 // batch_size *
+                                                 batch_size]].reshape(
+                                                     -1, batch_size)
+    random_ratio = 1. - random.sum() / (random.max(1).sum() * batch_size)
+    self.assertTrue(stats['padding_ratio'] < random_ratio / 2)
+    # padded batches
+    for keys, padded, lengths in sampler.iter_padded(pad_value=-1):
+      for k, dat, n in zip(keys, padded, lengths):
+        self.assertTrue(np.all(dat[:n] == data[k]))
+        self.assertTrue(np.all(dat[n:] == -1))
+    stats = sampler.statistics()
+    self.assertEqual(stats['batches'], len(batches))
+    self.assertTrue(stats['batch_time_max'] > 0)
+    self.assertTrue(0 < stats['batch_time_mean'] <= stats['batch_time_max'])
+    # the statistics are running aggregates
+    self.assertTrue(all(np.isscalar(v) for v in sampler._statistics.values()))
+    os.remove(fpath)
+
+  def test_bucket_batch_empty_entries(self):
+    fpath = _get_tempfile()
+    data = {
+        'a': np.arange(5, dtype='float64'),
+        'b': np.arange(5, 8, dtype='float64'),
+        'z': np.zeros((0,), dtype='float64'),
+    }
+    with PointerArrayWriter(fpath, (0,), 'float64', remove_exist=True) as f:
+      f.write(data)
+    x = PointerArray(fpath)
+    self.assertEqual(x.indices['z'], (8, 8))
+    # the zero-length entry at the end of the data
+    sampler = BucketBatchSampler(x, max_rows=100, bucket_width=100, seed=1)
+    keys = []
+    for batch, padded, lengths in sampler.iter_padded(pad_value=-1):
+      for k, dat, n in zip(batch, padded, lengths):
+        self.assertTrue(np.all(dat[:n] == data[k]))
+        self.assertTrue(np.all(dat[n:] == -1))
+        keys.append(k)
+    self.assertEqual(sorted(keys), ['a', 'b', 'z'])
+    # only zero-length entries
+    with PointerArrayWriter(fpath, (0,), 'float64', remove_exist=True) as f:
+      f.write({'z': np.zeros((0,), dtype='float64')})
+    sampler = BucketBatchSampler(PointerArray(fpath), max_rows=100)
+    batches = list(sampler.iter_padded())
+    self.assertEqual(len(batches), 1)
+    self.assertEqual(batches[0][1].shape, (1, 0))
+    os.remove(fpath)
+
+  def test_bucket_batch_ragged(self):
+    fpath = _get_tempfile()
+    rows = [np.arange(np.random.randint(1, 50)) for _ in range(300)]
+    with RaggedMmapArrayWriter(fpath, (0,), 'int64', remove_exist=True) as f:
+      f.write(rows)
+    x = RaggedMmapArray(fpath)
+    sampler = BucketBatchSampler(x,
+                                 max_rows=100,
+                                 boundaries=[10, 20, 30],
+                                 max_batch_size=4,
+                                 shuffle=False)
+    self.assertEqual(sampler.n_buckets, 4)
+    batches = sampler.epoch()
+    self.assertTrue(all(len(b) <= 4 for b in batches))
+    self.assertEqual(sorted(np.concatenate(batches).tolist()), list(range(300)))
+    buffers = set()
+    for indices, padded, lengths in sampler.iter_padded():
+      buffers.add(padded.__array_interface__['data'][0])
+      for i, dat, n in zip(indices, padded, lengths):
+        self.assertTrue(np.all(dat[:n] == rows[i]))
+    # the buffer is reused
+    self.assertEqual(len(buffers), 1)
+    os.remove(fpath)
+    os.remove(fpath + '.offsets')
+
+
+# ===========================================================================
+# Main
+# ===========================================================================
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,120 @@
+from __future__ import absolute_import, division, print_function
+
+import os
+import pickle
+import shutil
+import unittest
+from multiprocessing import Pool
+from tempfile import mkdtemp
+
+import numpy as np
+
+from bigarray import ShardedMmapArray, mmap_array
+
+np.random.seed(8)
+
+
+# ===========================================================================
+# Helper function
+# ===========================================================================
+def _fn_write(job):
+  path, shard, array = job
+  with ShardedMmapArray.writer(path,
+                               shard,
+                               shape=(0,) + array.shape[1:],
+                               dtype=array.dtype,
+                               remove_exist=True) as f:
+    f.write(array)
+
+
+def _n_pooled(path):
+  return len([p for p, _ in mmap_array._POOL._entries if p.startswith(path)])
+
+
+# ===========================================================================
+# Test cases
+# ===========================================================================
+class ShardedMmapArrayTest(unittest.TestCase):
+
+  def test_write_read(self):
+    path = mkdtemp()
+    arrays = [np.random.rand(np.random.randint(0, 50), 3, 2) for _ in range(12)]
+    # one process per shard
+    with Pool(2) as pool:
+      pool.map(_fn_write, [(path, i, a) for i, a in enumerate(arrays)])
+    array = np.concatenate(arrays, axis=0)
+
+    x = ShardedMmapArray(path, max_open=3)
+    self.assertEqual(x.n_shards, 12)
+    self.assertEqual(x.shape, array.shape)
+    self.assertEqual(x.shard_offsets[-1], array.shape[0])
+    self.assertEqual(x.n_opened, 0)
+    self.assertTrue(np.all(x[:] == array))
+    self.assertEqual(x.n_opened, 3)
+    # the mappings of the closed shards are evicted from the pool
+    self.assertEqual(_n_pooled(path), 3)
+    self.assertTrue(np.all(x[10:300] == array[10:300]))
+    self.assertTrue(np.all(x[-70:-3] == array[-70:-3]))
+    self.assertTrue(np.all(x[5:400:9] == array[5:400:9]))
+    self.assertTrue(np.all(x[63] == array[63]))
+    self.assertTrue(np.all(x[-1, 2] == array[-1, 2]))
+    self.assertTrue(np.all(x[..., 1] == array[..., 1]))
+    indices = np.random.randint(0, array.shape[0], size=(10, 5))
+    self.assertTrue(np.all(x[indices] == array[indices]))
+    self.assertTrue(
+        np.all(x[array[:, 0, 0] > 0.5] == array[array[:, 0, 0] > 0.5]))
+    self.assertTrue(np.all(np.asarray(x) == array))
+    self.assertRaises(IndexError, lambda: x[array.shape[0]])
+    # pickling
+    y = pickle.loads(pickle.dumps(x))
+    self.assertTrue(np.all(y[100:200] == array[100:200]))
+    x.close()
+    y.close()
+    self.assertEqual(_n_pooled(path), 0)
+    shutil.rmtree(path)
+
+  def test_pointer_shards(self):
+    path = mkdtemp()
+    data = {}
+    for shard in range(4):
+      arrays = {
+          'name%d' % (shard * 10 + i):
+              np.random.rand(np.random.randint(1, 5), 2) for i in range(10)
+      }
+      data.update(arrays)
+      with ShardedMmapArray.writer(path,
+                                   shard,
+                                   shape=(0, 2),
+                                   dtype='float64',
+                                   pointer=True) as f:
+        f.write(arrays)
+    x = ShardedMmapArray(path)
+    self.assertEqual(len(x.indices), 40)
+    self.assertTrue(all(np.all(x[name] == dat) for name, dat in data.items()))
+    keys = ['name%d' % i for i in np.random.permutation(40)[:16]]
+    batch, lengths = x.gather(keys, padding=True)
+    for i, k in enumerate(keys):
+      self.assertTrue(np.all(batch[i, :lengths[i]] == data[k]))
+    self.assertRaises(KeyError, lambda: x['unknown'])
+    # a plain shard with reserved capacity has no indices
+    with ShardedMmapArray.writer(path,
+                                 4,
+                                 shape=(0, 2),
+                                 dtype='float64',
+                                 growth_factor=2.) as f:
+      f.write(np.ones((3, 2)))
+      f.write(np.ones((1, 2)))
+      f.flush()
+      x = ShardedMmapArray(path)
+      self.assertTrue(f.capacity > f.shape[0])
+      self.assertEqual(x._is_pointer, [True] * 4 + [False])
+      self.assertEqual(len(x.indices), 40)
+      self.assertTrue(np.all(x[-4:] == 1))
+    shutil.rmtree(path)
+
+
+# ===========================================================================
+# Main
+# ===========================================================================
+if __name__ == '__main__':
+  unittest.main()